@@ -943,6 +943,67 @@ print(current_df.describe())
 # ## ส่วนที่ 3: สร้าง Feature Drift Detector Class
 #
 # เราจะสร้าง class ที่รวมทุก drift detection methods เพื่อใช้งานได้สะดวก
+#
+# ### Batched PSI
+# แทนที่จะคำนวณ PSI ทีละ feature เราจัดข้อมูลเป็น matrix (features × samples)
+# แล้วคำนวณทุก feature ในครั้งเดียว:
+# 1. bin edges ต่อ feature (เติม `np.inf` ท้าย row ที่มี edges ซ้ำ/น้อยกว่า)
+# 2. หา bin index ด้วยการเปรียบเทียบกับ interior edges ทีละคอลัมน์ (vectorized ทั้ง matrix)
+# 3. บวก offset `feature_index * n_bins` แล้วใช้ `np.bincount` ครั้งเดียวนับทุก feature
+
+# %%
+def batched_bin_edges(reference, bins=10):
+    """
+    Percentile bin edges ของทุก feature (rows) ของ reference matrix
+
+    Returns:
+    --------
+    np.ndarray : (n_features, bins + 1) edges ที่ไม่ซ้ำอยู่ต้น row ที่เหลือเป็น np.inf
+    """
+    edges = np.percentile(reference, np.linspace(0, 100, bins + 1), axis=1).T
+    
+    # เหมือน np.unique ต่อ row: เก็บ edge แรกของแต่ละค่า แล้วย้ายไปต้น row
+    keep = np.ones(edges.shape, dtype=bool)
+    keep[:, 1:] = edges[:, 1:] != edges[:, :-1]
+    order = np.argsort(~keep, axis=1, kind='stable')
+    edges = np.take_along_axis(edges, order, axis=1)
+    edges[~np.take_along_axis(keep, order, axis=1)] = np.inf
+    return edges
+
+def batched_histogram(matrix, bin_edges):
+    """
+    Histogram ของทุก row ในครั้งเดียว (semantics เดียวกับ np.histogram)
+
+    Returns:
+    --------
+    np.ndarray : (n_features, n_bins) counts
+    """
+    n_features, n_bins = bin_edges.shape[0], bin_edges.shape[1] - 1
+    n_edges = np.isfinite(bin_edges).sum(axis=1)
+    rows = np.arange(n_features)
+    
+    # bin index = จำนวน interior edges ที่ <= ค่า (bin สุดท้ายรวมขอบขวา)
+    idx = np.zeros(matrix.shape, dtype=np.intp)
+    for j in range(1, n_bins):
+        idx += matrix >= bin_edges[:, j:j + 1]
+    idx = np.minimum(idx, (n_edges - 2)[:, None])
+    
+    first_edge = bin_edges[:, :1]
+    last_edge = bin_edges[rows, np.maximum(n_edges - 1, 0)][:, None]
+    valid = (matrix >= first_edge) & (matrix <= last_edge) & (n_edges >= 2)[:, None]
+    
+    flat = (idx + rows[:, None] * n_bins)[valid]
+    return np.bincount(flat, minlength=n_features * n_bins).reshape(n_features, n_bins)
+
+def batched_psi(reference, current, bin_edges, eps=1e-6):
+    """
+    PSI ของทุก feature: reference (features × n_ref), current (features × n_cur)
+
+    bin ที่เป็น padding มี proportion = eps ทั้งสองฝั่งจึงไม่มีผลต่อ PSI
+    """
+    ref_props = batched_histogram(reference, bin_edges) / reference.shape[1] + eps
+    cur_props = batched_histogram(current, bin_edges) / current.shape[1] + eps
+    return np.sum((cur_props - ref_props) * np.log(cur_props / ref_props), axis=1)
 
 # %%
 class FeatureDriftDetector:
@@ -1010,6 +1071,13 @@ class FeatureDriftDetector:
         
         return {'psi': psi}
     
+    def calculate_psi_batch(self, features, bins=10):
+        """PSI ของหลาย numerical features ในครั้งเดียวด้วย batched_psi"""
+        ref_matrix = self.reference[features].to_numpy(dtype=float).T
+        cur_matrix = self.current[features].to_numpy(dtype=float).T
+        psi_values = batched_psi(ref_matrix, cur_matrix, batched_bin_edges(ref_matrix, bins))
+        return dict(zip(features, psi_values))
+    
     def wasserstein_test(self, feature):
         """Wasserstein Distance"""
         ref_data = self.reference[feature].dropna()
@@ -1047,13 +1115,13 @@ class FeatureDriftDetector:
         
         return {'statistic': stat, 'p_value': p_value}
     
-    def analyze_numerical_feature(self, feature):
-        """วิเคราะห์ drift สำหรับ numerical feature"""
+    def analyze_numerical_feature(self, feature, psi=None):
+        """วิเคราะห์ drift สำหรับ numerical feature (ส่ง psi มาได้ถ้าคำนวณไว้แล้ว)"""
         results = {
             'feature': feature,
             'type': 'numerical',
             'ks_test': self.ks_test(feature),
-            'psi': self.calculate_psi(feature),
+            'psi': self.calculate_psi(feature) if psi is None else {'psi': psi},
             'wasserstein': self.wasserstein_test(feature)
         }
         
@@ -1115,9 +1183,16 @@ class FeatureDriftDetector:
         """วิเคราะห์ drift สำหรับทุก features"""
         all_results = {}
         
-        # Numerical features
-        for feature in self.numerical_features:
-            all_results[feature] = self.analyze_numerical_feature(feature)
+        # Numerical features: ใช้ batched PSI ได้เมื่อไม่มี missing values
+        # (ถ้ามีต้อง dropna ทีละ feature -> ขนาดไม่เท่ากัน ใช้ calculate_psi ปกติ)
+        features = self.numerical_features
+        psi_values = {}
+        if features and not (self.reference[features].isna().any().any()
+                             or self.current[features].isna().any().any()):
+            psi_values = self.calculate_psi_batch(features)
+        
+        for feature in features:
+            all_results[feature] = self.analyze_numerical_feature(feature, psi_values.get(feature))
         
         # Categorical features
         for feature in self.categorical_features:
@@ -2133,8 +2208,12 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from scipy import stats
+from scipy.signal import lfilter
+from numpy.lib.stride_tricks import sliding_window_view
 from collections import deque
 from datetime import datetime, timedelta
+import bisect
+import time
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -2282,8 +2361,156 @@ plt.show()
 # ## ส่วนที่ 3: Sliding Window Drift Detector
 #
 # Implement sliding window สำหรับ real-time drift detection
+#
+# **`update_many(values, timestamps)`**: detectors ทุกตัวรับ chunk เป็น NumPy array ได้ในครั้งเดียว
+# - ผลลัพธ์, history และ drift points เหมือนเรียก `update()` ทีละค่าทุกประการ
+# - history เก็บเป็น column chunks (`DetectorHistory`) ไม่สร้าง dict ต่อ sample
+# - KS/PSI ของทุก window คำนวณจาก ranks/bins ของค่าใน stream ด้วย prefix sums ไม่ sort ต่อ window
+#
+# **`incremental=True`, `stride`**: โหมดสำหรับ `update()` ทีละ event (ดูส่วนที่ 8)
+# - bin edges ของ reference ถูก freeze ตอน initialize, test window เป็น NumPy ring buffer
+# - bin counts ปรับตอน insert/evict -> PSI O(bins) ต่อ event แทน O(window)
+# - `stride=k` ประเมินทุก k samples, `ks_threshold=None` ใช้ PSI อย่างเดียว
 
 # %%
+class DetectorHistory:
+    """
+    History ของ streaming detector
+    
+    update() เพิ่มทีละ dict, update_many() เพิ่มเป็น columns (dict ของ arrays) ทั้ง chunk
+    to_frame() สร้าง DataFrame จากทั้งสองแบบตามลำดับที่เพิ่ม (สร้างเมื่อเรียกเท่านั้น)
+    """
+    
+    def __init__(self):
+        self._chunks = []  # list ของ rows (list of dict) หรือ columns (dict of arrays)
+        self._length = 0
+    
+    def append(self, row):
+        if not self._chunks or not isinstance(self._chunks[-1], list):
+            self._chunks.append([])
+        self._chunks[-1].append(row)
+        self._length += 1
+    
+    def extend(self, columns):
+        """เพิ่ม results หลายแถวจาก dict ของ arrays แล้วคืน columns เดิม"""
+        n = len(next(iter(columns.values()), ()))
+        if n:
+            self._chunks.append(columns)
+            self._length += n
+        return columns
+    
+    def __len__(self):
+        return self._length
+    
+    def to_frame(self):
+        if not self._chunks:
+            return pd.DataFrame()
+        frames = [pd.DataFrame(chunk) for chunk in self._chunks]
+        if len(frames) == 1:
+            return frames[0]
+        # infer dtypes ใหม่หลังรวม: dtype ไม่ขึ้นกับการแบ่ง chunk (เช่น column ที่เป็น None ทั้ง chunk)
+        return pd.concat(frames, ignore_index=True).infer_objects()
+
+
+def as_timestamps(timestamps, n):
+    """timestamps ของ chunk เป็น array (None -> None ทุกแถว เหมือน update(value))"""
+    if timestamps is None:
+        return np.full(n, None, dtype=object)
+    return np.asarray(timestamps)
+
+
+def ring_running_sums(prior_sum, deltas, wraps, resync, size):
+    """
+    ผลรวมของ ring buffer หลังแต่ละ insert: บวก deltas ทีละค่า และแทนด้วยค่า resync
+    ที่ตำแหน่ง wraps (ห่างกัน size) -> ลำดับการบวกเดียวกับการ insert ทีละค่า
+    """
+    sums = np.empty(len(deltas))
+    head = wraps[0] if len(wraps) else len(deltas)
+    sums[:head] = np.cumsum(np.concatenate(([prior_sum], deltas[:head])))[1:]
+    if len(wraps):
+        tail = deltas[head:]
+        grid = np.zeros(len(wraps) * size)
+        grid[:len(tail)] = tail
+        grid = grid.reshape(len(wraps), size)
+        grid[:, 0] = resync
+        sums[head:] = np.cumsum(grid, axis=1).ravel()[:len(tail)]
+    return sums
+
+
+def concat_columns(pieces):
+    """รวม list ของ dict-of-arrays เป็น dict เดียว"""
+    if not pieces:
+        return {}
+    return {key: np.concatenate([piece[key] for piece in pieces]) for key in pieces[0]}
+
+
+def window_bin_counts(bin_idx, n_bins, window):
+    """
+    จำนวนค่าในแต่ละ bin ของทุก window ต่อเนื่องยาว window (prefix sums)
+    
+    bin_idx < 0 = ค่าที่ไม่ถูกนับ (เช่นค่านอกช่วงของ np.histogram)
+    """
+    valid = bin_idx >= 0
+    onehot = np.zeros((len(bin_idx) + 1, n_bins), dtype=np.int32)
+    onehot[np.flatnonzero(valid) + 1, bin_idx[valid]] = 1
+    prefix = np.cumsum(onehot, axis=0)
+    return prefix[window:] - prefix[:-window]
+
+
+def psi_rows(ref_props, test_counts, n_test):
+    """PSI ของทุกแถวใน test_counts (สูตรเดียวกับ calculate_psi)"""
+    eps = 1e-6
+    test_props = test_counts / n_test + eps
+    return np.sum((test_props - ref_props) * np.log(test_props / ref_props), axis=1)
+
+
+def histogram_psi_many(reference, stream, window, bins=10):
+    """calculate_psi(reference, w) ของทุก window ใน stream: bins จาก reference คำนวณครั้งเดียว"""
+    breakpoints = np.unique(np.percentile(reference, np.linspace(0, 100, bins + 1)))
+    ref_counts, _ = np.histogram(reference, bins=breakpoints)
+    ref_props = ref_counts / len(reference) + 1e-6
+    n_bins = len(breakpoints) - 1
+    
+    # เหมือน np.histogram: bin สุดท้ายปิดขวา ค่านอกช่วงไม่ถูกนับ
+    bin_idx = np.searchsorted(breakpoints, stream, side='right') - 1
+    bin_idx[stream == breakpoints[-1]] = n_bins - 1
+    bin_idx[bin_idx >= n_bins] = -1
+    return psi_rows(ref_props, window_bin_counts(bin_idx, n_bins, window), window)
+
+
+def ks_2samp_many(reference, stream, window, cache, step=1):
+    """
+    stats.ks_2samp(reference, w) ของทุก step windows ใน stream (window แรกเริ่มที่ stream[0])
+    
+    ECDF ของ reference คงที่ -> แทนแต่ละค่าด้วย rank เทียบ reference แล้ว sort ranks ต่อ window
+    D * n1 * n2 เป็นจำนวนเต็ม หาได้จาก max/min ของ (rank * n2 - j * n1) ตามลำดับใน window
+    สถิติและ p-value (exact mode ของ scipy) ขึ้นกับ (n1, n2, D) เท่านั้น
+    จึง cache ไว้และเรียก scipy เฉพาะ D ที่ยังไม่เคยเห็น
+    """
+    ref = np.sort(reference)
+    n1 = len(ref)
+    left = np.searchsorted(ref, stream, side='left').astype(np.int32)
+    right = np.searchsorted(ref, stream, side='right').astype(np.int32)
+    steps = np.arange(window, dtype=np.int32) * n1
+    
+    # ranks เรียงต่อ window (ถ้าไม่มีค่าซ้ำกับ reference ranks ทั้งสองแบบเท่ากัน sort ครั้งเดียวพอ)
+    lower = np.sort(sliding_window_view(left, window)[::step], axis=1)
+    upper = lower.copy() if np.array_equal(left, right) else np.sort(sliding_window_view(right, window)[::step], axis=1)
+    lower *= window
+    lower -= steps
+    upper *= window
+    upper -= steps + n1
+    d = np.maximum(np.maximum(lower.max(axis=1), 0), -upper.min(axis=1))
+    
+    keys, first, inverse = np.unique(d, return_index=True, return_inverse=True)
+    for key, i in zip(keys, first):
+        if (n1, window, key) not in cache:
+            result = stats.ks_2samp(reference, stream[i * step:i * step + window])
+            cache[(n1, window, key)] = (result.statistic, result.pvalue)
+    table = np.array([cache[(n1, window, key)] for key in keys])
+    return table[inverse, 0], table[inverse, 1]
+
+
 class SlidingWindowDriftDetector:
     """
     Drift detector ที่ใช้ sliding window approach
@@ -2294,28 +2521,37 @@ class SlidingWindowDriftDetector:
     - Memory-efficient processing
     """
     
+    block_size = 4096  # จำนวน windows ต่อ block ใน update_many (จำกัด memory ของ rank counts)
+    
     def __init__(self, reference_window_size=200, test_window_size=100, 
-                 ks_threshold=0.05, psi_threshold=0.1):
+                 ks_threshold=0.05, psi_threshold=0.1, incremental=False, stride=1):
         """
         Parameters:
         -----------
         reference_window_size : int - ขนาดของ reference window
         test_window_size : int - ขนาดของ test window
-        ks_threshold : float - threshold สำหรับ KS test p-value
+        ks_threshold : float - threshold สำหรับ KS test p-value (None = ใช้ PSI อย่างเดียว)
         psi_threshold : float - threshold สำหรับ PSI
+        incremental : bool - freeze bin edges ของ reference ตอน initialize และปรับ bin counts
+                      ของ test window ตอน insert/evict ใน ring buffer -> PSI O(bins) ต่อ event
+        stride : int - ประเมิน drift ทุก stride samples (นับจาก sample ที่ test window เต็มครั้งแรก)
         """
         self.reference_window_size = reference_window_size
         self.test_window_size = test_window_size
         self.ks_threshold = ks_threshold
         self.psi_threshold = psi_threshold
+        self.incremental = incremental
+        self.stride = stride
         
         # ใช้ deque สำหรับ efficient sliding window
         self.reference_buffer = deque(maxlen=reference_window_size)
         self.test_buffer = deque(maxlen=test_window_size)
         
-        self.history = []
+        self.history = DetectorHistory()
         self.drift_points = []
         self.is_initialized = False
+        self.full_window_count = 0  # จำนวน samples ที่ test window เต็มแล้ว (ใช้กับ stride)
+        self._ks_cache = {}
     
     def calculate_psi(self, reference, test, bins=10):
         """คำนวณ PSI"""
@@ -2332,6 +2568,122 @@ class SlidingWindowDriftDetector:
         psi = np.sum((test_props - ref_props) * np.log(test_props / ref_props))
         return psi
     
+    def _freeze_reference(self, bins=10):
+        """
+        Incremental mode: bin edges จาก percentiles ของ reference คงที่จนกว่าจะ reset_reference
+        bin แรก/สุดท้ายเปิดปลาย (เหมือน DecayedHistogram) ค่าที่อยู่นอกช่วงเดิมจึงยังถูกนับ
+        """
+        reference = np.array(self.reference_buffer)
+        edges = np.unique(np.percentile(reference, np.linspace(0, 100, bins + 1)))
+        self._inner_edges = edges[1:-1]
+        self._edge_list = self._inner_edges.tolist()
+        n_bins = len(self._inner_edges) + 1
+        ref_counts = np.bincount(np.searchsorted(self._inner_edges, reference, side='right'), minlength=n_bins)
+        self._ref_array = reference
+        self._ref_props = ref_counts / len(reference) + 1e-6
+        self._ref_mean = np.mean(reference)
+        
+        # ring buffer ของ test window: ค่า, bin ของแต่ละค่า, counts ต่อ bin และผลรวม
+        self._ring_values = np.zeros(self.test_window_size)
+        self._ring_bins = np.zeros(self.test_window_size, dtype=np.int64)
+        self._bin_counts = np.zeros(n_bins, dtype=np.int64)
+        self._ring_head = 0
+        self._ring_size = 0
+        self._ring_sum = 0.0
+        
+        # KS: reference เรียงครั้งเดียว, rank (left/right) ของแต่ละค่าใน ring และ ranks ที่เรียงแล้วของ test window
+        self._ref_sorted = np.sort(reference)
+        self._ref_list = self._ref_sorted.tolist()
+        self._ring_left = np.zeros(self.test_window_size, dtype=np.int64)
+        self._ring_right = np.zeros(self.test_window_size, dtype=np.int64)
+        self._sorted_left = []
+        self._sorted_right = []
+        self._ks_steps = np.arange(self.test_window_size) * len(reference)
+    
+    def _window_values(self):
+        """ค่าใน test window เรียงตามเวลา"""
+        if not self.incremental:
+            return np.array(self.test_buffer, dtype=float)
+        if self._ring_size < self.test_window_size:
+            return self._ring_values[:self._ring_size].copy()
+        return np.concatenate([self._ring_values[self._ring_head:], self._ring_values[:self._ring_head]])
+    
+    def _insert(self, value):
+        """ใส่ค่าลง ring buffer: O(1) ปรับ counts ของ bin ที่เข้า/ออก"""
+        head = self._ring_head
+        bin_idx = bisect.bisect_right(self._edge_list, value)
+        track_ranks = self.ks_threshold is not None
+        if self._ring_size == self.test_window_size:
+            self._bin_counts[self._ring_bins[head]] -= 1
+            self._ring_sum += value - self._ring_values[head]
+            if track_ranks:
+                del self._sorted_left[bisect.bisect_left(self._sorted_left, self._ring_left[head])]
+                del self._sorted_right[bisect.bisect_left(self._sorted_right, self._ring_right[head])]
+        else:
+            self._ring_size += 1
+            self._ring_sum += value
+        self._ring_values[head] = value
+        self._ring_bins[head] = bin_idx
+        self._bin_counts[bin_idx] += 1
+        if track_ranks:
+            left = bisect.bisect_left(self._ref_list, value)
+            right = bisect.bisect_right(self._ref_list, value)
+            self._ring_left[head] = left
+            self._ring_right[head] = right
+            bisect.insort(self._sorted_left, left)
+            bisect.insort(self._sorted_right, right)
+        self._ring_head = (head + 1) % self.test_window_size
+        if self._ring_head == 0:
+            # ring เรียงตามเวลาพอดี: คำนวณผลรวมใหม่ กัน floating-point error สะสม
+            self._ring_sum = self._ring_values.sum()
+    
+    def _insert_many(self, values):
+        """
+        ใส่ values ลง ring buffer (ผลเหมือน _insert ทีละค่า)
+        -> คืนผลรวมของ test window หลังแต่ละค่า
+        """
+        size = self.test_window_size
+        window = self._window_values()
+        combined = np.concatenate([window, values])
+        positions = len(window) + np.arange(len(values))
+        evicted = positions >= size
+        deltas = values.copy()
+        deltas[evicted] = values[evicted] - combined[positions[evicted] - size]
+        wraps = np.flatnonzero((self._ring_head + np.arange(1, len(values) + 1)) % size == 0)
+        resync = np.array([combined[end - size + 1:end + 1].sum() for end in positions[wraps]])
+        sums = ring_running_sums(self._ring_sum, deltas, wraps, resync, size)
+        
+        kept = min(len(values), size)
+        slots = (self._ring_head + np.arange(len(values) - kept, len(values))) % size
+        self._ring_values[slots] = values[-kept:]
+        self._ring_bins[slots] = np.searchsorted(self._inner_edges, values[-kept:], side='right')
+        self._ring_head = (self._ring_head + len(values)) % size
+        self._ring_size = min(size, self._ring_size + len(values))
+        self._bin_counts = np.bincount(self._ring_bins[:self._ring_size], minlength=len(self._bin_counts))
+        self._ring_sum = sums[-1]
+        if self.ks_threshold is not None:
+            self._ring_left[slots] = np.searchsorted(self._ref_sorted, values[-kept:], side='left')
+            self._ring_right[slots] = np.searchsorted(self._ref_sorted, values[-kept:], side='right')
+            self._sorted_left = sorted(self._ring_left[:self._ring_size].tolist())
+            self._sorted_right = sorted(self._ring_right[:self._ring_size].tolist())
+        return sums
+    
+    def _ks_incremental(self):
+        """
+        stats.ks_2samp(reference, test window) จาก ranks ที่เรียงไว้แล้ว: O(window) ต่อการประเมิน
+        
+        D * n1 * n2 แบบเดียวกับ ks_2samp_many แล้วใช้ cache (n1, n2, D) ร่วมกับ update_many
+        เรียก scipy เฉพาะ D ที่ยังไม่เคยเห็น
+        """
+        n1, n2 = len(self._ref_list), self.test_window_size
+        lower = np.array(self._sorted_left) * n2 - self._ks_steps
+        upper = np.array(self._sorted_right) * n2 - self._ks_steps - n1
+        key = (n1, n2, max(int(lower.max()), 0, -int(upper.min())))
+        if key not in self._ks_cache:
+            result = stats.ks_2samp(self._ref_array, self._ring_values)
+            self._ks_cache[key] = (result.statistic, result.pvalue)
+        return self._ks_cache[key]
+    
     def update(self, value, timestamp=None):
         """
         Update detector ด้วยค่าใหม่
@@ -2345,26 +2697,51 @@ class SlidingWindowDriftDetector:
             self.reference_buffer.append(value)
             if len(self.reference_buffer) >= self.reference_window_size:
                 self.is_initialized = True
+                if self.incremental:
+                    self._freeze_reference()
             return {'drift_detected': False, 'status': 'initializing'}
         
-        self.test_buffer.append(value)
+        if self.incremental:
+            self._insert(value)
+            n_buffered = self._ring_size
+        else:
+            self.test_buffer.append(value)
+            n_buffered = len(self.test_buffer)
         
         # รอจนมีข้อมูลพอใน test buffer
-        if len(self.test_buffer) < self.test_window_size:
+        if n_buffered < self.test_window_size:
             return {'drift_detected': False, 'status': 'collecting'}
         
-        # ทำ drift detection
-        ref_array = np.array(self.reference_buffer)
-        test_array = np.array(self.test_buffer)
-        
-        # KS Test
-        ks_stat, ks_pval = stats.ks_2samp(ref_array, test_array)
+        # ประเมินทุก stride samples
+        self.full_window_count += 1
+        if (self.full_window_count - 1) % self.stride:
+            return {'drift_detected': False, 'status': 'skipped'}
         
-        # PSI
-        psi = self.calculate_psi(ref_array, test_array)
+        # ทำ drift detection
+        if self.incremental:
+            # PSI จาก bin counts ที่มีอยู่แล้ว: O(bins)
+            eps = 1e-6
+            test_props = self._bin_counts / self.test_window_size + eps
+            psi = np.sum((test_props - self._ref_props) * np.log(test_props / self._ref_props))
+            ref_mean = self._ref_mean
+            test_mean = self._ring_sum / self.test_window_size
+        else:
+            ref_array = np.array(self.reference_buffer)
+            test_array = np.array(self.test_buffer)
+            psi = self.calculate_psi(ref_array, test_array)
+            ref_mean = np.mean(ref_array)
+            test_mean = np.mean(test_array)
+        
+        # KS Test (ks_threshold=None -> ข้าม)
+        if self.ks_threshold is None:
+            ks_stat, ks_pval = np.nan, np.nan
+        elif self.incremental:
+            ks_stat, ks_pval = self._ks_incremental()
+        else:
+            ks_stat, ks_pval = stats.ks_2samp(ref_array, test_array)
         
         # Detection logic
-        ks_drift = ks_pval < self.ks_threshold
+        ks_drift = self.ks_threshold is not None and ks_pval < self.ks_threshold
         psi_drift = psi > self.psi_threshold
         drift_detected = ks_drift or psi_drift
         
@@ -2374,8 +2751,8 @@ class SlidingWindowDriftDetector:
             'ks_statistic': ks_stat,
             'ks_pvalue': ks_pval,
             'psi': psi,
-            'ref_mean': np.mean(ref_array),
-            'test_mean': np.mean(test_array),
+            'ref_mean': ref_mean,
+            'test_mean': test_mean,
             'status': 'DRIFT' if drift_detected else 'normal'
         }
         
@@ -2386,17 +2763,101 @@ class SlidingWindowDriftDetector:
         
         return result
     
+    def update_many(self, values, timestamps=None):
+        """
+        Update detector ด้วย chunk ของค่า (NumPy array) ในครั้งเดียว
+        
+        ผลลัพธ์, history และ drift_points เหมือนเรียก update() ทีละค่า
+        แต่ KS/PSI/mean ของทุก window ที่ถูกประเมินใน chunk คำนวณแบบ vectorized
+        
+        Returns:
+        --------
+        dict : columns (NumPy arrays) ของ results ของ samples ที่ถูกประเมิน (keys เดียวกับ history)
+        """
+        values = np.asarray(values, dtype=float)
+        timestamps = as_timestamps(timestamps, len(values))
+        
+        start = 0
+        if not self.is_initialized:
+            start = min(len(values), self.reference_window_size - len(self.reference_buffer))
+            self.reference_buffer.extend(values[:start])
+            if len(self.reference_buffer) >= self.reference_window_size:
+                self.is_initialized = True
+                if self.incremental:
+                    self._freeze_reference()
+        incoming = values[start:]
+        if not len(incoming):
+            return {}
+        
+        # sample แรกที่ window เต็ม แล้วเลือกทุก stride windows
+        window = self.test_window_size
+        buffered = self._window_values()
+        first = max(len(buffered), window - 1)
+        stream = np.concatenate([buffered, incoming])[first - window + 1:]
+        timestamps = timestamps[start + first - len(buffered):]
+        n_windows = max(len(stream) - window + 1, 0)
+        evaluated = np.arange((-self.full_window_count) % self.stride, n_windows, self.stride)
+        self.full_window_count += n_windows
+        
+        if self.incremental:
+            ring_sums = self._insert_many(incoming)[first - len(buffered):]
+            ref_array, ref_mean = self._ref_array, self._ref_mean
+        else:
+            self.test_buffer.extend(incoming)
+            ref_array = np.array(self.reference_buffer)
+            ref_mean = np.mean(ref_array)
+        
+        pieces = []
+        for b in range(0, len(evaluated), self.block_size):
+            rows = evaluated[b:b + self.block_size]
+            block = stream[rows[0]:rows[-1] + window]
+            if self.ks_threshold is not None:
+                ks_stat, ks_pval = ks_2samp_many(ref_array, block, window, self._ks_cache, step=self.stride)
+                ks_drift = ks_pval < self.ks_threshold
+            else:
+                ks_stat = ks_pval = np.full(len(rows), np.nan)
+                ks_drift = np.zeros(len(rows), dtype=bool)
+            if self.incremental:
+                bin_idx = np.searchsorted(self._inner_edges, block, side='right')
+                counts = window_bin_counts(bin_idx, len(self._bin_counts), window)[::self.stride]
+                psi = psi_rows(self._ref_props, counts, window)
+                test_mean = ring_sums[rows] / window
+            else:
+                psi = histogram_psi_many(ref_array, block, window)[::self.stride]
+                test_mean = np.mean(sliding_window_view(block, window)[::self.stride], axis=1)
+            drift_detected = ks_drift | (psi > self.psi_threshold)
+            pieces.append({
+                'timestamp': timestamps[rows],
+                'drift_detected': drift_detected,
+                'ks_statistic': ks_stat,
+                'ks_pvalue': ks_pval,
+                'psi': psi,
+                'ref_mean': np.full(len(rows), ref_mean),
+                'test_mean': test_mean,
+                'status': np.where(drift_detected, 'DRIFT', 'normal')
+            })
+        
+        offset = len(self.history)
+        results = self.history.extend(concat_columns(pieces))
+        if results:
+            self.drift_points.extend((offset + np.flatnonzero(results['drift_detected'])).tolist())
+        return results
+    
     def reset_reference(self):
         """Reset reference window ด้วย test window ปัจจุบัน"""
+        current = self._window_values()
         self.reference_buffer.clear()
-        for val in self.test_buffer:
+        for val in current:
             self.reference_buffer.append(val)
         self.test_buffer.clear()
+        self.full_window_count = 0
+        if self.incremental:
+            self._freeze_reference()
         print("📋 Reference window reset with current data")
     
     def get_history_df(self):
         """แปลง history เป็น DataFrame"""
-        return pd.DataFrame(self.history)
+        return self.history.to_frame()
 
 # %%
 # ทดสอบ SlidingWindowDriftDetector กับ sudden drift
@@ -2537,8 +2998,56 @@ print("   - Gradual drift: ใช้เวลานานกว่าจะ dete
 # ## ส่วนที่ 5: Adaptive Reference Window
 #
 # ปรับ reference window เพื่อ handle gradual drift
+#
+# **Decayed histogram reference** (`half_life`): แทนที่จะผสม reference เก่า/ใหม่แบบ 50/50
+# (copy ข้อมูลและทำให้ reference เปลี่ยนแบบขั้นบันได) เราเก็บ reference เป็น histogram
+# ที่ bin edges คงที่ และน้ำหนักทุก bin ลดลงครึ่งหนึ่งทุก `half_life` samples
+# - update = คูณน้ำหนักด้วย decay factor แล้วบวก counts ใหม่ -> O(bins) ไม่ copy array
+# - half_life สั้น = ตาม data ใหม่เร็ว, ยาว = reference นิ่ง
 
 # %%
+class DecayedHistogram:
+    """
+    Reference distribution แบบ histogram ที่น้ำหนักลดลงแบบ exponential
+    
+    bin edges มาจาก percentiles ของ reference เริ่มต้นและคงที่ตลอด
+    bin แรก/สุดท้ายเปิดปลาย ค่าที่อยู่นอกช่วงเดิมจึงยังถูกนับ
+    """
+    
+    def __init__(self, reference, bins=10, half_life=500):
+        reference = np.asarray(reference, dtype=float)
+        edges = np.unique(np.percentile(reference, np.linspace(0, 100, bins + 1)))
+        self.inner_edges = edges[1:-1]
+        self.decay = 0.5 ** (1 / half_life)
+        self.weights = np.zeros(len(self.inner_edges) + 1)
+        self.weighted_sum = 0.0
+        self.total = 0.0
+        self.update(reference)
+    
+    def _counts(self, values):
+        idx = np.searchsorted(self.inner_edges, values, side='right')
+        return np.bincount(idx, minlength=len(self.weights))
+    
+    def update(self, values):
+        """ลดน้ำหนักเดิมตามจำนวน samples ใหม่ แล้วเพิ่ม counts ของ values"""
+        values = np.asarray(values, dtype=float)
+        factor = self.decay ** len(values)
+        self.weights *= factor
+        self.weights += self._counts(values)
+        self.weighted_sum = self.weighted_sum * factor + values.sum()
+        self.total = self.total * factor + len(values)
+    
+    @property
+    def mean(self):
+        return self.weighted_sum / self.total
+    
+    def psi(self, test):
+        """PSI ระหว่าง decayed reference กับ test window (bins เดียวกัน)"""
+        eps = 1e-6
+        ref_props = self.weights / self.total + eps
+        test_props = self._counts(test) / len(test) + eps
+        return np.sum((test_props - ref_props) * np.log(test_props / ref_props))
+
 class AdaptiveDriftDetector:
     """
     Drift detector ที่ปรับ reference window อัตโนมัติ
@@ -2549,24 +3058,29 @@ class AdaptiveDriftDetector:
     - Track both short-term และ long-term drift
     """
     
+    block_size = 4096  # จำนวน samples สูงสุดต่อรอบใน update_many
+    
     def __init__(self, reference_window_size=200, test_window_size=50,
-                 confirmation_window=3, psi_threshold=0.1):
+                 confirmation_window=3, psi_threshold=0.1, half_life=None):
         """
         Parameters:
         -----------
         confirmation_window : int - จำนวนครั้งติดต่อกันที่ต้อง detect ก่อนยืนยัน drift
+        half_life : int - ถ้ากำหนด ใช้ DecayedHistogram เป็น reference (half-life เป็นจำนวน samples)
         """
         self.reference_window_size = reference_window_size
         self.test_window_size = test_window_size
         self.confirmation_window = confirmation_window
         self.psi_threshold = psi_threshold
+        self.half_life = half_life
         
         self.reference_buffer = deque(maxlen=reference_window_size)
+        self.reference_hist = None
         self.test_buffer = deque(maxlen=test_window_size)
         
         self.consecutive_drift_count = 0
         self.confirmed_drifts = []
-        self.history = []
+        self.history = DetectorHistory()
         self.adaptation_count = 0
     
     def calculate_psi(self, reference, test, bins=10):
@@ -2586,6 +3100,13 @@ class AdaptiveDriftDetector:
     
     def adapt_reference(self):
         """ปรับ reference window"""
+        if self.reference_hist is not None:
+            # decayed mode: reference เดิมลดน้ำหนักลงตาม half-life (O(bins) ไม่ copy)
+            self.reference_hist.update(self.test_buffer)
+            self.adaptation_count += 1
+            self.consecutive_drift_count = 0
+            return
+        
         # ผสม old reference กับ new data
         old_weight = 0.5
         old_ref = list(self.reference_buffer)
@@ -2619,10 +3140,16 @@ class AdaptiveDriftDetector:
             return {'status': 'collecting', 'drift_detected': False}
         
         # Drift detection
-        ref_array = np.array(self.reference_buffer)
         test_array = np.array(self.test_buffer)
-        
-        psi = self.calculate_psi(ref_array, test_array)
+        if self.half_life is not None:
+            if self.reference_hist is None:
+                self.reference_hist = DecayedHistogram(self.reference_buffer, half_life=self.half_life)
+            psi = self.reference_hist.psi(test_array)
+            ref_mean = self.reference_hist.mean
+        else:
+            ref_array = np.array(self.reference_buffer)
+            psi = self.calculate_psi(ref_array, test_array)
+            ref_mean = np.mean(ref_array)
         potential_drift = psi > self.psi_threshold
         
         if potential_drift:
@@ -2640,7 +3167,7 @@ class AdaptiveDriftDetector:
             'confirmed_drift': confirmed,
             'consecutive_count': self.consecutive_drift_count,
             'adaptation_count': self.adaptation_count,
-            'ref_mean': np.mean(ref_array),
+            'ref_mean': ref_mean,
             'test_mean': np.mean(test_array)
         }
         
@@ -2654,8 +3181,105 @@ class AdaptiveDriftDetector:
         
         return result
     
+    def _psi_many(self, stream):
+        """PSI และ ref mean ของทุก window ใน stream เทียบ reference ปัจจุบัน"""
+        window = self.test_window_size
+        if self.half_life is not None:
+            if self.reference_hist is None:
+                self.reference_hist = DecayedHistogram(self.reference_buffer, half_life=self.half_life)
+            hist = self.reference_hist
+            bin_idx = np.searchsorted(hist.inner_edges, stream, side='right')
+            counts = window_bin_counts(bin_idx, len(hist.weights), window)
+            return psi_rows(hist.weights / hist.total + 1e-6, counts, window), hist.mean
+        ref_array = np.array(self.reference_buffer)
+        return histogram_psi_many(ref_array, stream, window), np.mean(ref_array)
+    
+    def update_many(self, values, timestamps=None):
+        """
+        Update detector ด้วย chunk ของค่า (NumPy array) ในครั้งเดียว
+        
+        ระหว่าง adaptations reference คงที่ จึงคำนวณ PSI ของทุก window แบบ vectorized
+        แล้วหยุดที่ sample ที่ยืนยัน drift -> adapt -> ทำต่อด้วย reference ใหม่
+        (ช่วงที่ adapt ถี่ ต้นทุนจะเข้าใกล้ update() ทีละค่า เพราะ reference เปลี่ยนทุกไม่กี่ samples)
+        ผลลัพธ์เหมือนเรียก update() ทีละค่า
+        
+        Returns:
+        --------
+        dict : columns (NumPy arrays) ของ results ของ samples ที่ถูกประเมิน (keys เดียวกับ history)
+        """
+        values = np.asarray(values, dtype=float)
+        timestamps = as_timestamps(timestamps, len(values))
+        window = self.test_window_size
+        pieces = []
+        n_rows = len(self.history)
+        pos = 0
+        span = 64  # ขยาย x2 เมื่อไม่มี adaptation (adapt ถี่ก็ไม่ต้องคำนวณทั้ง block ซ้ำ)
+        
+        while pos < len(values):
+            missing = self.reference_window_size - len(self.reference_buffer)
+            if missing > 0:
+                # initializing (รวมถึงหลัง adapt แบบ 50/50 ที่ reference ยังไม่เต็ม)
+                taken = values[pos:pos + missing]
+                self.reference_buffer.extend(taken)
+                pos += len(taken)
+                continue
+            
+            buffered = np.array(self.test_buffer, dtype=float)
+            chunk = values[pos:pos + span]
+            first = max(len(buffered), window - 1)
+            if len(buffered) + len(chunk) <= first:
+                # collecting: test buffer ยังไม่เต็ม
+                self.test_buffer.extend(chunk)
+                pos += len(chunk)
+                continue
+            
+            stream = np.concatenate([buffered, chunk])[first - window + 1:]
+            psi, ref_mean = self._psi_many(stream)
+            potential = psi > self.psi_threshold
+            
+            # consecutive_drift_count หลังแต่ละ sample (ต่อจากค่าก่อน chunk)
+            steps = np.arange(1, len(psi) + 1)
+            last_reset = np.maximum.accumulate(np.where(potential, 0, steps))
+            consecutive = steps - last_reset + np.where(last_reset == 0, self.consecutive_drift_count, 0)
+            confirmed = consecutive >= self.confirmation_window
+            hits = np.flatnonzero(confirmed)
+            n_evaluated = hits[0] + 1 if len(hits) else len(psi)
+            consumed = first - len(buffered) + n_evaluated
+            
+            adapted = np.full(n_evaluated, np.nan, dtype=object)
+            if len(hits):
+                adapted[-1] = True
+            skipped = pos + first - len(buffered)
+            pieces.append({
+                'timestamp': timestamps[skipped:skipped + n_evaluated],
+                'psi': psi[:n_evaluated],
+                'potential_drift': potential[:n_evaluated],
+                'confirmed_drift': confirmed[:n_evaluated],
+                'consecutive_count': consecutive[:n_evaluated],
+                'adaptation_count': np.full(n_evaluated, self.adaptation_count),
+                'ref_mean': np.full(n_evaluated, ref_mean),
+                'test_mean': np.mean(sliding_window_view(stream[:n_evaluated + window - 1], window), axis=1),
+                'adapted': adapted
+            })
+            self.test_buffer.extend(chunk[:consumed])
+            self.consecutive_drift_count = int(consecutive[n_evaluated - 1])
+            n_rows += n_evaluated
+            pos += consumed
+            
+            if len(hits):
+                self.confirmed_drifts.append(n_rows - 1)
+                self.adapt_reference()
+                span = 64
+            else:
+                span = min(2 * span, self.block_size)
+        
+        columns = concat_columns(pieces)
+        if columns and not any(piece['confirmed_drift'][-1] for piece in pieces):
+            del columns['adapted']  # เหมือน update(): มี column 'adapted' เฉพาะเมื่อเคย adapt
+        return self.history.extend(columns)
+    
     def get_history_df(self):
-        return pd.DataFrame(self.history)
+        return self.history.to_frame()
 
 # %%
 # ทดสอบ Adaptive Detector
@@ -2719,6 +3343,36 @@ plt.show()
 print("\n💡 Adaptive detector ปรับ reference window เมื่อ detect drift")
 print("   ทำให้สามารถติดตาม gradual drift ได้ต่อเนื่อง")
 
+# %%
+# เปรียบเทียบ 50/50 reference กับ decayed histogram reference หลาย half-life
+decay_comparison = {}
+for half_life in [None, 50, 200, 1000]:
+    detector = AdaptiveDriftDetector(
+        reference_window_size=200, test_window_size=50,
+        confirmation_window=3, psi_threshold=0.1, half_life=half_life
+    )
+    for value in gradual_stream['value']:
+        detector.update(value)
+    label = '50/50 mix' if half_life is None else f'half_life={half_life}'
+    decay_comparison[label] = detector.get_history_df()
+    print(f"{label:>15}: {detector.adaptation_count} adaptations, "
+          f"final ref mean={decay_comparison[label]['ref_mean'].iloc[-1]:.2f}")
+
+fig, ax = plt.subplots(figsize=(14, 5))
+for label, history in decay_comparison.items():
+    ax.plot(history.index + offset, history['ref_mean'], label=label)
+ax.plot(gradual_stream['index'], gradual_stream['value'].rolling(50).mean(), 'k--', alpha=0.5, label='Data (rolling mean)')
+ax.set_xlabel('Time Index')
+ax.set_ylabel('Reference Mean')
+ax.set_title('Reference Adaptation: 50/50 Mix vs Decayed Histogram')
+ax.legend()
+plt.tight_layout()
+plt.savefig('decayed_reference.png', dpi=150, bbox_inches='tight')
+plt.show()
+
+print("\n💡 Decayed reference ปรับตัวต่อเนื่องแทนการกระโดดแบบขั้นบันได")
+print("   และปรับความไวได้ด้วย half_life")
+
 # %% [markdown]
 # ## ส่วนที่ 6: Page-Hinkley Test for Change Detection
 #
@@ -2735,6 +3389,10 @@ class PageHinkleyDetector:
     - Low memory footprint
     """
     
+    block_size = 65536  # จำนวน samples ต่อ block ใน update_many
+    reset_lookahead = 32  # จำนวน samples หลัง reset ที่ _reset_table คำนวณล่วงหน้า
+    table_size = 1024  # จำนวนตำแหน่งเริ่มต้นต่อตาราง (เล็กพอให้อยู่ใน cache)
+    
     def __init__(self, delta=0.005, lambda_=50, alpha=0.9999):
         """
         Parameters:
@@ -2753,7 +3411,7 @@ class PageHinkleyDetector:
         self.max_sum = float('-inf')
         
         self.n_samples = 0
-        self.history = []
+        self.history = DetectorHistory()
         self.drift_points = []
     
     def update(self, value, timestamp=None):
@@ -2809,8 +3467,165 @@ class PageHinkleyDetector:
         self.min_sum = float('inf')
         self.max_sum = float('-inf')
     
+    def _means(self, values):
+        """
+        Estimated mean หลังแต่ละค่า: mean = alpha * mean + (1 - alpha) * value
+        คือ IIR filter อันดับ 1 -> lfilter ให้ลำดับการคำนวณเดียวกับ update()
+        """
+        means = np.empty(len(values))
+        head = 0
+        if self.n_samples == 0:
+            means[0] = values[0]
+            head = 1
+        previous = means[0] if head else self.mean
+        means[head:], _ = lfilter([1 - self.alpha], [1, -self.alpha], values[head:],
+                                  zi=[self.alpha * previous])
+        return means
+    
+    def _reset_table(self, increments, origin):
+        """
+        ค่าสะสม sum/min/max ถ้าเพิ่ง reset ก่อนตำแหน่ง origin .. origin + table_size - 1
+        (reset_lookahead samples แรก) และระยะถึง drift แรกจากแต่ละตำแหน่ง
+        
+        แถว k = ค่าหลัง k + 1 samples ของทุกตำแหน่งเริ่มต้น (บวกทีละ sample ลำดับเดียวกับ update())
+        """
+        n = min(self.table_size, len(increments) - origin)
+        padded = np.full(n + self.reset_lookahead - 1, np.nan)
+        available = increments[origin:origin + len(padded)]
+        padded[:len(available)] = available
+        
+        sums = np.empty((self.reset_lookahead, n))
+        min_sums = np.empty_like(sums)
+        max_sums = np.empty_like(sums)
+        sums[0] = min_sums[0] = max_sums[0] = padded[:n]
+        for k in range(1, self.reset_lookahead):
+            np.add(sums[k - 1], padded[k:k + n], out=sums[k])
+            np.minimum(min_sums[k - 1], sums[k], out=min_sums[k])
+            np.maximum(max_sums[k - 1], sums[k], out=max_sums[k])
+        drift = (sums - min_sums > self.lambda_) | (max_sums - sums > self.lambda_)
+        return {
+            'origin': origin, 'end': origin + n,
+            'sums': sums, 'min_sums': min_sums, 'max_sums': max_sums,
+            'found': drift.any(axis=0).tolist(), 'first': drift.argmax(axis=0).tolist(),
+            'segments': []
+        }
+    
+    @staticmethod
+    def _fill_from_table(table, sums, min_sums, max_sums):
+        """คัดลอกค่าสะสมของ segments (start, end) ที่เดินด้วยตารางลง arrays ของ block"""
+        if table is None or not table['segments']:
+            return
+        starts, ends = np.array(table['segments']).T
+        lengths = ends - starts
+        rows = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        columns = np.repeat(starts - table['origin'], lengths)
+        positions = columns + rows + table['origin']
+        sums[positions] = table['sums'][rows, columns]
+        min_sums[positions] = table['min_sums'][rows, columns]
+        max_sums[positions] = table['max_sums'][rows, columns]
+    
+    def _scan(self, increments, pos, sums, min_sums, max_sums):
+        """
+        สะสมต่อจาก state ปัจจุบันตั้งแต่ pos จนเจอ drift หรือหมด block
+        (มองล่วงหน้าทีละช่วงที่ขยาย x2) -> คืนตำแหน่งถัดไปและว่าเจอ drift หรือไม่
+        """
+        span = 2 * self.reset_lookahead
+        while pos < len(increments):
+            cumulative = np.cumsum(np.concatenate(([self.sum], increments[pos:pos + span])))[1:]
+            lows = np.minimum.accumulate(np.concatenate(([self.min_sum], cumulative)))[1:]
+            highs = np.maximum.accumulate(np.concatenate(([self.max_sum], cumulative)))[1:]
+            hits = np.flatnonzero((cumulative - lows > self.lambda_) | (highs - cumulative > self.lambda_))
+            n = hits[0] + 1 if len(hits) else len(cumulative)
+            sums[pos:pos + n] = cumulative[:n]
+            min_sums[pos:pos + n] = lows[:n]
+            max_sums[pos:pos + n] = highs[:n]
+            pos += n
+            if len(hits):
+                self.reset()
+                return pos, True
+            self.sum, self.min_sum, self.max_sum = cumulative[-1], lows[-1], highs[-1]
+            span *= 2
+        return pos, False
+    
+    def update_many(self, values, timestamps=None):
+        """
+        Update detector ด้วย chunk ของค่า (NumPy array) ในครั้งเดียว
+        
+        - mean: lfilter (mean ไม่ถูก reset จึงคำนวณทั้ง block ได้ในครั้งเดียว)
+        - cumulative sum, running min/max: np.cumsum / np.minimum.accumulate / np.maximum.accumulate
+        - หลัง drift ค่าสะสมถูก reset: ช่วงที่ drift ถี่ใช้ตาราง _reset_table
+          (ค่าสะสมจากทุกตำแหน่งเริ่มต้น) แล้วกระโดดจาก drift หนึ่งไปอีก drift ด้วย index
+        ผลลัพธ์เหมือนเรียก update() ทีละค่า
+        
+        Returns:
+        --------
+        dict : columns (NumPy arrays) ของ results ของทุก sample ใน chunk (keys เดียวกับ history)
+        """
+        values = np.asarray(values, dtype=float)
+        timestamps = as_timestamps(timestamps, len(values))
+        pieces = []
+        
+        for b in range(0, len(values), self.block_size):
+            x = values[b:b + self.block_size]
+            n = len(x)
+            means = self._means(x)
+            increments = x - means - self.delta
+            sums, min_sums, max_sums = np.empty(n), np.empty(n), np.empty(n)
+            table = None
+            detections = []
+            pos = 0
+            
+            while pos < n:
+                if self.min_sum == float('inf'):
+                    # เพิ่ง reset: กระโดดไป drift ถัดไปด้วยตาราง ตราบที่อยู่ภายใน reset_lookahead samples
+                    if table is None or pos >= table['end']:
+                        self._fill_from_table(table, sums, min_sums, max_sums)
+                        table = self._reset_table(increments, pos)
+                        origin, table_end = table['origin'], table['end']
+                        found, first, segments = table['found'], table['first'], table['segments']
+                    while pos < table_end and found[pos - origin]:
+                        start = pos
+                        pos += first[pos - origin] + 1
+                        segments.append((start, pos))
+                        detections.append(pos - 1)
+                    if table_end <= pos < n:
+                        continue
+                    if pos < n and pos + self.reset_lookahead >= n:
+                        # ท้าย block: ไม่มี drift แล้ว ค่าสะสมยังอยู่ในตาราง
+                        segments.append((pos, n))
+                        self.sum = table['sums'][n - pos - 1, pos - origin]
+                        self.min_sum = table['min_sums'][n - pos - 1, pos - origin]
+                        self.max_sum = table['max_sums'][n - pos - 1, pos - origin]
+                        pos = n
+                    if pos == n:
+                        break
+                pos, detected = self._scan(increments, pos, sums, min_sums, max_sums)
+                if detected:
+                    detections.append(pos - 1)
+            self._fill_from_table(table, sums, min_sums, max_sums)
+            
+            ph_positive = sums - min_sums
+            ph_negative = max_sums - sums
+            drift_up = ph_positive > self.lambda_
+            drift_down = ph_negative > self.lambda_
+            pieces.append({
+                'timestamp': timestamps[b:b + n],
+                'value': x,
+                'mean': means,
+                'sum': sums,
+                'ph_positive': ph_positive,
+                'ph_negative': ph_negative,
+                'drift_detected': drift_up | drift_down,
+                'drift_direction': np.where(drift_up, 'up', np.where(drift_down, 'down', None))
+            })
+            self.drift_points.extend((self.n_samples + np.array(detections, dtype=int)).tolist())
+            self.n_samples += n
+            self.mean = means[-1]
+        
+        return self.history.extend(concat_columns(pieces))
+    
     def get_history_df(self):
-        return pd.DataFrame(self.history)
+        return self.history.to_frame()
 
 # %%
 # ทดสอบ Page-Hinkley
@@ -2863,6 +3678,181 @@ plt.tight_layout()
 plt.savefig('page_hinkley_detection.png', dpi=150, bbox_inches='tight')
 plt.show()
 
+# %% [markdown]
+# ## ส่วนที่ 7: Vectorized `update_many` และ Benchmark
+#
+# `update()` รับทีละค่าและสร้าง dict ต่อ sample -> overhead ของ Python ต่อ event สูง
+# `update_many(values, timestamps)` รับ chunk เป็น NumPy array:
+# - **Page-Hinkley**: mean ด้วย `lfilter`, ค่าสะสมด้วย `cumsum` / running min-max
+#   หลัง reset ใช้ตารางค่าสะสมจากทุกตำแหน่งเริ่มต้นแล้วกระโดดจาก drift หนึ่งไปอีก drift
+# - **Sliding Window**: KS statistic จาก ranks ที่ sort ต่อ window (p-value cache ตาม D), PSI จาก bin counts ด้วย prefix sums
+# - **Adaptive**: vectorized ระหว่าง adaptations -> ยิ่ง adapt ถี่ (reference เปลี่ยนทุกไม่กี่ samples) ความเร็วยิ่งเข้าใกล้ `update()`
+#
+# ตรวจก่อนว่าผลลัพธ์ตรงกับ `update()` ทีละค่าทุกประการ แล้วจึงวัด events/sec
+
+# %%
+# ผลลัพธ์ต้องเหมือน update() ทีละค่า: ทั้ง chunk เดียวและแบ่ง chunk ขนาดสุ่ม
+detector_factories = {
+    'Sliding Window': lambda: SlidingWindowDriftDetector(reference_window_size=200, test_window_size=100),
+    'Adaptive (50/50)': lambda: AdaptiveDriftDetector(reference_window_size=200, test_window_size=50),
+    'Adaptive (half_life=200)': lambda: AdaptiveDriftDetector(reference_window_size=200, test_window_size=50, half_life=200),
+    'Page-Hinkley': lambda: PageHinkleyDetector(delta=0.01, lambda_=30)
+}
+chunk_rng = np.random.default_rng(0)
+
+for dtype, stream in streams.items():
+    values, timestamps = stream['value'].to_numpy(), stream['timestamp'].to_numpy()
+    for name, make_detector in detector_factories.items():
+        per_sample = make_detector()
+        for value, timestamp in zip(values, stream['timestamp']):
+            per_sample.update(value, timestamp=timestamp)
+        
+        one_chunk = make_detector()
+        one_chunk.update_many(values, timestamps)
+        
+        chunked = make_detector()
+        bounds = np.sort(chunk_rng.choice(np.arange(1, len(values)), size=15, replace=False))
+        for part, part_ts in zip(np.split(values, bounds), np.split(timestamps, bounds)):
+            chunked.update_many(part, part_ts)
+        
+        expected = per_sample.get_history_df()
+        for detector in (one_chunk, chunked):
+            pd.testing.assert_frame_equal(detector.get_history_df(), expected, check_exact=True)
+            for attr in ('drift_points', 'confirmed_drifts', 'adaptation_count', 'n_samples'):
+                assert getattr(detector, attr, None) == getattr(per_sample, attr, None), (dtype, name, attr)
+
+print(f"✅ update_many == update() for {len(detector_factories)} detectors x {len(streams)} drift types "
+      f"(single chunk and random chunks)")
+
+# %%
+# Benchmark: update() ทีละค่า vs update_many() บน stream 1,000,000 events
+bench_rng = np.random.default_rng(42)
+n_events = 1_000_000
+bench_values = bench_rng.normal(50, 10, n_events)
+bench_values[n_events // 2:] += 5  # sudden drift กลาง stream
+bench_timestamps = pd.date_range('2024-01-01', periods=n_events, freq='s')
+
+n_per_sample = {'Sliding Window': 2000}  # update() ทีละค่าของ sliding window ช้ามาก วัดบนช่วงสั้นกว่า
+warmup = 300  # ผ่าน initialization ของ reference/test windows ก่อนจับเวลา
+
+benchmark_rows = []
+for name, make_detector in detector_factories.items():
+    n_single = n_per_sample.get(name, 20000)
+    single_values = bench_values[warmup:warmup + n_single].tolist()
+    single_timestamps = list(bench_timestamps[warmup:warmup + n_single])
+    detector = make_detector()
+    detector.update_many(bench_values[:warmup], bench_timestamps[:warmup])
+    start = time.perf_counter()
+    for value, timestamp in zip(single_values, single_timestamps):
+        detector.update(value, timestamp=timestamp)
+    per_sample_rate = n_single / (time.perf_counter() - start)
+    
+    detector = make_detector()
+    start = time.perf_counter()
+    detector.update_many(bench_values, bench_timestamps)
+    vectorized_rate = n_events / (time.perf_counter() - start)
+    
+    benchmark_rows.append({
+        'detector': name,
+        'update() events/s': per_sample_rate,
+        'update_many() events/s': vectorized_rate,
+        'speedup': vectorized_rate / per_sample_rate,
+        'history rows': len(detector.history)
+    })
+
+benchmark_df = pd.DataFrame(benchmark_rows).set_index('detector')
+print("=" * 60)
+print(f"⚡ Streaming Detector Throughput ({n_events:,} events)")
+print("=" * 60)
+print(benchmark_df.to_string(float_format=lambda v: f"{v:,.1f}"))
+
+# %% [markdown]
+# ## ส่วนที่ 8: Incremental PSI ด้วย Ring Buffer
+#
+# `update()` ของ Sliding Window แปลง deques เป็น arrays, หา percentiles และ histogram 300 ค่าใหม่ทุก event -> O(window)
+# `SlidingWindowDriftDetector(incremental=True, stride=k)`:
+# - **Frozen bins**: edges จาก percentiles ของ reference ตอน initialize (bin ปลายทั้งสองเปิด) คงที่จน `reset_reference()`
+# - **Ring buffer**: ค่าใหม่ทับค่าเก่าสุด ลด count ของ bin ที่ออก เพิ่ม count ของ bin ที่เข้า -> PSI จาก counts O(bins)
+# - **Running mean**: ผลรวมของ window ปรับทีละค่า และคำนวณใหม่ทุกครั้งที่ ring วนครบรอบ กัน floating-point error สะสม
+# - **Stride**: ประเมิน (และบันทึก history) ทุก k samples; samples ระหว่างนั้นคืน `status='skipped'`
+# - **KS**: reference เรียงครั้งเดียวตอน freeze, rank ของค่าที่เข้า/ออกหาด้วย bisect แล้วเก็บ ranks ของ test window แบบเรียงไว้
+#   D ได้จาก ranks ที่เรียงแล้ว O(window) ต่อการประเมิน (วิธีเดียวกับ `ks_2samp_many`) และ p-value จาก cache ของ (n1, n2, D)
+#
+# bin edges ที่ freeze ต่างจาก percentiles ของ reference ปัจจุบันเพียงเล็กน้อย (reference ไม่เปลี่ยนจนกว่าจะ reset)
+# ความต่างหลักคือ bin ปลายเปิด: ค่าที่อยู่นอกช่วงของ reference ถูกนับ แทนที่จะถูกทิ้งแบบ `np.histogram`
+
+# %%
+# ตรวจความถูกต้อง: counts ใน ring buffer ตรงกับ histogram ของ test window, KS ตรงกับ stats.ks_2samp, update_many == update()
+incremental_factories = {
+    'incremental': lambda: SlidingWindowDriftDetector(reference_window_size=200, test_window_size=100, incremental=True),
+    'incremental, stride=10': lambda: SlidingWindowDriftDetector(reference_window_size=200, test_window_size=100,
+                                                                 incremental=True, stride=10),
+    'incremental, PSI only': lambda: SlidingWindowDriftDetector(reference_window_size=200, test_window_size=100,
+                                                                incremental=True, ks_threshold=None)
+}
+
+for dtype, stream in streams.items():
+    values, timestamps = stream['value'].to_numpy(), stream['timestamp'].to_numpy()
+    for name, make_detector in incremental_factories.items():
+        per_sample = make_detector()
+        for value, timestamp in zip(values, stream['timestamp']):
+            per_sample.update(value, timestamp=timestamp)
+        
+        window = per_sample._window_values()
+        recount = np.bincount(np.searchsorted(per_sample._inner_edges, window, side='right'),
+                              minlength=len(per_sample._bin_counts))
+        assert np.array_equal(per_sample._bin_counts, recount), (dtype, name)
+        assert np.isclose(per_sample._ring_sum, window.sum()), (dtype, name)
+        if per_sample.ks_threshold is not None:
+            expected = stats.ks_2samp(per_sample._ref_array, window)
+            assert np.allclose(per_sample._ks_incremental(), (expected.statistic, expected.pvalue),
+                               rtol=1e-12, atol=0), (dtype, name)
+        
+        chunked = make_detector()
+        bounds = np.sort(chunk_rng.choice(np.arange(1, len(values)), size=15, replace=False))
+        for part, part_ts in zip(np.split(values, bounds), np.split(timestamps, bounds)):
+            chunked.update_many(part, part_ts)
+        pd.testing.assert_frame_equal(chunked.get_history_df(), per_sample.get_history_df(), check_exact=True)
+        assert chunked.drift_points == per_sample.drift_points, (dtype, name)
+
+print(f"✅ ring buffer counts, incremental KS และ update_many == update() for {len(incremental_factories)} modes x {len(streams)} drift types")
+
+# %%
+# Throughput ของ update() ทีละ event และการ detect บน sudden stream (drift ที่ sample 500)
+incremental_factories = {'full recompute': detector_factories['Sliding Window'], **incremental_factories}
+n_single = 20000
+single_values = bench_values[warmup:warmup + n_single].tolist()
+single_timestamps = list(bench_timestamps[warmup:warmup + n_single])
+sudden_values = sudden_stream['value'].to_numpy()
+sudden_onset = 500
+
+incremental_rows = []
+for name, make_detector in incremental_factories.items():
+    n_events_run = n_per_sample['Sliding Window'] if name == 'full recompute' else n_single
+    detector = make_detector()
+    detector.update_many(bench_values[:warmup], bench_timestamps[:warmup])
+    start = time.perf_counter()
+    for value, timestamp in zip(single_values[:n_events_run], single_timestamps[:n_events_run]):
+        detector.update(value, timestamp=timestamp)
+    rate = n_events_run / (time.perf_counter() - start)
+    
+    detector = make_detector()
+    detected = np.array([detector.update(value)['drift_detected'] for value in sudden_values])
+    incremental_rows.append({
+        'mode': name,
+        'update() events/s': rate,
+        'alerts before onset': int(detected[:sudden_onset].sum()),
+        # None = ไม่ detect drift เลยหลัง onset
+        'detection delay': int(np.argmax(detected[sudden_onset:])) if detected[sudden_onset:].any() else None,
+        'history rows': len(detector.history)
+    })
+
+incremental_df = pd.DataFrame(incremental_rows).set_index('mode')
+print("=" * 60)
+print("⚡ Sliding Window: full recompute vs incremental PSI")
+print("=" * 60)
+print(incremental_df.to_string(float_format=lambda v: f"{v:,.1f}"))
+
 # %% [markdown]
 # ## สรุป LAB 4
 #
@@ -2871,6 +3861,8 @@ plt.show()
 # 2. **Sliding Window**: วิธีมาตรฐานสำหรับ streaming drift detection
 # 3. **Adaptive Detection**: ปรับ reference window เมื่อ detect drift
 # 4. **Page-Hinkley**: Algorithm สำหรับ mean shift detection
+# 5. **Vectorized Streaming**: `update_many` ประมวลผลทั้ง chunk ด้วย NumPy ได้ผลเท่ากับทีละค่า
+# 6. **Incremental PSI**: frozen bins + ring buffer ทำให้ `update()` ทีละ event เหลือ O(bins) และเลือก stride ได้
 #
 # ### Comparison:
 # | Method | Pros | Cons | Best For |
@@ -3626,11 +4618,38 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from datetime import datetime, timedelta
-from scipy import stats
+from scipy import stats, special
 import json
 import os
+import sys
 import logging
+import asyncio
+import time
+import bisect
+import cProfile
+import dataclasses
+import gzip
+import html
+import io
+import itertools
+import pickle
+import platform
+import pstats
+import queue
+import shutil
+import sqlite3
+import threading
+import tracemalloc
+import urllib.request
+import uuid
 from collections import deque
+from functools import lru_cache
+from math import gcd
+from string import Template
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+from multiprocessing import shared_memory
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -3684,21 +4703,24 @@ class DriftResult:
     current_mean: float
     reference_std: float
     current_std: float
+    test_name: str = 'ks'  # test ที่ให้ ks_statistic/ks_pvalue: 'ks' หรือ 'chi2' (categorical)
+    
+    METRIC_FIELDS = ('psi', 'ks_statistic', 'ks_pvalue', 'reference_mean',
+                     'current_mean', 'reference_std', 'current_std')
     
     def to_dict(self):
-        return {
+        data = {
             'timestamp': self.timestamp.isoformat(),
             'feature': self.feature,
             'drift_detected': self.drift_detected,
-            'drift_type': self.drift_type.value,
-            'psi': self.psi,
-            'ks_statistic': self.ks_statistic,
-            'ks_pvalue': self.ks_pvalue,
-            'reference_mean': self.reference_mean,
-            'current_mean': self.current_mean,
-            'reference_std': self.reference_std,
-            'current_std': self.current_std
+            'drift_type': self.drift_type.value
         }
+        # NaN = ค่าที่ไม่ใช้กับ feature นี้ (เช่น mean/std ของ categorical) -> None เพื่อให้เป็น JSON ที่ถูกต้อง
+        for name in self.METRIC_FIELDS:
+            value = getattr(self, name)
+            data[name] = None if np.isnan(value) else value
+        data['test_name'] = self.test_name
+        return data
 
 @dataclass
 class Alert:
@@ -3708,14 +4730,22 @@ class Alert:
     message: str
     details: Dict
     acknowledged: bool = False
+    alert_id: int = -1  # กำหนดโดย AlertStore
+    feature: str = ''
+    occurrences: int = 1  # จำนวนครั้งที่ drift เดิมเกิดซ้ำ (deduplicated)
+    last_seen: Optional[datetime] = None
     
     def to_dict(self):
         return {
+            'alert_id': self.alert_id,
             'timestamp': self.timestamp.isoformat(),
+            'feature': self.feature,
             'severity': self.severity.value,
             'message': self.message,
             'details': self.details,
-            'acknowledged': self.acknowledged
+            'acknowledged': self.acknowledged,
+            'occurrences': self.occurrences,
+            'last_seen': (self.last_seen or self.timestamp).isoformat()
         }
 
 @dataclass
@@ -3727,97 +4757,1176 @@ class MonitoringConfig:
     psi_moderate_threshold: float = 0.2
     psi_severe_threshold: float = 0.25
     ks_significance: float = 0.05
-    check_interval_seconds: int = 60
+    check_interval_seconds: float = 60
     alert_cooldown_minutes: int = 30
     features_to_monitor: List[str] = field(default_factory=list)
+    executor_mode: str = 'serial'  # 'serial', 'thread' หรือ 'process'
+    max_workers: Optional[int] = None
+    results_store_dir: Optional[str] = None  # None = เก็บ segments ใน memory
+    results_segment_size: int = 10000
+    summary_windows: Dict[str, timedelta] = field(default_factory=dict)  # เช่น {'last_hour': timedelta(hours=1)}
+    sink_dir: Optional[str] = None  # ถ้ากำหนด: เขียน results/alerts เป็น JSONL แบบ append
+    sink_max_bytes: int = 64 * 1024 * 1024
+    sink_rotate_seconds: Optional[float] = None
+    sink_compress: bool = True
+    instrumentation_enabled: bool = False  # บันทึกเวลา/จำนวนครั้ง/allocation ต่อ stage
+    profile_every_n_checks: int = 0  # > 0: profile ทุก N checks (0 = ปิด)
+    profiler: str = 'cprofile'  # 'cprofile' หรือ 'tracemalloc'
+    metrics_port: Optional[int] = None  # ถ้ากำหนด: เปิด /metrics แบบ Prometheus (0 = สุ่ม port ว่าง)
+    metrics_host: str = '127.0.0.1'
+    reference_mode: str = 'window'  # 'window' (raw values), 'sketch' (QuantileSketch) หรือ 'decayed' (DecayedHistogram)
+    sketch_k: int = 400  # ขนาด sketch: rank error ประมาณ 1.7/k
+    reference_half_life: float = 5000  # decayed mode: น้ำหนักลดครึ่งหนึ่งทุกกี่ samples
+    decay_resolution: int = 100  # decayed mode: จำนวน bins ละเอียด (KS และการรวมเป็น PSI bins)
+    checkpoint_dir: Optional[str] = None  # ถ้ากำหนด: checkpoint state เป็นระยะใน background
+    checkpoint_interval_seconds: float = 300
+    checkpoint_keep: int = 2  # จำนวน checkpoints ที่เก็บไว้
+    categorical_features: List[str] = field(default_factory=list)  # features ใน features_to_monitor ที่เป็น categorical
+    categorical_top_k: int = 50  # เก็บ top-k categories จาก reference ที่เหลือรวมเป็น 'other'
+    alert_retention: int = 10000  # จำนวน alerts ที่เก็บใน memory
+    alert_archive_path: Optional[str] = None  # SQLite file สำหรับ alerts ที่เกิน retention (None = ทิ้ง)
+    alert_dedup: bool = True  # รวม alert ซ้ำของ feature/severity เดิมที่ยังไม่ acknowledge
+    alert_logging: bool = True  # False: ไม่ log alerts ของ pipeline นี้ (เช่น replay) pipelines อื่นยัง log ตามปกติ
+    alert_sinks: List = field(default_factory=list)  # AlertSink ถ้ากำหนด: ส่ง alerts แบบ async แทนการ log ตรงๆ
+    alert_queue_size: int = 10000  # คิวของ AlertDispatcher (เต็มแล้วทิ้ง ไม่ block ingest)
+    alert_batch_size: int = 100
+    alert_flush_seconds: float = 0.5  # รอรวม batch นานสุดกี่วินาที
+    alert_max_retries: int = 3
+    alert_retry_backoff_seconds: float = 0.5  # backoff = ค่านี้ * 2^attempt
 
 # %% [markdown]
 # ## ส่วนที่ 3: สร้าง Core Monitoring Components
+#
+# ### KS Test จาก Sorted Reference
+# `stats.ks_2samp` sort ข้อมูลทั้ง reference และ current ใหม่ทุกครั้ง
+# แต่ reference เปลี่ยนไม่บ่อย เราจึงเก็บ reference ที่ sort แล้วไว้ แล้ว:
+# - sort แค่ current window (เล็กกว่ามาก)
+# - ใช้ `np.searchsorted` หา ECDF ของ reference ที่ตำแหน่งของ current ทุกจุด
+# - D = max |F_ref(x) - F_cur(x)| ซึ่งค่าสูงสุดเกิดที่จุดของ current เสมอ (ทั้งที่ x และก่อน x)
+#
+# p-value: ใช้ exact (นับ lattice paths) เมื่อ window ไม่เกิน 10,000 ค่า
+# และ asymptotic (Kolmogorov distribution) เมื่อใหญ่กว่า เหมือน `ks_2samp(method='auto')`
+# exact p-value ขึ้นกับ (n1, n2, h) เท่านั้น และขนาด window คงที่ จึง cache ไว้ได้
 
 # %%
-class DriftCalculator:
+KS_EXACT_MAX_N = 10000
+
+@lru_cache(maxsize=4096)
+def _ks_exact_pvalue(n1: int, n2: int, h: int) -> float:
     """
-    Component สำหรับคำนวณ drift metrics
+    Exact two-sided p-value: 1 - P(ทุกจุดบน path อยู่ใน band |i/n1 - j/n2| < h/lcm)
+
+    นับ lattice paths ทีละแถว โดยแต่ละแถวคือ cumsum ของแถวก่อนหน้าภายใน band
+    (scale ค่าเป็นระยะเพื่อไม่ให้ overflow)
+    """
+    if h == 0:
+        return 1.0
+    if n1 > n2:
+        n1, n2 = n2, n1
+    g = gcd(n1, n2)
+    a, b = n2 // g, n1 // g
+    
+    paths = np.zeros(n2 + 1)
+    paths[:min(n2, (h - 1) // b) + 1] = 1.0
+    log_scale = 0.0
+    for i in range(1, n1 + 1):
+        lo = max(0, (i * a - h) // b + 1)
+        hi = min(n2, -(-(i * a + h) // b) - 1)
+        row = np.zeros(n2 + 1)
+        if lo <= hi:
+            row[lo:hi + 1] = np.cumsum(paths[lo:hi + 1])
+        paths = row
+        peak = paths.max()
+        if peak > 1e100:
+            paths /= peak
+            log_scale += np.log(peak)
+    
+    if paths[n2] <= 0:
+        return 1.0
+    log_total = special.gammaln(n1 + n2 + 1) - special.gammaln(n1 + 1) - special.gammaln(n2 + 1)
+    p_inside = np.exp(np.log(paths[n2]) + log_scale - log_total)
+    return float(np.clip(1.0 - p_inside, 0.0, 1.0))
+
+def ks_2samp_sorted(sorted_reference: np.ndarray, current: np.ndarray, method: str = 'auto') -> tuple:
+    """
+    Two-sample KS test โดยใช้ reference ที่ sort แล้ว
+
+    Returns:
+    --------
+    tuple : (statistic, p_value) ตรงกับ stats.ks_2samp
     """
+    n1, n2 = len(sorted_reference), len(current)
+    cur = np.sort(current)
     
-    @staticmethod
-    def calculate_psi(reference: np.ndarray, current: np.ndarray, bins: int = 10) -> float:
-        """Calculate Population Stability Index"""
-        breakpoints = np.percentile(reference, np.linspace(0, 100, bins + 1))
-        breakpoints = np.unique(breakpoints)
-        
-        if len(breakpoints) < 2:
-            return 0.0
-        
-        ref_counts, _ = np.histogram(reference, bins=breakpoints)
-        cur_counts, _ = np.histogram(current, bins=breakpoints)
-        
-        eps = 1e-6
-        ref_props = ref_counts / len(reference) + eps
-        cur_props = cur_counts / len(current) + eps
-        
-        psi = np.sum((cur_props - ref_props) * np.log(cur_props / ref_props))
-        return float(psi)
+    # ECDF (เป็นจำนวนนับ) ที่ตำแหน่ง x และก่อน x ของทุกค่าใน current
+    ref_le = np.searchsorted(sorted_reference, cur, side='right')
+    ref_lt = np.searchsorted(sorted_reference, cur, side='left')
+    cur_le = np.searchsorted(cur, cur, side='right')
+    cur_lt = np.searchsorted(cur, cur, side='left')
     
-    @staticmethod
-    def calculate_ks_test(reference: np.ndarray, current: np.ndarray) -> tuple:
-        """Calculate Kolmogorov-Smirnov test"""
-        statistic, pvalue = stats.ks_2samp(reference, current)
-        return float(statistic), float(pvalue)
+    diff = max(np.abs(ref_le * n2 - cur_le * n1).max(),
+               np.abs(ref_lt * n2 - cur_lt * n1).max())
+    statistic = diff / (n1 * n2)
     
-    @staticmethod
-    def determine_drift_type(psi: float, config: MonitoringConfig) -> DriftType:
-        """Determine drift severity based on PSI"""
-        if psi >= config.psi_severe_threshold:
-            return DriftType.SEVERE
-        elif psi >= config.psi_moderate_threshold:
-            return DriftType.MODERATE
-        elif psi >= config.psi_mild_threshold:
-            return DriftType.MILD
-        return DriftType.NONE
+    if method == 'auto':
+        method = 'exact' if max(n1, n2) <= KS_EXACT_MAX_N else 'asymp'
+    
+    if method == 'exact':
+        lcm = (n1 // gcd(n1, n2)) * n2
+        pvalue = _ks_exact_pvalue(n1, n2, int(np.round(statistic * lcm)))
+    else:
+        en = n1 * n2 / (n1 + n2)
+        pvalue = float(np.clip(stats.kstwo.sf(statistic, np.round(en)), 0, 1))
+    
+    return float(statistic), pvalue
 
 # %%
-class DataBuffer:
+# ตรวจสอบว่าได้ผลเท่ากับ stats.ks_2samp และเปรียบเทียบความเร็ว
+rng = np.random.default_rng(0)
+max_diff = {'exact': 0.0, 'asymp': 0.0}
+for n_ref, n_cur in [(1000, 200), (500, 500), (30, 70), (20000, 300)]:
+    method = 'exact' if max(n_ref, n_cur) <= KS_EXACT_MAX_N else 'asymp'
+    for shift in [0.0, 0.1, 0.5]:
+        ref = rng.normal(0, 1, n_ref)
+        cur = rng.normal(shift, 1, n_cur)
+        stat_fast, p_fast = ks_2samp_sorted(np.sort(ref), cur)
+        stat_scipy, p_scipy = stats.ks_2samp(ref, cur)
+        max_diff[method] = max(max_diff[method], abs(stat_fast - stat_scipy), abs(p_fast - p_scipy))
+for method, diff in max_diff.items():
+    print(f"Max |difference| vs stats.ks_2samp ({method}): {diff:.2e}")
+    assert diff < 1e-9, f"ks_2samp_sorted ({method}) differs from stats.ks_2samp"
+
+ref = rng.normal(0, 1, 1000)
+sorted_ref = np.sort(ref)
+windows = [rng.normal(0.1, 1, 200) for _ in range(200)]
+
+start = time.perf_counter()
+for cur in windows:
+    stats.ks_2samp(ref, cur)
+scipy_ms = (time.perf_counter() - start) / len(windows) * 1000
+
+# รอบแรกเป็น warm-up ของ p-value cache (ใน production window size คงที่ cache จะอุ่นอย่างรวดเร็ว)
+for cur in windows:
+    ks_2samp_sorted(sorted_ref, cur)
+
+start = time.perf_counter()
+for cur in windows:
+    ks_2samp_sorted(sorted_ref, cur)
+fast_ms = (time.perf_counter() - start) / len(windows) * 1000
+
+print(f"stats.ks_2samp : {scipy_ms:.3f} ms/check")
+print(f"ks_2samp_sorted: {fast_ms:.3f} ms/check ({scipy_ms / fast_ms:.1f}x)")
+
+# %%
+def batched_histogram(matrix: np.ndarray, bin_edges: np.ndarray) -> np.ndarray:
     """
-    Buffer สำหรับเก็บ reference และ current data
+    Histogram ของทุก row (feature) ในครั้งเดียว ด้วย offset-encoded np.bincount
+
+    bin_edges: (n_features, n_bins + 1) เติม np.inf ท้าย row ที่มี edges น้อยกว่า
     """
+    n_features, n_bins = bin_edges.shape[0], bin_edges.shape[1] - 1
+    n_edges = np.isfinite(bin_edges).sum(axis=1)
+    rows = np.arange(n_features)
+    
+    # bin index = จำนวน interior edges ที่ <= ค่า (bin สุดท้ายรวมขอบขวา เหมือน np.histogram)
+    idx = np.zeros(matrix.shape, dtype=np.intp)
+    for j in range(1, n_bins):
+        idx += matrix >= bin_edges[:, j:j + 1]
+    idx = np.minimum(idx, (n_edges - 2)[:, None])
+    
+    first_edge = bin_edges[:, :1]
+    last_edge = bin_edges[rows, np.maximum(n_edges - 1, 0)][:, None]
+    valid = (matrix >= first_edge) & (matrix <= last_edge) & (n_edges >= 2)[:, None]
+    
+    flat = (idx + rows[:, None] * n_bins)[valid]
+    return np.bincount(flat, minlength=n_features * n_bins).reshape(n_features, n_bins)
+
+def batched_psi(reference: np.ndarray, current: np.ndarray, bin_edges: np.ndarray) -> np.ndarray:
+    """PSI vector ของทุก feature: reference (features × n_ref), current (features × n_cur)"""
+    eps = 1e-6
+    ref_props = batched_histogram(reference, bin_edges) / reference.shape[1] + eps
+    cur_props = batched_histogram(current, bin_edges) / current.shape[1] + eps
+    return np.sum((cur_props - ref_props) * np.log(cur_props / ref_props), axis=1)
+
+# %% [markdown]
+# ### Per-stage Instrumentation
+# เมื่อ check ช้า เราต้องรู้ว่าช้าที่ ingest, PSI, KS, alerting หรือ serialization
+# - แต่ละ stage บันทึกเวลาเป็น histogram แบบ log2 buckets (O(1) ต่อครั้ง memory คงที่) พร้อม call count
+# - ถ้า tracemalloc ทำงานอยู่ จะบันทึก net allocation ของ stage ด้วย
+# - `profile_every_n_checks` แนบ cProfile หรือ tracemalloc กับบาง checks เท่านั้น (sampling)
+# - เมื่อปิด `stage()` คืน context manager ตัวเดียวกันที่ไม่ทำอะไร -> overhead แทบเป็นศูนย์
+
+# %%
+class _NullStage:
+    """Context manager ที่ไม่ทำอะไร (ใช้เมื่อปิด instrumentation)"""
+    __slots__ = ()
     
-    def __init__(self, config: MonitoringConfig):
-        self.config = config
-        self.reference_data: Dict[str, deque] = {}
-        self.current_data: Dict[str, deque] = {}
-        self.is_initialized = False
-        
-    def initialize(self, reference_df: pd.DataFrame):
-        """Initialize with reference data"""
-        for feature in self.config.features_to_monitor:
-            if feature in reference_df.columns:
-                self.reference_data[feature] = deque(
-                    reference_df[feature].values[-self.config.reference_window_size:],
-                    maxlen=self.config.reference_window_size
-                )
-                self.current_data[feature] = deque(
-                    maxlen=self.config.current_window_size
-                )
-        self.is_initialized = True
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+class StageHistogram:
+    """
+    Histogram ของเวลา (nanoseconds) แบบ log2 buckets
+    
+    bucket i เก็บค่าใน [2^(i-1), 2^i) -> quantile ที่ได้เป็นค่าประมาณ (ขอบบนของ bucket)
+    """
+    N_BUCKETS = 64
+    
+    def __init__(self):
+        self.buckets = [0] * self.N_BUCKETS
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.alloc_bytes = 0
+    
+    def record(self, elapsed_ns: int, alloc_bytes: int = 0):
+        self.buckets[min(elapsed_ns.bit_length(), self.N_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total_ns += elapsed_ns
+        if elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+        self.alloc_bytes += alloc_bytes
+    
+    def quantile(self, q: float) -> float:
+        """ค่าประมาณของ quantile q (nanoseconds)"""
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for i, n in enumerate(self.buckets):
+            cumulative += n
+            if n and cumulative >= target:
+                return float(min(2 ** i, self.max_ns))
+        return float(self.max_ns)
+
+class _StageTimer:
+    """จับเวลา (และ allocation ถ้า tracemalloc ทำงาน) ของหนึ่ง stage"""
+    __slots__ = ('instrumentation', 'name', 'start', 'alloc_start')
+    
+    def __init__(self, instrumentation: 'Instrumentation', name: str):
+        self.instrumentation = instrumentation
+        self.name = name
+    
+    def __enter__(self):
+        self.alloc_start = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+        self.start = time.perf_counter_ns()
+        return self
+    
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter_ns() - self.start
+        alloc = 0
+        if self.alloc_start is not None and tracemalloc.is_tracing():
+            alloc = tracemalloc.get_traced_memory()[0] - self.alloc_start
+        self.instrumentation.record(self.name, elapsed, alloc)
+        return False
+
+class _ProfileSession:
+    """แนบ cProfile หรือ tracemalloc กับ check หนึ่งครั้ง แล้วเก็บ top entries"""
+    
+    def __init__(self, instrumentation: 'Instrumentation', check_number: int):
+        self.instrumentation = instrumentation
+        self.check_number = check_number
+    
+    def __enter__(self):
+        if self.instrumentation.profiler == 'tracemalloc':
+            self.started = not tracemalloc.is_tracing()
+            if self.started:
+                tracemalloc.start()
+            self.before = tracemalloc.take_snapshot()
+        else:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        return self
+    
+    def __exit__(self, *exc):
+        top_n = self.instrumentation.top_n
+        if self.instrumentation.profiler == 'tracemalloc':
+            after = tracemalloc.take_snapshot()
+            if self.started:
+                tracemalloc.stop()
+            stats_list = after.compare_to(self.before, 'lineno')[:top_n]
+            text = '\n'.join(str(stat) for stat in stats_list)
+        else:
+            self.profile.disable()
+            stream = io.StringIO()
+            pstats.Stats(self.profile, stream=stream).sort_stats('cumulative').print_stats(top_n)
+            text = stream.getvalue()
+        self.instrumentation.profiles.append({
+            'check': self.check_number,
+            'profiler': self.instrumentation.profiler,
+            'timestamp': datetime.now().isoformat(),
+            'top': text
+        })
+        return False
+
+class Instrumentation:
+    """
+    เก็บเวลา, call count และ allocation ต่อ stage ใช้ร่วมกันทั้ง pipeline
+    
+    ใช้งาน: `with instrumentation.stage('psi'): ...`
+    cProfile เห็นเฉพาะ thread ที่เรียก check (worker threads/processes ไม่ถูก profile)
+    """
+    PROFILERS = ('cprofile', 'tracemalloc')
+    
+    def __init__(self, enabled: bool = False, profile_every_n_checks: int = 0,
+                 profiler: str = 'cprofile', top_n: int = 15, max_profiles: int = 10):
+        if profiler not in self.PROFILERS:
+            raise ValueError(f"Unknown profiler: {profiler}")
+        self.enabled = enabled
+        self.profile_every_n_checks = profile_every_n_checks
+        self.profiler = profiler
+        self.top_n = top_n
+        self.histograms: Dict[str, StageHistogram] = {}
+        self.profiles = deque(maxlen=max_profiles)
+        self.checks_seen = 0
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_config(cls, config: MonitoringConfig) -> 'Instrumentation':
+        return cls(
+            enabled=config.instrumentation_enabled,
+            profile_every_n_checks=config.profile_every_n_checks,
+            profiler=config.profiler
+        )
+    
+    def stage(self, name: str):
+        """Context manager จับเวลา stage (no-op ถ้าปิดอยู่)"""
+        if not self.enabled:
+            return _NULL_STAGE
+        return _StageTimer(self, name)
+    
+    def record(self, name: str, elapsed_ns: int, alloc_bytes: int = 0):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = StageHistogram()
+            histogram.record(elapsed_ns, alloc_bytes)
+    
+    def profile_check(self):
+        """Context manager ที่ profile ทุก N checks (no-op สำหรับ checks อื่น)"""
+        if not self.enabled or self.profile_every_n_checks <= 0:
+            return _NULL_STAGE
+        with self._lock:
+            self.checks_seen += 1
+            check_number = self.checks_seen
+        if check_number % self.profile_every_n_checks:
+            return _NULL_STAGE
+        return _ProfileSession(self, check_number)
+    
+    def report(self) -> pd.DataFrame:
+        """สรุปต่อ stage: count, เวลารวม, mean/p50/p99/max และ allocation"""
+        with self._lock:
+            rows = [
+                {
+                    'stage': name,
+                    'count': h.count,
+                    'total_ms': h.total_ns / 1e6,
+                    'mean_us': h.total_ns / h.count / 1e3,
+                    'p50_us': h.quantile(0.5) / 1e3,
+                    'p99_us': h.quantile(0.99) / 1e3,
+                    'max_us': h.max_ns / 1e3,
+                    'alloc_kb': h.alloc_bytes / 1024
+                }
+                for name, h in self.histograms.items() if h.count
+            ]
+        columns = ['stage', 'count', 'total_ms', 'mean_us', 'p50_us', 'p99_us', 'max_us', 'alloc_kb']
+        return pd.DataFrame(rows, columns=columns).sort_values('total_ms', ascending=False, ignore_index=True)
+    
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.profiles.clear()
+            self.checks_seen = 0
+
+# %% [markdown]
+# ### Quantile Sketch สำหรับ Reference ขนาดใหญ่
+# RingBuffer เก็บค่าดิบ reference จึงถูกจำกัดที่ `reference_window_size`
+# ซึ่งเล็กเกินไปสำหรับ baseline จาก training set หลายล้าน rows
+# `QuantileSketch` (KLL) สรุป distribution ใน memory คงที่ (ไม่เกินราว 3k ค่า เมื่อ k = `sketch_k`) และ merge กันได้:
+# - level i เก็บค่าที่มีน้ำหนัก 2^i เมื่อ level เต็มจะ sort แล้วเลื่อนค่าครึ่งหนึ่ง (สลับคู่แบบสุ่ม) ขึ้น level ถัดไป
+# - sketch จากหลาย chunk/เครื่อง merge ได้โดยต่อ level เดียวกันแล้ว compact
+# - count, min, max, mean, std ถูกเก็บแบบ exact
+#
+# PSI ใช้ percentile breakpoints และ histogram ของ reference ที่ได้จาก sketch
+# ส่วน KS คำนวณกับ sketch ในรูป weighted sample (ค่าประมาณ ใช้ asymptotic p-value)
+
+# %%
+class QuantileSketch:
+    """
+    KLL quantile sketch (mergeable) สำหรับ reference distribution
+    
+    Parameters:
+    -----------
+    k : int
+        ขนาดของ level บนสุด ยิ่งมากยิ่งแม่น (rank error ประมาณ 1.7/k)
+    """
+    
+    def __init__(self, k: int = 400, seed: Optional[int] = None):
+        self.k = k
+        self.levels: List[np.ndarray] = [np.empty(0)]
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self._rng = np.random.default_rng(seed)
+        self._sorted = None
+    
+    def __len__(self) -> int:
+        return self.count
+    
+    @property
+    def std(self) -> float:
+        return float(np.sqrt(self.m2 / self.count)) if self.count else 0.0
+    
+    @property
+    def nbytes(self) -> int:
+        return sum(level.nbytes for level in self.levels)
+    
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+    
+    def _add_moments(self, count: int, mean: float, m2: float):
+        """รวม count/mean/M2 แบบ Chan et al. (เสถียรแม้ค่ามี offset ใหญ่)"""
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+    
+    def extend(self, values: np.ndarray):
+        """เพิ่มค่าทีละ batch (NaN ถูกข้าม)"""
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        batch_mean = float(values.mean())
+        self._add_moments(len(values), batch_mean, float(((values - batch_mean) ** 2).sum()))
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+    
+    def merge(self, other: 'QuantileSketch') -> 'QuantileSketch':
+        """รวม sketch อื่นเข้ามา (in-place)"""
+        if other.count == 0:
+            return self
+        self._add_moments(other.count, other.mean, other.m2)
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for i, level in enumerate(other.levels):
+            self.levels[i] = np.concatenate([self.levels[i], level])
+        self._compress()
+        return self
+    
+    def _compress(self):
+        """Compact level ที่เกิน capacity จนกว่าทุก level จะอยู่ในขนาด"""
+        self._sorted = None
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) <= self._capacity(level):
+                level += 1
+                continue
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            items = np.sort(items)
+            # เก็บค่าเศษไว้ที่ level เดิมเพื่อให้น้ำหนักรวมเท่ากับ count พอดี
+            keep = len(items) % 2
+            promoted = items[keep:][self._rng.integers(2)::2]
+            self.levels[level] = items[:keep]
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            # เพิ่ม level ทำให้ capacity ของ level ล่างลดลง -> เริ่มตรวจใหม่จากล่าง
+            level = 0
+    
+    def sorted_view(self) -> tuple:
+        """(ค่าที่เรียงแล้ว, cumulative weights) ของทุก level"""
+        if self._sorted is None:
+            values = np.concatenate(self.levels)
+            weights = np.concatenate([np.full(len(l), 2.0 ** i) for i, l in enumerate(self.levels)])
+            order = np.argsort(values, kind='stable')
+            self._sorted = (values[order], np.cumsum(weights[order]))
+        return self._sorted
+    
+    def quantiles(self, q: np.ndarray) -> np.ndarray:
+        values, cumulative = self.sorted_view()
+        idx = np.searchsorted(cumulative, np.asarray(q) * cumulative[-1], side='left')
+        return values[np.clip(idx, 0, len(values) - 1)]
+    
+    def rank(self, x: np.ndarray, side: str = 'right') -> np.ndarray:
+        """จำนวนค่า (ประมาณ) ที่ <= x (side='right') หรือ < x (side='left')"""
+        values, cumulative = self.sorted_view()
+        idx = np.searchsorted(values, x, side=side)
+        return np.where(idx > 0, cumulative[np.maximum(idx - 1, 0)], 0.0)
+
+def ks_2samp_weighted(sorted_values: np.ndarray, cumulative_weights: np.ndarray,
+                      current: np.ndarray) -> tuple:
+    """
+    KS test ระหว่าง weighted sample (เช่นจาก QuantileSketch) กับ current window
+    
+    ใช้ asymptotic p-value โดยถือว่า reference มีขนาดเท่ากับน้ำหนักรวม
+    """
+    cur = np.sort(current)
+    n1, n2 = cumulative_weights[-1], len(cur)
+    
+    # CDF ทั้งสองเป็น step function จึงพอที่จะเทียบที่ทุกจุดกระโดด
+    points = np.concatenate([cur, sorted_values])
+    idx = np.searchsorted(sorted_values, points, side='right')
+    ref_cdf = np.where(idx > 0, cumulative_weights[np.maximum(idx - 1, 0)], 0.0) / n1
+    cur_cdf = np.searchsorted(cur, points, side='right') / n2
+    statistic = float(np.abs(ref_cdf - cur_cdf).max())
+    
+    en = n1 * n2 / (n1 + n2)
+    pvalue = float(np.clip(stats.kstwo.sf(statistic, np.round(en)), 0, 1))
+    return statistic, pvalue
+
+# %% [markdown]
+# ### Exponentially Decayed Reference
+# `update_reference` ใน window mode append ทั้ง current window เข้า reference (copy ข้อมูล)
+# และทำให้ reference เปลี่ยนแบบขั้นบันได `DecayedHistogram` เก็บ reference เป็น histogram ละเอียด
+# (`decay_resolution` bins จาก percentiles ของ reference แรก) ที่น้ำหนักลดครึ่งหนึ่งทุก `reference_half_life` samples:
+# - update = คูณน้ำหนักทุก bin ด้วย decay^n แล้วบวก counts ของ batch ใหม่ -> O(bins) ไม่ copy array
+# - PSI bins = รวม bins ละเอียดเป็น `bins` กลุ่มตาม weighted quantiles ปัจจุบัน
+# - KS ใช้ weighted CDF ที่ระดับ bins ละเอียด ด้วย effective sample size (Kish) ของน้ำหนัก
+
+# %%
+class DecayedHistogram:
+    """
+    Reference แบบ histogram ที่น้ำหนักลดลงแบบ exponential ตามจำนวน samples
+    
+    bin edges ถูกกำหนดจาก batch แรกและคงที่ bin แรก/สุดท้ายเปิดปลาย
+    (min/max ที่เคยเห็นถูกเก็บไว้เป็นขอบนอกของ profile)
+    """
+    
+    def __init__(self, half_life: float = 5000, resolution: int = 100):
+        self.half_life = half_life
+        self.resolution = resolution
+        self.decay = 0.5 ** (1 / half_life)
+        self.inner_edges: Optional[np.ndarray] = None
+        self.weights: Optional[np.ndarray] = None
+        self.min = np.inf
+        self.max = -np.inf
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self._shift = 0.0
+        self._sum = 0.0
+        self._sum_sq = 0.0
+    
+    def __len__(self) -> int:
+        return self.count
+    
+    @property
+    def effective_n(self) -> float:
+        """Kish effective sample size ของน้ำหนัก"""
+        return self.total ** 2 / self.total_sq if self.total_sq else 0.0
+    
+    @property
+    def mean(self) -> float:
+        return self._shift + self._sum / self.total if self.total else 0.0
+    
+    @property
+    def std(self) -> float:
+        if not self.total:
+            return 0.0
+        mean = self._sum / self.total
+        return float(np.sqrt(max(self._sum_sq / self.total - mean ** 2, 0.0)))
+    
+    def counts(self, values: np.ndarray) -> np.ndarray:
+        """Histogram ของ values บน bins ละเอียด"""
+        idx = np.searchsorted(self.inner_edges, values, side='right')
+        return np.bincount(idx, minlength=len(self.weights))
+    
+    def extend(self, values: np.ndarray):
+        """ลดน้ำหนักเดิมตามจำนวน values ใหม่ แล้วบวก counts (samples ใน batch เดียวกันมีน้ำหนักเท่ากัน)"""
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        n = len(values)
+        if n == 0:
+            return
+        if self.inner_edges is None:
+            edges = np.unique(np.percentile(values, np.linspace(0, 100, self.resolution + 1)))
+            self.inner_edges = edges[1:-1]
+            self.weights = np.zeros(len(self.inner_edges) + 1)
+            self._shift = float(values.mean())
+        
+        factor = self.decay ** n
+        self.weights *= factor
+        self.weights += self.counts(values)
+        shifted = values - self._shift
+        self._sum = self._sum * factor + shifted.sum()
+        self._sum_sq = self._sum_sq * factor + (shifted ** 2).sum()
+        self.total = self.total * factor + n
+        self.total_sq = self.total_sq * factor ** 2 + n
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.count += n
+    
+    def edges(self) -> np.ndarray:
+        """ขอบของ bins ละเอียดทั้งหมด (รวม min/max ที่เคยเห็น)"""
+        return np.concatenate([[self.min], self.inner_edges, [self.max]])
+
+# %%
+@dataclass
+class ReferenceProfile:
+    """ค่าที่คำนวณล่วงหน้าจาก reference window ของ feature หนึ่ง"""
+    bin_edges: np.ndarray
+    reference_props: np.ndarray
+    sorted_reference: np.ndarray
+    mean: float
+    std: float
+    version: int = 0
+    reference_weights: Optional[np.ndarray] = None  # cumulative weights (sketch mode)
+
+class DriftCalculator:
+    """
+    Component สำหรับคำนวณ drift metrics
+    
+    เก็บ ReferenceProfile ต่อ feature ไว้ใน cache เพราะ reference เปลี่ยน
+    เฉพาะตอน DataBuffer.update_reference -> แต่ละ check จึงต้อง bin แค่ current window
+    """
+    
+    def __init__(self, bins: int = 10, instrumentation: Optional[Instrumentation] = None):
+        self.bins = bins
+        self.instrumentation = instrumentation or Instrumentation()
+        self.profiles: Dict[str, ReferenceProfile] = {}
+        self._batch_key = None
+        self._batch_edges = None
+        self._batch_ref_props = None
+    
+    def build_profile(self, reference, version: int = 0) -> ReferenceProfile:
+        """สร้าง profile จาก reference (percentile breakpoints + histogram)"""
+        if isinstance(reference, QuantileSketch):
+            return self.build_profile_from_sketch(reference, version)
+        if isinstance(reference, DecayedHistogram):
+            return self.build_profile_from_decayed(reference, version)
+        
+        breakpoints = np.percentile(reference, np.linspace(0, 100, self.bins + 1))
+        breakpoints = np.unique(breakpoints)
+        
+        if len(breakpoints) < 2:
+            reference_props = np.empty(0)
+        else:
+            ref_counts, _ = np.histogram(reference, bins=breakpoints)
+            reference_props = ref_counts / len(reference) + 1e-6
+        
+        return ReferenceProfile(
+            bin_edges=breakpoints,
+            reference_props=reference_props,
+            sorted_reference=np.sort(reference),
+            mean=float(np.mean(reference)),
+            std=float(np.std(reference)),
+            version=version
+        )
+    
+    def build_profile_from_sketch(self, sketch: QuantileSketch, version: int = 0) -> ReferenceProfile:
+        """สร้าง profile จาก QuantileSketch (histogram ของ reference ประมาณจาก ranks ที่ขอบ bins)"""
+        breakpoints = sketch.quantiles(np.linspace(0, 1, self.bins + 1))
+        breakpoints[0], breakpoints[-1] = sketch.min, sketch.max
+        breakpoints = np.unique(breakpoints)
+        
+        if len(breakpoints) < 2:
+            reference_props = np.empty(0)
+        else:
+            # bins แบบ np.histogram: [e_i, e_i+1) ยกเว้น bin สุดท้ายรวมขอบขวา
+            below = sketch.rank(breakpoints, side='left')
+            below[-1] = sketch.rank(breakpoints[-1:], side='right')[0]
+            reference_props = np.diff(below) / sketch.count + 1e-6
+        
+        values, cumulative = sketch.sorted_view()
+        return ReferenceProfile(
+            bin_edges=breakpoints,
+            reference_props=reference_props,
+            sorted_reference=values,
+            mean=float(sketch.mean),
+            std=sketch.std,
+            version=version,
+            reference_weights=cumulative
+        )
+    
+    def build_profile_from_decayed(self, histogram: DecayedHistogram, version: int = 0) -> ReferenceProfile:
+        """สร้าง profile จาก DecayedHistogram: O(resolution) ไม่แตะค่าดิบ"""
+        edges = histogram.edges()
+        weights = histogram.weights
+        cumulative = np.cumsum(weights)
+        
+        # PSI bins: ตัดที่ขอบ bins ละเอียดที่ weighted CDF ข้าม 1/bins, 2/bins, ...
+        targets = np.linspace(0, 1, self.bins + 1)[1:-1] * cumulative[-1]
+        cuts = np.unique(np.searchsorted(cumulative, targets, side='left') + 1)
+        cuts = cuts[cuts < len(weights)]
+        breakpoints = np.unique(np.concatenate([[edges[0]], edges[cuts], [edges[-1]]]))
+        group_weights = np.add.reduceat(weights, np.concatenate([[0], cuts]))
+        if len(breakpoints) < 2:
+            reference_props = np.empty(0)
+        else:
+            reference_props = group_weights[:len(breakpoints) - 1] / histogram.total + 1e-6
+        
+        # KS: มวลของแต่ละ bin ละเอียดวางที่จุดกึ่งกลาง ปรับน้ำหนักรวมเป็น effective n
+        return ReferenceProfile(
+            bin_edges=breakpoints,
+            reference_props=reference_props,
+            sorted_reference=(edges[:-1] + edges[1:]) / 2,
+            mean=histogram.mean,
+            std=histogram.std,
+            version=version,
+            reference_weights=cumulative * histogram.effective_n / histogram.total
+        )
+    
+    def get_profile(self, feature: str, reference, version: int = 0) -> ReferenceProfile:
+        """คืน profile จาก cache หรือสร้างใหม่ถ้า reference version เปลี่ยน"""
+        profile = self.profiles.get(feature)
+        if profile is None or profile.version != version:
+            with self.instrumentation.stage('profile_build'):
+                profile = self.build_profile(reference, version)
+            self.profiles[feature] = profile
+        return profile
+    
+    def invalidate(self, feature: Optional[str] = None):
+        """ลบ profile ออกจาก cache (ทุก feature ถ้าไม่ระบุ)"""
+        if feature is None:
+            self.profiles.clear()
+        else:
+            self.profiles.pop(feature, None)
+    
+    @staticmethod
+    def calculate_psi_from_profile(profile: ReferenceProfile, current: np.ndarray) -> float:
+        """Calculate PSI โดย bin เฉพาะ current window"""
+        if len(profile.bin_edges) < 2:
+            return 0.0
+        
+        cur_counts, _ = np.histogram(current, bins=profile.bin_edges)
+        cur_props = cur_counts / len(current) + 1e-6
+        ref_props = profile.reference_props
+        
+        psi = np.sum((cur_props - ref_props) * np.log(cur_props / ref_props))
+        return float(psi)
+    
+    @staticmethod
+    def calculate_psi(reference: np.ndarray, current: np.ndarray, bins: int = 10) -> float:
+        """Calculate Population Stability Index"""
+        breakpoints = np.percentile(reference, np.linspace(0, 100, bins + 1))
+        breakpoints = np.unique(breakpoints)
+        
+        if len(breakpoints) < 2:
+            return 0.0
+        
+        ref_counts, _ = np.histogram(reference, bins=breakpoints)
+        cur_counts, _ = np.histogram(current, bins=breakpoints)
+        
+        eps = 1e-6
+        ref_props = ref_counts / len(reference) + eps
+        cur_props = cur_counts / len(current) + eps
+        
+        psi = np.sum((cur_props - ref_props) * np.log(cur_props / ref_props))
+        return float(psi)
+    
+    @staticmethod
+    def calculate_ks_test(reference: np.ndarray, current: np.ndarray) -> tuple:
+        """Calculate Kolmogorov-Smirnov test"""
+        statistic, pvalue = stats.ks_2samp(reference, current)
+        return float(statistic), float(pvalue)
+    
+    @staticmethod
+    def calculate_ks_from_profile(profile: ReferenceProfile, current: np.ndarray) -> tuple:
+        """Calculate KS test จาก sorted reference ใน profile"""
+        if profile.reference_weights is not None:
+            return ks_2samp_weighted(profile.sorted_reference, profile.reference_weights, current)
+        return ks_2samp_sorted(profile.sorted_reference, current)
+    
+    def calculate_categorical_batch(self, reference_counts: np.ndarray,
+                                    current_counts: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Categorical PSI และ chi-squared ของหลาย features จาก counts (features × categories)
+        
+        category ที่ไม่มีทั้งสองฝั่ง (padding) ไม่ถูกนับ chi-squared เป็น homogeneity test
+        แบบเดียวกับ stats.chi2_contingency(correction=False)
+        """
+        with self.instrumentation.stage('categorical'):
+            reference_counts = np.asarray(reference_counts, dtype=float)
+            current_counts = np.asarray(current_counts, dtype=float)
+            present = (reference_counts + current_counts) > 0
+            ref_total = reference_counts.sum(axis=1, keepdims=True)
+            cur_total = current_counts.sum(axis=1, keepdims=True)
+            
+            eps = 1e-6
+            ref_props = reference_counts / ref_total + eps
+            cur_props = current_counts / cur_total + eps
+            psi = np.where(present, (cur_props - ref_props) * np.log(cur_props / ref_props), 0).sum(axis=1)
+            
+            column = reference_counts + current_counts
+            total = ref_total + cur_total
+            with np.errstate(divide='ignore', invalid='ignore'):
+                expected_ref = ref_total * column / total
+                expected_cur = cur_total * column / total
+                terms = ((reference_counts - expected_ref) ** 2 / expected_ref
+                         + (current_counts - expected_cur) ** 2 / expected_cur)
+            chi2 = np.where(present, terms, 0).sum(axis=1)
+            dof = present.sum(axis=1) - 1
+            pvalue = np.where(dof > 0, stats.chi2.sf(chi2, np.maximum(dof, 1)), 1.0)
+            
+            nan = np.full(len(psi), np.nan)
+            return {
+                'psi': psi,
+                'ks_statistic': chi2,
+                'ks_pvalue': pvalue,
+                'reference_mean': nan,
+                'current_mean': nan,
+                'reference_std': nan,
+                'current_std': nan
+            }
+    
+    def calculate_psi_batch(self, features: List[str], profiles: List[ReferenceProfile],
+                            current_matrix: np.ndarray) -> np.ndarray:
+        """
+        PSI ของหลาย features ในครั้งเดียว (current_matrix: features × samples)
+
+        edges และ reference proportions ของทุก feature ถูก stack เป็น matrix
+        และ cache ไว้จนกว่า profile ตัวใดตัวหนึ่งจะเปลี่ยน version
+        """
+        with self.instrumentation.stage('psi'):
+            key = tuple((f, p.version) for f, p in zip(features, profiles))
+            if key != self._batch_key:
+                n_bins = max(1, max(len(p.bin_edges) - 1 for p in profiles))
+                edges = np.full((len(profiles), n_bins + 1), np.inf)
+                ref_props = np.full((len(profiles), n_bins), 1e-6)
+                for i, p in enumerate(profiles):
+                    edges[i, :len(p.bin_edges)] = p.bin_edges
+                    ref_props[i, :len(p.reference_props)] = p.reference_props
+                self._batch_key = key
+                self._batch_edges = edges
+                self._batch_ref_props = ref_props
+            
+            cur_counts = batched_histogram(current_matrix, self._batch_edges)
+            cur_props = cur_counts / current_matrix.shape[1] + 1e-6
+            ref_props = self._batch_ref_props
+            return np.sum((cur_props - ref_props) * np.log(cur_props / ref_props), axis=1)
+    
+    def evaluate(self, profile: ReferenceProfile, current: np.ndarray,
+                 psi: Optional[float] = None) -> Dict[str, float]:
+        """คำนวณ metrics ทั้งหมดของ feature หนึ่งจาก profile และ current window"""
+        with self.instrumentation.stage('ks'):
+            ks_stat, ks_pval = self.calculate_ks_from_profile(profile, current)
+        if psi is None:
+            with self.instrumentation.stage('psi'):
+                psi = self.calculate_psi_from_profile(profile, current)
+        return {
+            'psi': float(psi),
+            'ks_statistic': ks_stat,
+            'ks_pvalue': ks_pval,
+            'reference_mean': profile.mean,
+            'current_mean': float(np.mean(current)),
+            'reference_std': profile.std,
+            'current_std': float(np.std(current))
+        }
+    
+    @staticmethod
+    def determine_drift_type(psi: float, config: MonitoringConfig) -> DriftType:
+        """Determine drift severity based on PSI"""
+        if psi >= config.psi_severe_threshold:
+            return DriftType.SEVERE
+        elif psi >= config.psi_moderate_threshold:
+            return DriftType.MODERATE
+        elif psi >= config.psi_mild_threshold:
+            return DriftType.MILD
+        return DriftType.NONE
+
+# %%
+class RingBuffer:
+    """
+    Fixed-capacity buffer บน NumPy array สำหรับ sliding window
+
+    ใช้ array ขนาด 2 * capacity และเขียนต่อท้ายไปเรื่อยๆ เมื่อเต็มจึงย้าย
+    ข้อมูลล่าสุดกลับไปต้น array (amortized O(1) ต่อค่า) ทำให้ข้อมูลใน window
+    เรียงตามเวลาและต่อเนื่องกันเสมอ -> view() คืน slice ได้โดยไม่ต้อง copy
+    """
+    
+    def __init__(self, capacity: int, dtype=np.float64, shared: bool = False):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self.shm = None
+        if shared:
+            # วาง array ไว้ใน shared memory ให้ worker process อ่านได้โดยไม่ต้อง pickle ข้อมูล
+            nbytes = 2 * capacity * np.dtype(dtype).itemsize
+            self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+            self._data = np.ndarray(2 * capacity, dtype=dtype, buffer=self.shm.buf)
+        else:
+            self._data = np.empty(2 * capacity, dtype=dtype)
+        self._end = 0
+        self._size = 0
+    
+    def __len__(self) -> int:
+        return self._size
+    
+    def is_full(self) -> bool:
+        return self._size == self.capacity
+    
+    def extend(self, values: np.ndarray):
+        """Append ทั้ง column ในครั้งเดียว (เก็บเฉพาะ capacity ค่าล่าสุด)"""
+        values = np.asarray(values, dtype=self._data.dtype).ravel()
+        n = len(values)
+        if n == 0:
+            return
+        if n >= self.capacity:
+            self._data[:self.capacity] = values[-self.capacity:]
+            self._end = self.capacity
+            self._size = self.capacity
+            return
+        
+        if self._end + n > len(self._data):
+            # ย้ายข้อมูลที่ยังอยู่ใน window กลับไปต้น array
+            keep = min(self._size, self.capacity - n)
+            self._data[:keep] = self._data[self._end - keep:self._end]
+            self._end = keep
+            self._size = keep
+        
+        self._data[self._end:self._end + n] = values
+        self._end += n
+        self._size = min(self._size + n, self.capacity)
+    
+    def append(self, value: float):
+        """Append ค่าเดียว"""
+        self.extend(np.array([value]))
+    
+    def view(self) -> np.ndarray:
+        """
+        Read-only view ของข้อมูลใน window (zero-copy)
+
+        Note: view จะเปลี่ยนตามเมื่อมีการเขียนครั้งถัดไป ถ้าต้องเก็บไว้ให้ .copy()
+        """
+        window = self._data[self._end - self._size:self._end]
+        window.flags.writeable = False
+        return window
+    
+    def copy(self, shared: bool = False) -> 'RingBuffer':
+        """สร้าง RingBuffer ใหม่ที่มีข้อมูลเหมือนกัน"""
+        buffer = RingBuffer(self.capacity, dtype=self._data.dtype, shared=shared)
+        buffer.extend(self.view())
+        return buffer
+    
+    def window_bounds(self) -> tuple:
+        """(start, end) ของ window ใน backing array"""
+        return self._end - self._size, self._end
+    
+    def clear(self):
+        self._end = 0
+        self._size = 0
+    
+    def close(self):
+        """คืน shared memory (ถ้ามี)"""
+        if self.shm is None:
+            return
+        self._data = np.empty(0, dtype=self._data.dtype)
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # ยังมี view ค้างอยู่ -> memory จะถูกคืนตอน process จบ
+        self.shm.unlink()
+        self.shm = None
+
+# %% [markdown]
+# ### Categorical Features
+# categorical features (เช่น region, education) ถูก dictionary-encode เป็น integer codes:
+# - `CategoryEncoder` เก็บ top-k categories ที่พบบ่อยที่สุดใน reference ที่เหลือ (และ category ใหม่) เป็น 'other'
+#   -> memory ต่อ feature คงที่แม้ cardinality สูง
+# - `CategoricalWindow` เก็บ codes ใน RingBuffer และ counts ต่อ category ที่อัปเดตแบบ incremental
+#   (บวก codes ใหม่ ลบ codes ที่หลุดจาก window) ไม่ต้อง `value_counts` ทุกครั้งที่ตรวจ
+# - Chi-squared (homogeneity test ของ reference vs current) และ categorical PSI คำนวณจาก counts
+#   ของทุก categorical features พร้อมกันแบบ vectorized
+#
+# DriftResult ของ categorical feature: `ks_statistic`/`ks_pvalue` เก็บค่า chi-squared และ p-value
+# (`test_name='chi2'` แยก series ใน Prometheus/MLflow จาก KS ที่อยู่ใน [0, 1]) ส่วน mean/std เป็น NaN
+# (`to_dict` ให้ `None` -> save_results และ JSONL sink เขียน `null` ไม่ใช่ `NaN`)
+
+# %%
+class CategoryEncoder:
+    """Dictionary encoding: code 0..k-1 = top-k categories ของ reference, code k = 'other'"""
+    
+    def __init__(self, categories):
+        self.categories = pd.Index(categories)
+        self.other_code = len(self.categories)
+    
+    @classmethod
+    def fit(cls, values, top_k: int = 50) -> 'CategoryEncoder':
+        counts = pd.Series(values).value_counts()
+        return cls(counts.index[:top_k])
+    
+    @property
+    def n_codes(self) -> int:
+        return self.other_code + 1
+    
+    def labels(self) -> List[str]:
+        return [str(c) for c in self.categories] + ['other']
+    
+    def encode(self, values) -> np.ndarray:
+        """แปลง values เป็น codes (hash lookup แบบ vectorized, category ที่ไม่รู้จัก -> other)"""
+        codes = self.categories.get_indexer(pd.Index(values))
+        codes[codes < 0] = self.other_code
+        return codes.astype(np.int32)
+
+class CategoricalWindow:
+    """Sliding window ของ category codes พร้อม counts ต่อ category (อัปเดตแบบ incremental)"""
+    
+    def __init__(self, capacity: int, n_codes: int):
+        self.codes = RingBuffer(capacity, dtype=np.int32)
+        self.counts = np.zeros(n_codes, dtype=np.int64)
+    
+    @property
+    def capacity(self) -> int:
+        return self.codes.capacity
+    
+    def __len__(self) -> int:
+        return len(self.codes)
+    
+    def extend(self, codes: np.ndarray):
+        codes = np.asarray(codes, dtype=np.int32).ravel()[-self.capacity:]
+        n_evicted = max(0, len(self.codes) + len(codes) - self.capacity)
+        if n_evicted:
+            self.counts -= np.bincount(self.codes.view()[:n_evicted], minlength=len(self.counts))
+        self.counts += np.bincount(codes, minlength=len(self.counts))
+        self.codes.extend(codes)
+    
+    def append(self, code: int):
+        self.extend(np.array([code]))
+    
+    def view(self) -> np.ndarray:
+        return self.codes.view()
+    
+    def copy(self, shared: bool = False) -> 'CategoricalWindow':
+        """Copy (อยู่ใน memory ของ process เสมอ categorical ถูกประเมินใน process หลัก)"""
+        window = CategoricalWindow(self.capacity, len(self.counts))
+        window.codes = self.codes.copy()
+        window.counts = self.counts.copy()
+        return window
+    
+    def clear(self):
+        self.codes.clear()
+        self.counts[:] = 0
+    
+    def close(self):
+        pass
+
+# %%
+class DataBuffer:
+    """
+    Buffer สำหรับเก็บ reference และ current data
+    
+    แต่ละ feature เก็บใน RingBuffer แยกกัน (columnar) เพื่อให้ ingest
+    ทีละ batch ได้ในครั้งเดียว และอ่าน window ได้แบบ zero-copy
+    
+    reference_mode='sketch': reference เป็น QuantileSketch แทน RingBuffer
+    (ไม่จำกัดจำนวน rows, get_reference คืน sketch)
+    reference_mode='decayed': reference เป็น DecayedHistogram
+    (update_reference = decay + เพิ่ม counts, ไม่ copy ค่าดิบ)
+    
+    categorical features เก็บใน CategoricalWindow ทั้ง reference และ current
+    โดยใช้ CategoryEncoder ที่ fit จาก reference (self.encoders)
+    """
+    
+    def __init__(self, config: MonitoringConfig, instrumentation: Optional[Instrumentation] = None):
+        self.config = config
+        self.instrumentation = instrumentation or Instrumentation()
+        self.reference_data: Dict[str, RingBuffer] = {}
+        self.current_data: Dict[str, RingBuffer] = {}
+        self.reference_version: Dict[str, int] = {}
+        self.encoders: Dict[str, CategoryEncoder] = {}
+        self.rows_ingested = 0
+        self.is_initialized = False
+        self._owns_reference = True
+        # ป้องกัน checkpoint อ่าน buffer ระหว่างที่ ingest เขียนอยู่
+        self.lock = threading.Lock()
+        
+    def initialize(self, reference_df: pd.DataFrame):
+        """Initialize with reference data"""
+        shared = self.config.executor_mode == 'process'
+        for feature in self.config.features_to_monitor:
+            if feature in reference_df.columns and feature in self.config.categorical_features:
+                encoder = CategoryEncoder.fit(reference_df[feature], self.config.categorical_top_k)
+                self.encoders[feature] = encoder
+                self.reference_data[feature] = CategoricalWindow(self.config.reference_window_size, encoder.n_codes)
+                self.reference_data[feature].extend(encoder.encode(reference_df[feature]))
+                self.current_data[feature] = CategoricalWindow(self.config.current_window_size, encoder.n_codes)
+                self.reference_version[feature] = self.reference_version.get(feature, -1) + 1
+            elif feature in reference_df.columns:
+                self.reference_data[feature] = self._new_reference(shared)
+                self.reference_data[feature].extend(reference_df[feature].to_numpy(dtype=float))
+                self.current_data[feature] = RingBuffer(self.config.current_window_size, shared=shared)
+                self.reference_version[feature] = self.reference_version.get(feature, -1) + 1
+        self.is_initialized = True
         logger.info(f"DataBuffer initialized with {len(self.reference_data)} features")
     
+    def _new_reference(self, shared: bool = False):
+        if self.config.reference_mode == 'sketch':
+            return QuantileSketch(self.config.sketch_k)
+        if self.config.reference_mode == 'decayed':
+            return DecayedHistogram(self.config.reference_half_life, self.config.decay_resolution)
+        return RingBuffer(self.config.reference_window_size, shared=shared)
+    
+    def merge_reference_sketches(self, sketches: Dict[str, QuantileSketch]):
+        """
+        รวม sketches ที่สร้างแยกกัน (เช่นทีละ chunk ของ training set) เข้ากับ reference
+        
+        ใช้ได้เฉพาะ reference_mode='sketch'
+        """
+        if self.config.reference_mode != 'sketch':
+            raise ValueError("merge_reference_sketches requires reference_mode='sketch'")
+        for feature, sketch in sketches.items():
+            if feature not in self.config.features_to_monitor or feature in self.encoders:
+                continue
+            if feature not in self.reference_data:
+                self.reference_data[feature] = QuantileSketch(self.config.sketch_k)
+                self.current_data[feature] = RingBuffer(self.config.current_window_size)
+            self.reference_data[feature].merge(sketch)
+            self.reference_version[feature] = self.reference_version.get(feature, -1) + 1
+        self.is_initialized = True
+    
     def add_data(self, data: Dict[str, float]):
         """Add new data point"""
-        for feature, value in data.items():
-            if feature in self.current_data:
-                self.current_data[feature].append(value)
-    
-    def get_reference(self, feature: str) -> Optional[np.ndarray]:
-        """Get reference data for a feature"""
-        if feature in self.reference_data:
-            return np.array(self.reference_data[feature])
+        with self.lock:
+            for feature, value in data.items():
+                if feature in self.encoders:
+                    self.current_data[feature].extend(self.encoders[feature].encode([value]))
+                elif feature in self.current_data:
+                    self.current_data[feature].append(value)
+    
+    def add_batch(self, batch_df):
+        """
+        Add a batch of data (append ทั้ง column ต่อ feature)
+        
+        รับ DataFrame หรือ dict ของ arrays (feature -> values) เช่น slices ของ memory-mapped array
+        """
+        n_rows = len(batch_df) if isinstance(batch_df, pd.DataFrame) else len(next(iter(batch_df.values()), []))
+        with self.instrumentation.stage('ingest'), self.lock:
+            for feature, buffer in self.current_data.items():
+                if feature not in batch_df:
+                    continue
+                if feature in self.encoders:
+                    buffer.extend(self.encoders[feature].encode(batch_df[feature]))
+                else:
+                    buffer.extend(np.asarray(batch_df[feature], dtype=float))
+            self.rows_ingested += n_rows
+    
+    def get_reference(self, feature: str):
+        """Get reference data for a feature (read-only view, QuantileSketch หรือ DecayedHistogram)"""
+        reference = self.reference_data.get(feature)
+        if isinstance(reference, (QuantileSketch, DecayedHistogram)):
+            return reference
+        if reference is not None:
+            return reference.view()
         return None
     
     def get_current(self, feature: str) -> Optional[np.ndarray]:
-        """Get current data for a feature"""
+        """Get current data for a feature (read-only view)"""
         if feature in self.current_data:
-            return np.array(self.current_data[feature])
+            return self.current_data[feature].view()
         return None
     
     def is_current_ready(self) -> bool:
@@ -3830,13 +5939,701 @@ class DataBuffer:
     
     def update_reference(self):
         """Update reference with current data"""
-        for feature in self.config.features_to_monitor:
-            if feature in self.current_data and len(self.current_data[feature]) > 0:
-                # Add current data to reference
-                for val in self.current_data[feature]:
-                    self.reference_data[feature].append(val)
-                self.current_data[feature].clear()
+        with self.instrumentation.stage('update_reference'), self.lock:
+            for feature in self.config.features_to_monitor:
+                if feature in self.current_data and len(self.current_data[feature]) > 0:
+                    # Add current data to reference
+                    self.reference_data[feature].extend(self.current_data[feature].view())
+                    self.reference_version[feature] += 1
+                    self.current_data[feature].clear()
         logger.info("Reference data updated with current window")
+    
+    def snapshot(self) -> 'DataBuffer':
+        """
+        Snapshot สำหรับตรวจ drift ขณะที่ยังรับข้อมูลเข้ามาต่อ
+        
+        current windows ถูก copy ส่วน reference ใช้ buffer เดิมร่วมกัน
+        (ingest เขียนเฉพาะ current) -> ห้ามเรียก update_reference ระหว่างที่ snapshot ยังใช้งาน
+        """
+        shared = self.config.executor_mode == 'process'
+        snapshot = DataBuffer(self.config, self.instrumentation)
+        snapshot.reference_data = self.reference_data
+        with self.instrumentation.stage('snapshot'), self.lock:
+            snapshot.current_data = {f: b.copy(shared=shared) for f, b in self.current_data.items()}
+        snapshot.reference_version = dict(self.reference_version)
+        snapshot.encoders = self.encoders
+        snapshot.is_initialized = self.is_initialized
+        snapshot._owns_reference = False
+        return snapshot
+    
+    def close(self):
+        """คืน shared memory ของทุก buffer"""
+        buffers = list(self.current_data.values())
+        if self._owns_reference:
+            buffers += [b for b in self.reference_data.values() if isinstance(b, (RingBuffer, CategoricalWindow))]
+        for buffer in buffers:
+            buffer.close()
+
+# %% [markdown]
+# ### Streaming JSONL Sink
+# `json.dump(..., indent=2)` ของทั้ง history ทุกครั้งที่ save จะช้าลงเรื่อยๆ ตามขนาด history
+# JsonlSink เขียนเฉพาะ record ใหม่ต่อท้ายไฟล์ (1 บรรทัดต่อ record) จาก background thread:
+# - รวม records เป็น batch ก่อนเขียน (ลดจำนวน system calls)
+# - rotate ไฟล์ตามขนาดหรืออายุ และบีบอัดไฟล์เก่าด้วย gzip ได้
+# - คิวมีขนาดจำกัด (`max_queue_size`) ถ้า disk เขียนไม่ทัน `write` จะรอ (backpressure) แทนการกิน memory ไม่จำกัด
+
+# %%
+class JsonlSink:
+    """
+    Append-only JSON Lines writer พร้อม rotation
+    """
+    
+    _STOP = object()
+    
+    def __init__(self, directory: str, name: str, max_bytes: int = 64 * 1024 * 1024,
+                 rotate_seconds: Optional[float] = None, compress: bool = True,
+                 batch_size: int = 1000, flush_interval: float = 1.0, max_queue_size: int = 100_000):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.name = name
+        self.path = os.path.join(directory, f'{name}.jsonl')
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.compress = compress
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        
+        self.records_written = 0
+        self.files_rotated = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self._file = None
+        self._opened_at = 0.0
+        self._thread = threading.Thread(target=self._run, name=f'jsonl-sink-{name}', daemon=True)
+        self._thread.start()
+    
+    def write(self, record: Dict):
+        """ส่ง record เข้าคิว (block เฉพาะเมื่อคิวเต็ม)"""
+        self._queue.put(record)
+    
+    def flush(self):
+        """รอจนทุก record ที่ส่งมาก่อนหน้าถูกเขียนลงไฟล์"""
+        self._queue.join()
+    
+    def close(self):
+        """เขียน records ที่ค้างทั้งหมดแล้วปิดไฟล์"""
+        if not self._thread.is_alive():
+            return
+        self._queue.put(self._STOP)
+        self._thread.join()
+    
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if self._file is not None and self._should_rotate():
+                    self._rotate()
+                continue
+            
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            stop = any(record is self._STOP for record in batch)
+            records = [record for record in batch if record is not self._STOP]
+            try:
+                if records:
+                    self._write_batch(records)
+            except Exception:
+                logger.exception(f"JsonlSink '{self.name}' failed to write {len(records)} records")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            
+            if stop:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                return
+    
+    def _write_batch(self, records: List[Dict]):
+        if self._file is None:
+            self._open()
+        elif self._should_rotate():
+            self._rotate()
+        
+        lines = ''.join(json.dumps(r, separators=(',', ':')) + '\n' for r in records)
+        self._file.write(lines.encode('utf-8'))
+        self._file.flush()
+        self.records_written += len(records)
+    
+    def _open(self):
+        self._file = open(self.path, 'ab')
+        self._opened_at = time.monotonic()
+    
+    def _should_rotate(self) -> bool:
+        if self._file.tell() == 0:
+            return False
+        if self._file.tell() >= self.max_bytes:
+            return True
+        return (self.rotate_seconds is not None
+                and time.monotonic() - self._opened_at >= self.rotate_seconds)
+    
+    def _rotate(self):
+        """ปิดไฟล์ปัจจุบัน เปลี่ยนชื่อพร้อม timestamp แล้วเปิดไฟล์ใหม่"""
+        self._file.close()
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        rotated = os.path.join(self.directory, f'{self.name}-{stamp}-{self.files_rotated:05d}.jsonl')
+        os.replace(self.path, rotated)
+        if self.compress:
+            with open(rotated, 'rb') as src, gzip.open(rotated + '.gz', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(rotated)
+        self.files_rotated += 1
+        self._open()
+    
+    def files(self) -> List[str]:
+        """ไฟล์ทั้งหมดของ sink เรียงจากเก่าไปใหม่ (ไฟล์ที่กำลังเขียนอยู่ท้ายสุด)"""
+        rotated = sorted(
+            f for f in os.listdir(self.directory)
+            if f.startswith(f'{self.name}-') and (f.endswith('.jsonl') or f.endswith('.jsonl.gz'))
+        )
+        paths = [os.path.join(self.directory, f) for f in rotated]
+        if os.path.exists(self.path):
+            paths.append(self.path)
+        return paths
+    
+    def write_manifest(self, filepath: str):
+        """flush แล้วเขียนไฟล์ JSON ที่ชี้ไปยังไฟล์ของ sink (ใช้แทน dump ทั้ง history ลง filepath)"""
+        self.flush()
+        manifest = {
+            'sink': self.name,
+            'format': 'jsonl',
+            'directory': self.directory,
+            'files': self.files(),
+            'records_written': self.records_written
+        }
+        with open(filepath, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        logger.info(f"{self.name} records are in {self.directory} (manifest written to {filepath})")
+    
+    def read_records(self):
+        """อ่าน records ทั้งหมดกลับมา (รวมไฟล์ที่ rotate/บีบอัดแล้ว)"""
+        for path in self.files():
+            opener = gzip.open if path.endswith('.gz') else open
+            with opener(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    yield json.loads(line)
+
+# %% [markdown]
+# ### Indexed Alert Store
+# `AlertManager.alerts` แบบ list โตไม่จำกัด, `get_active_alerts` ต้องสแกนทั้งหมด และ acknowledge ด้วย list index
+# AlertStore เก็บ alerts แบบ dict ตาม `alert_id` พร้อม indexes:
+# - active (ยังไม่ acknowledge) แยกตาม feature และ severity -> query active alerts ไม่ขึ้นกับจำนวน alerts ทั้งหมด
+# - acknowledge ด้วย `alert_id` O(1)
+# - dedup: drift ซ้ำของ feature/severity ที่ alert เดิมยังไม่ถูก acknowledge จะเพิ่ม `occurrences` แทนการสร้าง alert ใหม่
+# - retention: เกิน `alert_retention` จะย้าย alerts เก่า (acknowledged ก่อน) ไปเก็บใน SQLite เป็น batch
+#   ถ้าต้อง evict alerts ที่ยัง active จะ log warning และนับ (`total_active_evicted`) เพราะ alerts เหล่านั้น
+#   หายจาก active queries และ dedup (และหายไปเลยถ้าไม่มี archive)
+
+# %%
+class AlertStore:
+    """In-memory alerts แบบมี index + SQLite archive สำหรับ alerts ที่เกิน retention"""
+    
+    def __init__(self, max_alerts: int = 10000, archive_path: Optional[str] = None, dedup: bool = True):
+        self.max_alerts = max_alerts
+        self.archive_path = archive_path
+        self.dedup = dedup
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.total_created = 0
+        self.total_deduplicated = 0
+        self.total_archived = 0
+        self.total_active_evicted = 0  # alerts ที่ยังไม่ acknowledge แต่ถูก evict เพราะเกิน retention
+        
+        # alert_id -> Alert (insertion order = เก่าไปใหม่)
+        self._alerts: Dict[int, Alert] = {}
+        self._by_feature: Dict[str, Dict[int, Alert]] = {}
+        self._active: Dict[int, Alert] = {}
+        self._active_by_feature: Dict[str, Dict[int, Alert]] = {}
+        self._active_by_severity: Dict[AlertSeverity, Dict[int, Alert]] = {s: {} for s in AlertSeverity}
+        self._acknowledged: Dict[int, Alert] = {}
+        self._open: Dict[tuple, Alert] = {}  # (feature, severity) -> active alert สำหรับ dedup
+        # alert_id -> version ของการเปลี่ยนแปลงล่าสุด (เรียงตาม version) สำหรับ changes_since
+        self.version = 0
+        self._changes: Dict[int, int] = {}
+        
+        self._db = None
+        if archive_path:
+            os.makedirs(os.path.dirname(archive_path) or '.', exist_ok=True)
+            self._db = sqlite3.connect(archive_path, check_same_thread=False)
+            self._db.executescript("""
+                PRAGMA journal_mode = WAL;
+                PRAGMA synchronous = NORMAL;
+                CREATE TABLE IF NOT EXISTS alerts (
+                    alert_id INTEGER PRIMARY KEY,
+                    timestamp TEXT, feature TEXT, severity TEXT, message TEXT, details TEXT,
+                    acknowledged INTEGER, occurrences INTEGER, last_seen TEXT
+                );
+                CREATE INDEX IF NOT EXISTS alerts_feature ON alerts (feature, timestamp);
+            """)
+            # ต่อจาก alert_id ล่าสุดใน archive (เช่นหลัง restart)
+            row = self._db.execute('SELECT MAX(alert_id) FROM alerts').fetchone()
+            if row[0] is not None:
+                self.next_id = row[0] + 1
+    
+    def __len__(self) -> int:
+        return len(self._alerts)
+    
+    def add(self, alert: Alert) -> Optional[Alert]:
+        """
+        เพิ่ม alert (กำหนด alert_id ให้) คืน alert ที่เพิ่ม
+        
+        ถ้า dedup และมี active alert ของ feature/severity เดิม: อัปเดต alert เดิมแล้วคืน None
+        """
+        with self.lock:
+            key = (alert.feature, alert.severity)
+            existing = self._open.get(key) if self.dedup else None
+            if existing is not None:
+                existing.occurrences += 1
+                existing.last_seen = alert.timestamp
+                existing.details = alert.details
+                self.total_deduplicated += 1
+                self._touch(existing.alert_id)
+                return None
+            
+            alert.alert_id = self.next_id
+            self.next_id += 1
+            self.total_created += 1
+            self._alerts[alert.alert_id] = alert
+            self._by_feature.setdefault(alert.feature, {})[alert.alert_id] = alert
+            if alert.acknowledged:
+                self._acknowledged[alert.alert_id] = alert
+            else:
+                self._index_active(alert)
+            self._touch(alert.alert_id)
+            
+            if len(self._alerts) > self.max_alerts:
+                self._evict()
+            return alert
+    
+    def _touch(self, alert_id: int):
+        self.version += 1
+        self._changes.pop(alert_id, None)
+        self._changes[alert_id] = self.version
+    
+    def changes_since(self, version: int) -> Optional[List[Alert]]:
+        """
+        Alerts ใน memory ที่ถูกเพิ่ม/แก้ไขหลัง version (เก่าไปใหม่) ใช้เวลาตามจำนวนที่เปลี่ยน
+        
+        คืน None ถ้า version ไม่ถูกต้อง (เช่นมาจาก store อื่น)
+        """
+        with self.lock:
+            if version < 0 or version > self.version:
+                return None
+            changed = []
+            for alert_id, alert_version in reversed(self._changes.items()):
+                if alert_version <= version:
+                    break
+                changed.append(self._alerts[alert_id])
+            return changed[::-1]
+    
+    def _index_active(self, alert: Alert):
+        self._active[alert.alert_id] = alert
+        self._active_by_feature.setdefault(alert.feature, {})[alert.alert_id] = alert
+        self._active_by_severity[alert.severity][alert.alert_id] = alert
+        self._open[(alert.feature, alert.severity)] = alert
+    
+    def _unindex_active(self, alert: Alert):
+        self._active.pop(alert.alert_id, None)
+        self._active_by_feature.get(alert.feature, {}).pop(alert.alert_id, None)
+        self._active_by_severity[alert.severity].pop(alert.alert_id, None)
+        if self._open.get((alert.feature, alert.severity)) is alert:
+            del self._open[(alert.feature, alert.severity)]
+    
+    def acknowledge(self, alert_id: int) -> bool:
+        """Acknowledge ด้วย alert_id (O(1) ใน memory, primary key lookup ใน archive)"""
+        with self.lock:
+            alert = self._alerts.get(alert_id)
+            if alert is not None:
+                if not alert.acknowledged:
+                    alert.acknowledged = True
+                    self._unindex_active(alert)
+                    self._acknowledged[alert_id] = alert
+                    self._touch(alert_id)
+                return True
+            if self._db is not None:
+                cursor = self._db.execute('UPDATE alerts SET acknowledged = 1 WHERE alert_id = ?', (alert_id,))
+                self._db.commit()
+                return cursor.rowcount > 0
+            return False
+    
+    def get_open(self, feature: str, severity: AlertSeverity) -> Optional[Alert]:
+        """Active alert ของ feature/severity ที่ alert ซ้ำจะถูก dedup เข้าไป"""
+        return self._open.get((feature, severity))
+    
+    def get(self, alert_id: int) -> Optional[Alert]:
+        alert = self._alerts.get(alert_id)
+        if alert is None and self._db is not None:
+            archived = self.archived(alert_id=alert_id)
+            alert = archived[0] if archived else None
+        return alert
+    
+    def query(self, feature: Optional[str] = None, severity: Optional[AlertSeverity] = None,
+              acknowledged: Optional[bool] = None) -> List[Alert]:
+        """Alerts ใน memory ตาม filter (เก่าไปใหม่) เลือก index ที่เล็กที่สุดก่อนกรอง"""
+        with self.lock:
+            if acknowledged is False:
+                candidates = [self._active]
+                if feature is not None:
+                    candidates.append(self._active_by_feature.get(feature, {}))
+                if severity is not None:
+                    candidates.append(self._active_by_severity[severity])
+            else:
+                candidates = [self._acknowledged if acknowledged else self._alerts]
+                if feature is not None:
+                    candidates.append(self._by_feature.get(feature, {}))
+            base = min(candidates, key=len)
+            return [
+                a for a in base.values()
+                if (feature is None or a.feature == feature)
+                and (severity is None or a.severity == severity)
+                and (acknowledged is None or a.acknowledged == acknowledged)
+            ]
+    
+    def count_active(self, severity: Optional[AlertSeverity] = None) -> int:
+        if severity is None:
+            return len(self._active)
+        return len(self._active_by_severity[severity])
+    
+    def _evict(self):
+        """ย้าย alerts เก่าออกจาก memory ทีละ batch (10% ของ retention) acknowledged ก่อน"""
+        n_evict = len(self._alerts) - self.max_alerts + max(1, self.max_alerts // 10)
+        evicted = []
+        for pool in (self._acknowledged, self._alerts):
+            for alert_id in list(itertools.islice(pool, n_evict - len(evicted))):
+                alert = self._alerts.pop(alert_id)
+                self._changes.pop(alert_id, None)
+                self._by_feature[alert.feature].pop(alert_id)
+                if alert.acknowledged:
+                    del self._acknowledged[alert_id]
+                else:
+                    self._unindex_active(alert)
+                evicted.append(alert)
+        
+        active_evicted = sum(not a.acknowledged for a in evicted)
+        if active_evicted:
+            self.total_active_evicted += active_evicted
+            logger.warning(
+                f"Alert retention ({self.max_alerts}) evicted {active_evicted} unacknowledged alerts: "
+                + ("moved to the archive, no longer active" if self._db is not None
+                   else "no alert_archive_path, they are dropped")
+            )
+        
+        if self._db is not None:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO alerts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [self._row(a) for a in evicted]
+            )
+            self._db.commit()
+        self.total_archived += len(evicted)
+    
+    @staticmethod
+    def _row(alert: Alert) -> tuple:
+        return (
+            alert.alert_id, alert.timestamp.isoformat(), alert.feature, alert.severity.value,
+            alert.message, json.dumps(alert.details, default=str), int(alert.acknowledged),
+            alert.occurrences, (alert.last_seen or alert.timestamp).isoformat()
+        )
+    
+    def archived(self, feature: Optional[str] = None, severity: Optional[AlertSeverity] = None,
+                 acknowledged: Optional[bool] = None, alert_id: Optional[int] = None,
+                 limit: int = 100) -> List[Alert]:
+        """Query alerts ใน SQLite archive (ใหม่ไปเก่า)"""
+        if self._db is None:
+            return []
+        clauses, params = [], []
+        for column, value in (('feature', feature), ('alert_id', alert_id),
+                              ('severity', severity.value if severity else None),
+                              ('acknowledged', None if acknowledged is None else int(acknowledged))):
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        with self.lock:
+            rows = self._db.execute(
+                f'SELECT * FROM alerts {where} ORDER BY alert_id DESC LIMIT ?', params + [limit]
+            ).fetchall()
+        return [
+            Alert(
+                timestamp=datetime.fromisoformat(row[1]), feature=row[2],
+                severity=AlertSeverity(row[3]), message=row[4], details=json.loads(row[5]),
+                acknowledged=bool(row[6]), alert_id=row[0], occurrences=row[7],
+                last_seen=datetime.fromisoformat(row[8])
+            )
+            for row in rows
+        ]
+    
+    def state(self) -> Dict:
+        """State สำหรับ checkpoint (alerts ใน memory + counters, archive อยู่บน disk แล้ว)"""
+        with self.lock:
+            return {
+                'alerts': list(self._alerts.values()),
+                'next_id': self.next_id,
+                'version': self.version,
+                'total_created': self.total_created,
+                'total_deduplicated': self.total_deduplicated,
+                'total_archived': self.total_archived,
+                'total_active_evicted': self.total_active_evicted
+            }
+    
+    def load_state(self, state: Dict):
+        with self.lock:
+            for alert in state['alerts']:
+                self._alerts[alert.alert_id] = alert
+                self._by_feature.setdefault(alert.feature, {})[alert.alert_id] = alert
+                if alert.acknowledged:
+                    self._acknowledged[alert.alert_id] = alert
+                else:
+                    self._index_active(alert)
+            self.version = state['version']
+            for alert in state['alerts']:
+                self._touch(alert.alert_id)
+            self.next_id = max(self.next_id, state['next_id'])
+            self.total_created = state['total_created']
+            self.total_deduplicated = state['total_deduplicated']
+            self.total_archived = state['total_archived']
+            self.total_active_evicted = state.get('total_active_evicted', 0)
+    
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+# %% [markdown]
+# ### Async Alert Dispatch
+# `create_alert` ถูกเรียกใน path ของ `process_batch` ถ้าส่ง webhook ตรงๆ receiver ที่ช้าจะทำให้ ingest ช้าตาม
+# AlertDispatcher แยกการส่งออกไปทำใน event loop ของ background thread:
+# - `dispatch` แค่ใส่ alert ลง bounded queue (คิวเต็ม -> ทิ้งและนับ ไม่ block ผู้เรียก)
+# - รวม alerts เป็น batch (ครบ `batch_size` หรือครบ `flush_interval`) แล้วกระจายให้ทุก sink
+# - แต่ละ sink มีคิวและ workers ของตัวเอง (`concurrency`) sink ที่ช้าไม่หน่วง sink อื่น
+# - ส่งไม่สำเร็จ -> retry พร้อม exponential backoff
+#
+# Sinks: `LogAlertSink`, `FileAlertSink` (JSON Lines), `WebhookAlertSink` (HTTP POST)
+# หรือ subclass `AlertSink` แล้ว implement `async send(alerts)`
+
+# %%
+class AlertSink:
+    """Base class: override `send` ให้ส่ง batch ของ alert dicts (raise เมื่อไม่สำเร็จเพื่อ retry)"""
+    
+    def __init__(self, name: str, concurrency: int = 1):
+        self.name = name
+        self.concurrency = concurrency
+    
+    async def send(self, alerts: List[Dict]):
+        raise NotImplementedError
+
+class LogAlertSink(AlertSink):
+    """Log alerts ตาม severity"""
+    
+    LEVELS = {'critical': logging.CRITICAL, 'warning': logging.WARNING, 'info': logging.INFO}
+    
+    def __init__(self, name: str = 'log'):
+        super().__init__(name)
+    
+    async def send(self, alerts: List[Dict]):
+        for alert in alerts:
+            logger.log(self.LEVELS.get(alert['severity'], logging.INFO), alert['message'])
+
+class FileAlertSink(AlertSink):
+    """Append alerts เป็น JSON Lines"""
+    
+    def __init__(self, path: str, name: str = 'file'):
+        super().__init__(name)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+    
+    async def send(self, alerts: List[Dict]):
+        await asyncio.to_thread(self._append, alerts)
+    
+    def _append(self, alerts: List[Dict]):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(a, separators=(',', ':'), default=str) + '\n' for a in alerts))
+
+class WebhookAlertSink(AlertSink):
+    """POST {"alerts": [...]} เป็น JSON (HTTP status ที่ไม่ใช่ 2xx = ล้มเหลว)"""
+    
+    def __init__(self, url: str, name: str = 'webhook', timeout: float = 5.0,
+                 concurrency: int = 4, headers: Optional[Dict[str, str]] = None):
+        super().__init__(name, concurrency)
+        self.url = url
+        self.timeout = timeout
+        self.headers = headers or {}
+    
+    async def send(self, alerts: List[Dict]):
+        await asyncio.to_thread(self._post, alerts)
+    
+    def _post(self, alerts: List[Dict]):
+        body = json.dumps({'alerts': alerts}, default=str).encode('utf-8')
+        request = urllib.request.Request(
+            self.url, data=body, method='POST',
+            headers={'Content-Type': 'application/json', **self.headers}
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+class AlertDispatcher:
+    """
+    ส่ง alerts ไปยัง sinks จาก asyncio event loop ใน background thread
+    
+    stats[sink.name]: delivered / failed (หลัง retry ครบ) / retries / dropped (คิวของ sink เต็ม)
+    dropped: alerts ที่ถูกทิ้งเพราะคิวหลักเต็ม
+    """
+    
+    _STOP = object()
+    
+    def __init__(self, sinks: List[AlertSink], queue_size: int = 10000, batch_size: int = 100,
+                 flush_interval: float = 0.5, max_retries: int = 3, backoff_seconds: float = 0.5):
+        self.sinks = list(sinks)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.sink_queue_batches = max(1, queue_size // batch_size)
+        
+        self.dropped = 0
+        self.stats = {
+            sink.name: {'delivered': 0, 'failed': 0, 'retries': 0, 'dropped': 0}
+            for sink in self.sinks
+        }
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._pending = 0  # alerts ที่ dispatch แล้วแต่ยังส่งไม่ครบทุก sink
+        self._settled = threading.Condition()
+        self._thread = threading.Thread(target=asyncio.run, args=(self._run(),), name='alert-dispatch', daemon=True)
+        self._thread.start()
+    
+    @classmethod
+    def from_config(cls, config: MonitoringConfig) -> 'AlertDispatcher':
+        return cls(
+            config.alert_sinks,
+            queue_size=config.alert_queue_size,
+            batch_size=config.alert_batch_size,
+            flush_interval=config.alert_flush_seconds,
+            max_retries=config.alert_max_retries,
+            backoff_seconds=config.alert_retry_backoff_seconds
+        )
+    
+    def dispatch(self, alert: Alert) -> bool:
+        """ใส่ alert ลงคิว (ไม่ block) คืน False ถ้าคิวเต็มและ alert ถูกทิ้ง"""
+        with self._settled:
+            self._pending += 1
+        try:
+            self._queue.put_nowait(alert.to_dict())
+            return True
+        except queue.Full:
+            self.dropped += 1
+            self._settle(1)
+            return False
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """รอจน alerts ที่ dispatch ไปแล้วส่งครบทุก sink (สำเร็จหรือล้มเหลวหลัง retry)"""
+        with self._settled:
+            return self._settled.wait_for(lambda: self._pending == 0, timeout)
+    
+    def close(self, timeout: Optional[float] = 10.0):
+        """ส่ง alerts ที่ค้างให้เสร็จ (รอไม่เกิน timeout) แล้วหยุด event loop"""
+        if not self._thread.is_alive():
+            return
+        self.flush(timeout)
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+    
+    def _settle(self, n: int):
+        with self._settled:
+            self._pending -= n
+            if self._pending == 0:
+                self._settled.notify_all()
+    
+    def _next_batch(self) -> tuple:
+        """(batch, stop) รอ alert แรกแล้วรวมต่อจนครบ batch_size หรือ flush_interval (รันใน thread)"""
+        first = self._queue.get()
+        if first is self._STOP:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is self._STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+    
+    async def _run(self):
+        sink_queues = {sink.name: asyncio.Queue(maxsize=self.sink_queue_batches) for sink in self.sinks}
+        workers = [
+            asyncio.create_task(self._sink_worker(sink, sink_queues[sink.name]))
+            for sink in self.sinks for _ in range(sink.concurrency)
+        ]
+        
+        stop = False
+        while not stop:
+            batch, stop = await asyncio.to_thread(self._next_batch)
+            if not batch:
+                continue
+            if not self.sinks:
+                self._settle(len(batch))
+                continue
+            remaining = [len(self.sinks)]  # settle เมื่อทุก sink จัดการ batch นี้เสร็จ
+            for sink in self.sinks:
+                try:
+                    sink_queues[sink.name].put_nowait((batch, remaining))
+                except asyncio.QueueFull:
+                    self.stats[sink.name]['dropped'] += len(batch)
+                    self._batch_done(batch, remaining)
+        
+        for sink_queue in sink_queues.values():
+            await sink_queue.join()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+    
+    async def _sink_worker(self, sink: AlertSink, sink_queue: asyncio.Queue):
+        while True:
+            batch, remaining = await sink_queue.get()
+            try:
+                await self._deliver(sink, batch)
+            finally:
+                sink_queue.task_done()
+                self._batch_done(batch, remaining)
+    
+    async def _deliver(self, sink: AlertSink, batch: List[Dict]):
+        stats = self.stats[sink.name]
+        for attempt in range(self.max_retries + 1):
+            try:
+                await sink.send(batch)
+                stats['delivered'] += len(batch)
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    stats['failed'] += len(batch)
+                    logger.warning(f"Alert sink '{sink.name}' failed to deliver {len(batch)} alerts: {e}")
+                    return
+                stats['retries'] += 1
+                await asyncio.sleep(self.backoff_seconds * 2 ** attempt)
+    
+    def _batch_done(self, batch: List[Dict], remaining: List[int]):
+        remaining[0] -= 1
+        if remaining[0] == 0:
+            self._settle(len(batch))
 
 # %%
 class AlertManager:
@@ -3844,21 +6641,37 @@ class AlertManager:
     Component สำหรับจัดการ alerts
     """
     
-    def __init__(self, config: MonitoringConfig):
+    def __init__(self, config: MonitoringConfig, instrumentation: Optional[Instrumentation] = None,
+                 clock: Optional[Callable[[], datetime]] = None):
         self.config = config
-        self.alerts: List[Alert] = []
+        self.instrumentation = instrumentation or Instrumentation()
+        self.clock = clock or datetime.now  # replay ใช้ event time แทนเวลาจริง
+        self.store = AlertStore(config.alert_retention, config.alert_archive_path, config.alert_dedup)
+        self.dispatcher = AlertDispatcher.from_config(config) if config.alert_sinks else None
         self.last_alert_time: Dict[str, datetime] = {}
+        self.sink: Optional[JsonlSink] = None
+        if config.sink_dir:
+            self.sink = JsonlSink(
+                config.sink_dir, 'alerts',
+                max_bytes=config.sink_max_bytes,
+                rotate_seconds=config.sink_rotate_seconds,
+                compress=config.sink_compress
+            )
     
     def should_alert(self, feature: str) -> bool:
         """Check if we should send alert (cooldown)"""
         if feature not in self.last_alert_time:
             return True
         
-        elapsed = datetime.now() - self.last_alert_time[feature]
+        elapsed = self.clock() - self.last_alert_time[feature]
         return elapsed > timedelta(minutes=self.config.alert_cooldown_minutes)
     
     def create_alert(self, drift_result: DriftResult) -> Optional[Alert]:
         """Create alert based on drift result"""
+        with self.instrumentation.stage('alerting'):
+            return self._create_alert(drift_result)
+    
+    def _create_alert(self, drift_result: DriftResult) -> Optional[Alert]:
         if not drift_result.drift_detected:
             return None
         
@@ -3882,53 +6695,696 @@ class AlertManager:
             timestamp=drift_result.timestamp,
             severity=severity,
             message=message,
-            details=drift_result.to_dict()
+            details=drift_result.to_dict(),
+            feature=drift_result.feature
         )
         
-        self.alerts.append(alert)
-        self.last_alert_time[drift_result.feature] = datetime.now()
+        self.last_alert_time[drift_result.feature] = self.clock()
+        if self.store.add(alert) is None:
+            if self.config.alert_logging:
+                logger.info(f"{message} (repeat of an unacknowledged alert)")
+            if self.sink is not None:
+                # record ใหม่ของ alert เดิม (occurrences/last_seen ที่อัปเดต)
+                existing = self.store.get_open(alert.feature, alert.severity)
+                if existing is not None:
+                    self.sink.write(existing.to_dict())
+            return None
+        if self.sink is not None:
+            self.sink.write(alert.to_dict())
+        if self.dispatcher is not None:
+            # ส่งแบบ async (รวมถึง log ถ้ามี LogAlertSink) ไม่ block ผู้เรียก
+            self.dispatcher.dispatch(alert)
+            return alert
         
         # Log based on severity
-        if severity == AlertSeverity.CRITICAL:
-            logger.critical(message)
-        elif severity == AlertSeverity.WARNING:
-            logger.warning(message)
-        else:
-            logger.info(message)
+        if self.config.alert_logging:
+            if severity == AlertSeverity.CRITICAL:
+                logger.critical(message)
+            elif severity == AlertSeverity.WARNING:
+                logger.warning(message)
+            else:
+                logger.info(message)
         
         return alert
     
-    def get_active_alerts(self) -> List[Alert]:
-        """Get all unacknowledged alerts"""
-        return [a for a in self.alerts if not a.acknowledged]
-    
-    def acknowledge_alert(self, index: int):
-        """Acknowledge an alert"""
-        if 0 <= index < len(self.alerts):
-            self.alerts[index].acknowledged = True
+    @property
+    def alerts(self) -> List[Alert]:
+        """Alerts ที่ยังอยู่ใน memory (เก่าไปใหม่)"""
+        return self.store.query()
+    
+    def get_active_alerts(self, feature: Optional[str] = None,
+                          severity: Optional[AlertSeverity] = None) -> List[Alert]:
+        """Get unacknowledged alerts (จาก index ไม่สแกน alerts ทั้งหมด)"""
+        return self.store.query(feature=feature, severity=severity, acknowledged=False)
+    
+    def acknowledge_alert(self, alert_id: int) -> bool:
+        """Acknowledge an alert by alert_id"""
+        acknowledged = self.store.acknowledge(alert_id)
+        if acknowledged and self.sink is not None:
+            alert = self.store.get(alert_id)
+            if alert is not None:
+                self.sink.write(alert.to_dict())
+        return acknowledged
+    
+    def close(self):
+        """ส่ง alerts ที่ค้างใน dispatcher ให้เสร็จ แล้วปิด sink และ archive"""
+        if self.dispatcher is not None:
+            self.dispatcher.close()
+        if self.sink is not None:
+            self.sink.close()
+        self.store.close()
     
     def save_alerts(self, filepath: str):
-        """Save alerts to file"""
-        alerts_data = [a.to_dict() for a in self.alerts]
+        """
+        Save alerts to file
+        
+        ถ้ามี sink: flush sink แล้วเขียน manifest ที่ชี้ไปยังไฟล์ alerts.jsonl ลง filepath
+        เพราะ alerts.jsonl เป็น log ของทุกการเปลี่ยนแปลงอยู่แล้ว
+        (หนึ่ง record ต่อการสร้าง, dedup และ acknowledge; record ล่าสุดของแต่ละ alert_id คือ state ปัจจุบัน)
+        
+        ไม่มี sink: เขียน alerts ใน archive (ถ้ามี) ตามด้วย alerts ใน memory เรียงตาม alert_id
+        """
+        if self.sink is not None:
+            self.sink.write_manifest(filepath)
+            return
+        archived = self.store.archived(limit=-1)[::-1]  # LIMIT -1 = ทั้งหมด
+        alerts_data = [a.to_dict() for a in archived + self.alerts]
         with open(filepath, 'w') as f:
             json.dump(alerts_data, f, indent=2)
 
+# %% [markdown]
+# ### Columnar Results Store
+# เก็บ DriftResult เป็น NumPy structured array (~90 bytes ต่อ result) แทน list ของ dataclass
+# - ข้อมูลใหม่เขียนลง active segment ขนาดคงที่ เมื่อเต็มจะ sort ตาม (feature, timestamp)
+#   แล้ว seal เป็น segment (spill เป็นไฟล์ `.npy` ถ้ากำหนด directory แล้วเปิดแบบ memory-map ตอน query)
+# - แต่ละ segment มี offsets ต่อ feature -> range query ใช้ `np.searchsorted` ได้ O(log n)
+# - แต่ละ segment เก็บ permutation กลับเป็นลำดับที่ append (int32 ต่อ row) -> iterate และ `save_results`
+#   ได้ลำดับเดียวกับที่ตรวจ
+# - ค่าล่าสุดของแต่ละ feature เก็บแยกไว้ -> latest lookup O(1)
+
+# %%
+DRIFT_TYPES = list(DriftType)
+
+RESULT_DTYPE = np.dtype([
+    ('timestamp', 'datetime64[us]'),
+    ('feature_id', np.int32),
+    ('drift_detected', np.bool_),
+    ('drift_type', np.int8),
+    ('psi', np.float64),
+    ('ks_statistic', np.float64),
+    ('ks_pvalue', np.float64),
+    ('reference_mean', np.float64),
+    ('current_mean', np.float64),
+    ('reference_std', np.float64),
+    ('current_std', np.float64)
+])
+
+@dataclass
+class ResultSegment:
+    """Segment ที่ seal แล้ว: rows เรียงตาม (feature_id, timestamp)"""
+    start: np.datetime64
+    end: np.datetime64
+    feature_offsets: np.ndarray
+    rows: Optional[np.ndarray] = None  # None = อยู่บน disk
+    path: Optional[str] = None
+    order: Optional[np.ndarray] = None  # rows[order] = ลำดับที่ append (None = ไม่ทราบ ใช้ลำดับที่ sort)
+    order_path: Optional[str] = None  # ไฟล์ของ order ใน checkpoint (restore แล้ว)
+
+class DriftResultStore:
+    """
+    Append-only columnar store สำหรับ DriftResult history
+    """
+    
+    METRIC_FIELDS = list(DriftResult.METRIC_FIELDS)
+    
+    def __init__(self, segment_size: int = 10000, storage_dir: Optional[str] = None):
+        self.segment_size = segment_size
+        self.storage_dir = storage_dir
+        if storage_dir:
+            os.makedirs(storage_dir, exist_ok=True)
+        
+        self.feature_ids: Dict[str, int] = {}
+        self.feature_names: List[str] = []
+        self.feature_tests: Dict[int, str] = {}  # feature_id -> test_name (คงที่ต่อ feature)
+        self.segments: List[ResultSegment] = []
+        self._segment_ends: List[np.datetime64] = []
+        self._active = np.empty(segment_size, dtype=RESULT_DTYPE)
+        self._active_size = 0
+        self._active_index: Dict[int, List[int]] = {}
+        self._latest: Dict[int, np.void] = {}
+        self._n_sealed = 0
+        # segment ล่าสุดที่ seal แล้วตามลำดับที่ append (สำหรับ since)
+        self._last_sealed: Optional[np.ndarray] = None
+    
+    def __len__(self) -> int:
+        return self._n_sealed + self._active_size
+    
+    def __iter__(self):
+        """วนทุก result ตามลำดับที่ append"""
+        for segment in self.segments:
+            rows = self._load(segment)
+            for row in (rows if segment.order is None else rows[segment.order]):
+                yield self._to_result(row)
+        for row in self._active[:self._active_size]:
+            yield self._to_result(row)
+    
+    def _feature_id(self, feature: str) -> int:
+        if feature not in self.feature_ids:
+            self.feature_ids[feature] = len(self.feature_names)
+            self.feature_names.append(feature)
+        return self.feature_ids[feature]
+    
+    def append(self, result: DriftResult):
+        """เพิ่ม result หนึ่งรายการ"""
+        feature_id = self._feature_id(result.feature)
+        self.feature_tests[feature_id] = result.test_name
+        row = self._active[self._active_size]
+        row['timestamp'] = np.datetime64(result.timestamp, 'us')
+        row['feature_id'] = feature_id
+        row['drift_detected'] = result.drift_detected
+        row['drift_type'] = DRIFT_TYPES.index(result.drift_type)
+        for name in self.METRIC_FIELDS:
+            row[name] = getattr(result, name)
+        
+        self._active_index.setdefault(feature_id, []).append(self._active_size)
+        self._latest[feature_id] = row.copy()
+        self._active_size += 1
+        if self._active_size == self.segment_size:
+            self._seal()
+    
+    def extend(self, results: List[DriftResult]):
+        for result in results:
+            self.append(result)
+    
+    def _seal(self):
+        """Sort active segment ตาม (feature, timestamp) แล้วเก็บเป็น segment"""
+        rows = self._active[:self._active_size]
+        self._last_sealed = rows.copy()
+        sort_order = np.lexsort((rows['timestamp'], rows['feature_id']))
+        rows = rows[sort_order]
+        counts = np.bincount(rows['feature_id'], minlength=len(self.feature_names))
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        segment = ResultSegment(
+            start=rows['timestamp'].min(),
+            end=rows['timestamp'].max(),
+            feature_offsets=offsets,
+            order=np.argsort(sort_order).astype(np.int32)
+        )
+        
+        if self.storage_dir:
+            segment.path = os.path.join(self.storage_dir, f'segment_{len(self.segments):06d}.npy')
+            np.save(segment.path, rows)
+        else:
+            segment.rows = rows.copy()
+        
+        self.segments.append(segment)
+        self._segment_ends.append(segment.end)
+        self._n_sealed += len(rows)
+        self._active_size = 0
+        self._active_index = {}
+    
+    def state(self) -> Dict:
+        """
+        State สำหรับ checkpoint: copy ของ active rows และ latest rows
+        
+        sealed segments ไม่ถูกแก้ไขอีก จึงคืน reference ไปตรงๆ
+        """
+        return {
+            'feature_names': list(self.feature_names),
+            'feature_tests': dict(self.feature_tests),
+            'segments': list(self.segments),
+            'active': self._active[:self._active_size].copy(),
+            'latest': np.array([self._latest[i] for i in range(len(self.feature_names))], dtype=RESULT_DTYPE)
+        }
+    
+    def load_state(self, state: Dict):
+        """คืนค่า state จาก checkpoint (แทนที่ข้อมูลเดิมทั้งหมด)"""
+        self.feature_names = list(state['feature_names'])
+        self.feature_ids = {name: i for i, name in enumerate(self.feature_names)}
+        self.feature_tests = dict(state.get('feature_tests', {}))
+        self.segments = list(state['segments'])
+        self._segment_ends = [segment.end for segment in self.segments]
+        self._n_sealed = sum(int(segment.feature_offsets[-1]) for segment in self.segments)
+        
+        active = state['active']
+        self._active_size = len(active)
+        self._active[:self._active_size] = active
+        self._active_index = {}
+        for i, feature_id in enumerate(active['feature_id'].tolist()):
+            self._active_index.setdefault(feature_id, []).append(i)
+        self._latest = {i: row.copy() for i, row in enumerate(state['latest'])}
+        self._last_sealed = None
+    
+    def since(self, cursor: int) -> Optional[np.ndarray]:
+        """
+        Rows ที่ append หลังตำแหน่ง cursor (= len(store) ตอนอ่านครั้งก่อน) ตามลำดับที่ append
+        
+        ใช้เวลาตามจำนวน rows ใหม่ ถ้า cursor เก่ากว่า segment ล่าสุดที่ seal ไปแล้ว
+        (ลำดับเดิมไม่ได้เก็บไว้) หรือไม่ถูกต้อง คืน None -> ต้องโหลดใหม่ทั้งหมด
+        """
+        if cursor < 0 or cursor > len(self):
+            return None
+        active = self._active[:self._active_size]
+        if cursor >= self._n_sealed:
+            return active[cursor - self._n_sealed:].copy()
+        if self._last_sealed is not None and cursor >= self._n_sealed - len(self._last_sealed):
+            start = cursor - (self._n_sealed - len(self._last_sealed))
+            return np.concatenate([self._last_sealed[start:], active])
+        return None
+    
+    @staticmethod
+    def _load(segment: ResultSegment) -> np.ndarray:
+        if segment.rows is not None:
+            return segment.rows
+        return np.load(segment.path, mmap_mode='r')
+    
+    def latest(self, feature: str) -> Optional[DriftResult]:
+        """Result ล่าสุดของ feature (O(1))"""
+        feature_id = self.feature_ids.get(feature)
+        # feature ถูกลงทะเบียนก่อนเขียน _latest: reader ใน thread อื่นอาจเห็น feature ที่ยังไม่มีผล
+        row = self._latest.get(feature_id) if feature_id is not None else None
+        if row is None:
+            return None
+        return self._to_result(row)
+    
+    def query(self, feature: str, start: Optional[datetime] = None,
+              end: Optional[datetime] = None) -> np.ndarray:
+        """
+        Results ของ feature ในช่วงเวลา [start, end] เรียงตามเวลา
+        
+        Returns:
+        --------
+        np.ndarray : structured array (RESULT_DTYPE)
+        """
+        feature_id = self.feature_ids.get(feature)
+        if feature_id is None:
+            return np.empty(0, dtype=RESULT_DTYPE)
+        start = np.datetime64(start, 'us') if start is not None else np.datetime64('NaT')
+        end = np.datetime64(end, 'us') if end is not None else np.datetime64('NaT')
+        
+        parts = []
+        # segments ถูก seal ตามลำดับเวลา -> หา segment แรกที่อาจ overlap ด้วย bisect
+        first = 0 if np.isnat(start) else bisect.bisect_left(self._segment_ends, start)
+        for segment in self.segments[first:]:
+            if not np.isnat(end) and segment.start > end:
+                break
+            if feature_id + 1 >= len(segment.feature_offsets):
+                continue
+            lo, hi = segment.feature_offsets[feature_id], segment.feature_offsets[feature_id + 1]
+            if lo < hi:
+                parts.append(self._slice_by_time(self._load(segment)[lo:hi], start, end))
+        
+        active_rows = self._active_index.get(feature_id)
+        if active_rows:
+            parts.append(self._slice_by_time(self._active[active_rows], start, end))
+        
+        if not parts:
+            return np.empty(0, dtype=RESULT_DTYPE)
+        return np.concatenate(parts)
+    
+    @staticmethod
+    def _slice_by_time(rows: np.ndarray, start: np.datetime64, end: np.datetime64) -> np.ndarray:
+        timestamps = rows['timestamp']
+        lo = 0 if np.isnat(start) else np.searchsorted(timestamps, start, side='left')
+        hi = len(rows) if np.isnat(end) else np.searchsorted(timestamps, end, side='right')
+        return rows[lo:hi]
+    
+    def results(self, feature: str, start: Optional[datetime] = None,
+                end: Optional[datetime] = None) -> List[DriftResult]:
+        """เหมือน query แต่คืนเป็น DriftResult objects"""
+        return [self._to_result(row) for row in self.query(feature, start, end)]
+    
+    def _to_result(self, row: np.void) -> DriftResult:
+        return DriftResult(
+            timestamp=row['timestamp'].astype(datetime),
+            feature=self.feature_names[row['feature_id']],
+            drift_detected=bool(row['drift_detected']),
+            drift_type=DRIFT_TYPES[row['drift_type']],
+            test_name=self.feature_tests.get(int(row['feature_id']), 'ks'),
+            **{name: float(row[name]) for name in self.METRIC_FIELDS}
+        )
+
+# %% [markdown]
+# ### Incremental Summary Aggregates
+# Dashboard เรียก summary บ่อย แทนที่จะนับจาก history ทุกครั้ง เราอัปเดตตัวนับทีละ result (O(1))
+# - ค่าสะสมต่อ feature: total_checks, drift_count, PSI และ drift type ล่าสุด
+# - Rolling window (เช่น ชั่วโมง/วันล่าสุด): แบ่ง window เป็น buckets ตามเวลา
+#   bucket ที่เก่ากว่า window จะถูก reset เมื่อถูกใช้ซ้ำ (ความละเอียด = window / n_buckets)
+
+# %%
+class RollingCounter:
+    """นับ checks และ drifts ใน rolling time window ด้วย time buckets"""
+    
+    def __init__(self, window: timedelta, n_buckets: int = 60):
+        self.n_buckets = n_buckets
+        self.bucket_seconds = window.total_seconds() / n_buckets
+        self.epochs = [-1] * n_buckets
+        self.checks = [0] * n_buckets
+        self.drifts = [0] * n_buckets
+    
+    def add(self, timestamp: datetime, drift_detected: bool):
+        epoch = int(timestamp.timestamp() // self.bucket_seconds)
+        slot = epoch % self.n_buckets
+        if self.epochs[slot] != epoch:
+            self.epochs[slot] = epoch
+            self.checks[slot] = 0
+            self.drifts[slot] = 0
+        self.checks[slot] += 1
+        self.drifts[slot] += int(drift_detected)
+    
+    def totals(self, now: datetime) -> tuple:
+        """(checks, drifts) ใน window ที่สิ้นสุด ณ เวลา now"""
+        current = int(now.timestamp() // self.bucket_seconds)
+        checks = drifts = 0
+        for epoch, n_checks, n_drifts in zip(self.epochs, self.checks, self.drifts):
+            if current - self.n_buckets < epoch <= current:
+                checks += n_checks
+                drifts += n_drifts
+        return checks, drifts
+
+@dataclass
+class FeatureAggregate:
+    """ค่าสะสมของ feature หนึ่ง"""
+    total_checks: int = 0
+    drift_count: int = 0
+    latest_psi: float = 0.0
+    latest_drift_type: DriftType = DriftType.NONE
+    rolling: Dict[str, RollingCounter] = field(default_factory=dict)
+
+class SummaryAggregator:
+    """
+    Running aggregates สำหรับ get_summary_report
+    
+    update() ต่อ result เป็น O(1) และ summary() ใช้เวลาตามจำนวน features
+    ไม่ขึ้นกับความยาวของ history
+    """
+    
+    def __init__(self, windows: Optional[Dict[str, timedelta]] = None):
+        self.windows = windows or {}
+        self.features: Dict[str, FeatureAggregate] = {}
+        self.total_checks = 0
+        self.total_drifts = 0
+    
+    def update(self, result: DriftResult):
+        aggregate = self.features.get(result.feature)
+        if aggregate is None:
+            aggregate = FeatureAggregate(
+                rolling={name: RollingCounter(window) for name, window in self.windows.items()}
+            )
+            self.features[result.feature] = aggregate
+        
+        aggregate.total_checks += 1
+        aggregate.drift_count += int(result.drift_detected)
+        aggregate.latest_psi = result.psi
+        aggregate.latest_drift_type = result.drift_type
+        for counter in aggregate.rolling.values():
+            counter.add(result.timestamp, result.drift_detected)
+        
+        self.total_checks += 1
+        self.total_drifts += int(result.drift_detected)
+    
+    def feature_summary(self, feature: str, now: Optional[datetime] = None) -> Optional[Dict]:
+        aggregate = self.features.get(feature)
+        if aggregate is None:
+            return None
+        
+        summary = {
+            'latest_psi': aggregate.latest_psi,
+            'latest_drift_type': aggregate.latest_drift_type.value,
+            'drift_count': aggregate.drift_count,
+            'total_checks': aggregate.total_checks,
+            'drift_rate': aggregate.drift_count / aggregate.total_checks
+        }
+        if aggregate.rolling:
+            now = now or datetime.now()
+            summary['rolling'] = {}
+            for name, counter in aggregate.rolling.items():
+                checks, drifts = counter.totals(now)
+                summary['rolling'][name] = {
+                    'drift_count': drifts,
+                    'total_checks': checks,
+                    'drift_rate': drifts / checks if checks else 0.0
+                }
+        return summary
+
+# %% [markdown]
+# ### Prometheus Metrics Endpoint
+# `MetricsExporter` เปิด HTTP endpoint `/metrics` (text exposition format) ใน daemon thread
+# - ค่าถูกอ่านจาก state ของ pipeline ตอนที่ Prometheus scrape เท่านั้น ingest path ไม่ต้องทำอะไรเพิ่ม
+# - ingest rate คำนวณฝั่ง Prometheus จาก counter: `rate(drift_rows_ingested_total[1m])`
+# - ใช้ `port=0` เพื่อให้ OS เลือก port ว่าง (สะดวกสำหรับทดสอบบนเครื่อง)
+
+# %%
+class MetricsExporter:
+    """
+    Embedded Prometheus endpoint สำหรับ DriftMonitoringPipeline
+    
+    Metrics:
+    - drift_feature_psi / drift_feature_state / drift_feature_detected
+    - drift_feature_ks_statistic (numeric) / drift_feature_chi2_statistic (categorical)
+    - drift_rows_ingested_total, drift_checks_total, drift_check_duration_seconds (histogram)
+    - drift_buffer_fill_ratio{window="current"|"reference"}
+    - drift_active_alerts{severity}, drift_alerts_total
+    - drift_alert_deliveries_total{sink,status}, drift_alert_dispatch_dropped_total (ถ้ามี alert_sinks)
+    """
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+    # le buckets ของ drift_check_duration_seconds: 2^10 ns (~1 us) ถึง 2^36 ns (~69 s) ชุดเดิมทุก scrape
+    CHECK_DURATION_BUCKETS = range(10, 37)
+    
+    def __init__(self, pipeline: 'DriftMonitoringPipeline', host: str = '127.0.0.1', port: int = 0):
+        self.pipeline = pipeline
+        self.host = host
+        self.port = port
+        self.server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+    
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/metrics"
+    
+    def start(self):
+        """เปิด server ใน daemon thread (port จริงอยู่ใน self.port)"""
+        exporter = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', MetricsExporter.CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                logger.debug("metrics: " + format, *args)
+        
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self._thread = threading.Thread(target=self.server.serve_forever, name='drift-metrics', daemon=True)
+        self._thread.start()
+        logger.info(f"Metrics endpoint listening on {self.url}")
+    
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self._thread.join()
+            self.server = None
+    
+    @staticmethod
+    def _labels(**labels) -> str:
+        escaped = (
+            f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+            for k, v in labels.items()
+        )
+        return '{' + ','.join(escaped) + '}'
+    
+    def render(self) -> str:
+        """สร้าง metrics ทั้งหมดเป็น text exposition format"""
+        pipeline = self.pipeline
+        lines: List[str] = []
+        
+        def metric(name: str, kind: str, help_text: str, samples: List[tuple]):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{name}{suffix}{self._labels(**labels) if labels else ''} {float(value):.10g}")
+        
+        # Per-feature: ผลล่าสุดจาก results_store
+        latest = []
+        for feature in list(pipeline.results_store.feature_ids):
+            result = pipeline.results_store.latest(feature)
+            if result is not None:  # feature ที่เพิ่งลงทะเบียนแต่ยังไม่มีผล
+                latest.append((feature, result))
+        metric('drift_feature_psi', 'gauge', 'Latest PSI per feature.',
+               [('', {'feature': f}, r.psi) for f, r in latest])
+        metric('drift_feature_ks_statistic', 'gauge', 'Latest KS statistic per numeric feature.',
+               [('', {'feature': f}, r.ks_statistic) for f, r in latest if r.test_name == 'ks'])
+        metric('drift_feature_chi2_statistic', 'gauge', 'Latest chi-squared statistic per categorical feature.',
+               [('', {'feature': f}, r.ks_statistic) for f, r in latest if r.test_name == 'chi2'])
+        metric('drift_feature_state', 'gauge', 'Latest drift type (0=none, 1=mild, 2=moderate, 3=severe).',
+               [('', {'feature': f}, DRIFT_TYPES.index(r.drift_type)) for f, r in latest])
+        metric('drift_feature_detected', 'gauge', '1 if the latest check detected drift.',
+               [('', {'feature': f}, r.drift_detected) for f, r in latest])
+        
+        # Ingest และ check latency
+        metric('drift_rows_ingested_total', 'counter', 'Rows added to the current windows.',
+               [('', None, pipeline.data_buffer.rows_ingested)])
+        metric('drift_checks_total', 'counter', 'Drift checks completed.',
+               [('', None, pipeline.check_latency.count)])
+        histogram = pipeline.check_latency
+        buckets = list(histogram.buckets)
+        samples = []
+        cumulative = sum(buckets[:self.CHECK_DURATION_BUCKETS.start])
+        for i in self.CHECK_DURATION_BUCKETS:
+            cumulative += buckets[i]
+            samples.append(('_bucket', {'le': f"{2 ** i / 1e9:.9g}"}, cumulative))
+        samples.append(('_bucket', {'le': '+Inf'}, histogram.count))
+        samples.append(('_sum', None, histogram.total_ns / 1e9))
+        samples.append(('_count', None, histogram.count))
+        metric('drift_check_duration_seconds', 'histogram', 'Wall time of check_drift.', samples)
+        
+        # Buffer fill levels
+        fill = []
+        for window, buffers in (('current', pipeline.data_buffer.current_data),
+                                ('reference', pipeline.data_buffer.reference_data)):
+            for feature, buffer in list(buffers.items()):
+                if not isinstance(buffer, (RingBuffer, CategoricalWindow)):
+                    continue  # QuantileSketch / DecayedHistogram ไม่มีขนาดจำกัด
+                fill.append(('', {'feature': feature, 'window': window}, len(buffer) / buffer.capacity))
+        metric('drift_buffer_fill_ratio', 'gauge', 'Buffer length divided by window size.', fill)
+        
+        # Alerts
+        store = pipeline.alert_manager.store
+        metric('drift_active_alerts', 'gauge', 'Unacknowledged alerts by severity.',
+               [('', {'severity': severity.value}, store.count_active(severity)) for severity in AlertSeverity])
+        metric('drift_alerts_total', 'counter', 'Alerts created.',
+               [('', None, store.total_created)])
+        dispatcher = pipeline.alert_manager.dispatcher
+        if dispatcher is not None:
+            metric('drift_alert_deliveries_total', 'counter', 'Alert deliveries by sink and outcome.',
+                   [('', {'sink': name, 'status': status}, n)
+                    for name, stats in dispatcher.stats.items() for status, n in stats.items()])
+            metric('drift_alert_dispatch_dropped_total', 'counter', 'Alerts dropped because the dispatch queue was full.',
+                   [('', None, dispatcher.dropped)])
+        
+        return '\n'.join(lines) + '\n'
+
 # %% [markdown]
 # ## ส่วนที่ 4: สร้าง Main Monitoring Pipeline
 
+# %%
+# Worker สำหรับ executor_mode='process'
+# ต้องเป็น module-level function เพื่อให้ pickle ได้ แต่ละ worker เก็บ DriftCalculator (profile cache)
+# shared memory attach ต่อ task แล้วปิดทันที: snapshot สร้าง segments ใหม่ทุกรอบตรวจ
+# ถ้า cache ไว้ worker จะ map segments ที่ parent unlink ไปแล้วสะสมไม่สิ้นสุด
+#
+# Note: process mode ออกแบบสำหรับ Linux จึงสร้าง pool ด้วย fork context เสมอ
+# ถ้าใช้ spawn (macOS/Windows) ต้องย้าย class เหล่านี้ไปไว้ใน module ที่ import ได้
+_worker_calculator: Optional['DriftCalculator'] = None
+
+def _process_pool(max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """ProcessPoolExecutor แบบ fork (workers เห็น classes ที่นิยามใน notebook)"""
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('fork'))
+
+def _evaluate_feature_task(task: tuple) -> Dict[str, float]:
+    """คำนวณ metrics ของ feature หนึ่งใน worker process"""
+    global _worker_calculator
+    feature, version, bins, (reference_name, reference_start, reference_end), \
+        (current_name, current_start, current_end) = task
+    if _worker_calculator is None:
+        _worker_calculator = DriftCalculator(bins)
+    
+    reference_shm = shared_memory.SharedMemory(name=reference_name)
+    current_shm = shared_memory.SharedMemory(name=current_name)
+    try:
+        reference = np.ndarray(reference_end, dtype=np.float64, buffer=reference_shm.buf)[reference_start:]
+        current = np.ndarray(current_end, dtype=np.float64, buffer=current_shm.buf)[current_start:]
+        # profile เก็บ copies (sort/percentiles) ไม่อ้างถึง shared memory
+        profile = _worker_calculator.get_profile(feature, reference, version)
+        return _worker_calculator.evaluate(profile, current)
+    finally:
+        # ปล่อย views ก่อน close (close ล้มเหลวถ้ายังมี view ชี้ buffer อยู่)
+        reference = current = None
+        reference_shm.close()
+        current_shm.close()
+
 # %%
 class DriftMonitoringPipeline:
     """
     Main pipeline สำหรับ drift monitoring
+    
+    executor_mode ใน config กำหนดวิธีประเมิน features:
+    - 'serial': ทีละ feature (default)
+    - 'thread': ThreadPoolExecutor (NumPy/SciPy ปล่อย GIL ในส่วนที่หนัก)
+    - 'process': ProcessPoolExecutor อ่าน buffers ผ่าน shared memory
+    
+    ทุก mode คืนผลตามลำดับ features_to_monitor และสร้าง alerts ใน main thread
+    หลังรวมผลเสร็จ ทำให้ AlertManager ได้ลำดับเดียวกันเสมอ
+    
+    clock: ที่มาของเวลาสำหรับ timestamps ของ results, alert cooldown และ summary
+    (default datetime.now, ReplayEngine ส่ง EventClock)
     """
     
-    def __init__(self, config: MonitoringConfig):
+    EXECUTOR_MODES = ('serial', 'thread', 'process')
+    REFERENCE_MODES = ('window', 'sketch', 'decayed')
+    
+    def get_results_history(self) -> List[DriftResult]:
+        """History ทั้งหมดเป็น list ตามลำดับที่ตรวจ (สร้างจาก results_store ทุกครั้ง ใช้ results_store สำหรับ query)"""
+        return list(self.results_store)
+    
+    def __init__(self, config: MonitoringConfig, clock: Optional[Callable[[], datetime]] = None):
+        if config.executor_mode not in self.EXECUTOR_MODES:
+            raise ValueError(f"Unknown executor_mode: {config.executor_mode}")
+        if config.reference_mode not in self.REFERENCE_MODES:
+            raise ValueError(f"Unknown reference_mode: {config.reference_mode}")
+        if config.reference_mode != 'window' and config.executor_mode == 'process':
+            raise ValueError(f"reference_mode='{config.reference_mode}' is not supported with executor_mode='process'")
         self.config = config
-        self.data_buffer = DataBuffer(config)
-        self.alert_manager = AlertManager(config)
-        self.drift_calculator = DriftCalculator()
-        self.results_history: List[DriftResult] = []
+        self.clock = clock or datetime.now
+        self.instrumentation = Instrumentation.from_config(config)
+        self.data_buffer = DataBuffer(config, self.instrumentation)
+        self.alert_manager = AlertManager(config, self.instrumentation, self.clock)
+        self.drift_calculator = DriftCalculator(instrumentation=self.instrumentation)
+        self.results_store = DriftResultStore(
+            segment_size=config.results_segment_size,
+            storage_dir=config.results_store_dir
+        )
+        self.summary_aggregator = SummaryAggregator(config.summary_windows)
+        self.results_sink: Optional[JsonlSink] = None
+        if config.sink_dir:
+            self.results_sink = JsonlSink(
+                config.sink_dir, 'drift_results',
+                max_bytes=config.sink_max_bytes,
+                rotate_seconds=config.sink_rotate_seconds,
+                compress=config.sink_compress
+            )
+        self.check_latency = StageHistogram()
+        # ป้องกัน checkpoint อ่าน results/alerts ระหว่างที่ check_drift กำลังบันทึกผล
+        self._state_lock = threading.RLock()
+        self.metrics_exporter: Optional[MetricsExporter] = None
+        if config.metrics_port is not None:
+            self.metrics_exporter = MetricsExporter(self, config.metrics_host, config.metrics_port)
+            self.metrics_exporter.start()
         self.is_running = False
+        self._executor = None
+        self.checkpointer: Optional[PipelineCheckpointer] = None
+        if config.checkpoint_dir:
+            self.checkpointer = PipelineCheckpointer(
+                self, config.checkpoint_dir,
+                interval_seconds=config.checkpoint_interval_seconds,
+                keep=config.checkpoint_keep
+            )
+            self.checkpointer.start()
+    
+    @classmethod
+    def restore(cls, directory: str, config: Optional[MonitoringConfig] = None) -> 'DriftMonitoringPipeline':
+        """สร้าง pipeline จาก checkpoint ล่าสุดใน directory"""
+        return PipelineCheckpointer.restore(directory, config)
         
     def initialize(self, reference_data: pd.DataFrame):
         """Initialize pipeline with reference data"""
@@ -3936,36 +7392,168 @@ class DriftMonitoringPipeline:
         logger.info("DriftMonitoringPipeline initialized")
     
     def process_batch(self, batch_data: pd.DataFrame) -> List[DriftResult]:
-        """Process a batch of new data"""
+        """Process a batch of new data (DataFrame หรือ dict ของ arrays)"""
         results = []
         
-        # Add data to buffer
-        for idx, row in batch_data.iterrows():
-            data_point = {f: row[f] for f in self.config.features_to_monitor if f in row}
-            self.data_buffer.add_data(data_point)
+        # Add data to buffer (columnar)
+        self.data_buffer.add_batch(batch_data)
         
         # Check if ready for drift detection
         if not self.data_buffer.is_current_ready():
             logger.debug("Current buffer not ready yet")
             return results
         
-        # Perform drift detection for each feature
-        for feature in self.config.features_to_monitor:
-            result = self._detect_drift_for_feature(feature)
-            if result:
-                results.append(result)
-                self.results_history.append(result)
+        return self.check_drift()
+    
+    def check_drift(self, buffer: Optional[DataBuffer] = None) -> List[DriftResult]:
+        """
+        ตรวจ drift ทุก feature จาก buffer (default: self.data_buffer)
+        
+        ส่ง snapshot จาก DataBuffer.snapshot() มาได้ เพื่อให้ ingest เขียน
+        self.data_buffer ต่อไปได้ระหว่างที่กำลังคำนวณ
+        """
+        check_start = time.perf_counter_ns()
+        stage = self.instrumentation.stage
+        with self.instrumentation.profile_check(), stage('check'):
+            # Perform drift detection for each feature
+            with stage('evaluate'):
+                results = [r for r in self._evaluate_features(buffer or self.data_buffer) if r]
+            
+            with self._state_lock:
+                with stage('results_store'):
+                    self.results_store.extend(results)
+                    for result in results:
+                        self.summary_aggregator.update(result)
+                
+                if self.results_sink is not None:
+                    with stage('serialization'):
+                        for result in results:
+                            self.results_sink.write(result.to_dict())
                 
                 # Create alert if needed
-                if result.drift_detected:
-                    self.alert_manager.create_alert(result)
+                for result in results:
+                    if result.drift_detected:
+                        self.alert_manager.create_alert(result)
+        
+        self.check_latency.record(time.perf_counter_ns() - check_start)
+        return results
+    
+    def _get_executor(self):
+        """สร้าง executor ครั้งแรกที่ใช้งาน"""
+        if self._executor is None:
+            if self.config.executor_mode == 'thread':
+                self._executor = ThreadPoolExecutor(max_workers=self.config.max_workers)
+            else:
+                self._executor = _process_pool(self.config.max_workers)
+        return self._executor
+    
+    def _evaluate_features(self, buffer: DataBuffer) -> List[Optional[DriftResult]]:
+        """ประเมินทุก feature (ผลเรียงตาม features_to_monitor)"""
+        features = self.config.features_to_monitor
+        numeric = [f for f in features if f not in buffer.encoders]
+        results = dict(zip(numeric, self._evaluate_numeric(numeric, buffer)))
+        results.update(self._evaluate_categorical([f for f in features if f in buffer.encoders], buffer))
+        return [results.get(f) for f in features]
+    
+    def _evaluate_categorical(self, features: List[str], buffer: DataBuffer) -> Dict[str, DriftResult]:
+        """Categorical features ทั้งหมดในครั้งเดียวจาก counts (ใน process หลักทุก executor_mode)"""
+        ready = [
+            f for f in features
+            if f in buffer.reference_data and len(buffer.current_data[f]) >= 10
+        ]
+        if not ready:
+            return {}
+        
+        width = max(len(buffer.reference_data[f].counts) for f in ready)
+        reference_counts = np.zeros((len(ready), width))
+        current_counts = np.zeros((len(ready), width))
+        for i, f in enumerate(ready):
+            counts = buffer.reference_data[f].counts
+            reference_counts[i, :len(counts)] = counts
+            current_counts[i, :len(counts)] = buffer.current_data[f].counts
+        
+        metrics = self.drift_calculator.calculate_categorical_batch(reference_counts, current_counts)
+        return {
+            f: self._build_result(f, {name: float(values[i]) for name, values in metrics.items()}, test_name='chi2')
+            for i, f in enumerate(ready)
+        }
+    
+    def _evaluate_numeric(self, features: List[str], buffer: DataBuffer) -> List[Optional[DriftResult]]:
+        """ประเมิน numeric features ตาม executor_mode"""
+        if self.config.executor_mode == 'serial':
+            return self._evaluate_features_batched(features, buffer)
+        
+        executor = self._get_executor()
+        if self.config.executor_mode == 'thread':
+            return list(executor.map(lambda f: self._detect_drift_for_feature(f, buffer), features))
+        
+        # process: ส่งแค่ชื่อ shared memory และตำแหน่ง window ไปให้ worker
+        tasks = {f: self._build_task(f, buffer) for f in features}
+        ready = [f for f in features if tasks[f] is not None]
+        n_workers = self.config.max_workers or os.cpu_count() or 1
+        chunksize = max(1, len(ready) // (n_workers * 4))
+        metrics = executor.map(_evaluate_feature_task, [tasks[f] for f in ready], chunksize=chunksize)
+        results = dict(zip(ready, metrics))
+        
+        return [
+            self._build_result(f, results[f]) if f in results else None
+            for f in features
+        ]
+    
+    def _evaluate_features_batched(self, features: List[str], buffer: DataBuffer) -> List[Optional[DriftResult]]:
+        """Serial mode: PSI ของทุก feature ด้วย batched kernel แล้วคำนวณ KS ต่อ feature"""
+        ready = [
+            f for f in features
+            if f in buffer.reference_data and len(buffer.current_data[f]) >= 10
+        ]
+        currents = [buffer.get_current(f) for f in ready]
+        if len({len(c) for c in currents}) > 1:
+            # current windows ยาวไม่เท่ากัน -> stack เป็น matrix ไม่ได้
+            return [self._detect_drift_for_feature(f, buffer) for f in features]
+        
+        profiles = [
+            self.drift_calculator.get_profile(
+                f, buffer.get_reference(f), buffer.reference_version[f]
+            )
+            for f in ready
+        ]
+        position = {f: i for i, f in enumerate(ready)}
+        psi_values = {}
+        if ready:
+            psi_vector = self.drift_calculator.calculate_psi_batch(ready, profiles, np.stack(currents))
+            psi_values = dict(zip(ready, psi_vector))
         
+        results = []
+        for feature in features:
+            if feature not in psi_values:
+                results.append(None)
+                continue
+            i = position[feature]
+            metrics = self.drift_calculator.evaluate(profiles[i], currents[i], psi=psi_values[feature])
+            results.append(self._build_result(feature, metrics))
         return results
     
-    def _detect_drift_for_feature(self, feature: str) -> Optional[DriftResult]:
+    def _build_task(self, feature: str, buffer: DataBuffer) -> Optional[tuple]:
+        """สร้าง task สำหรับ worker process (None ถ้ายังประเมินไม่ได้)"""
+        reference = buffer.reference_data.get(feature)
+        current = buffer.current_data.get(feature)
+        
+        if reference is None or current is None or len(current) < 10:
+            return None
+        
+        return (
+            feature,
+            buffer.reference_version[feature],
+            self.drift_calculator.bins,
+            (reference.shm.name, *reference.window_bounds()),
+            (current.shm.name, *current.window_bounds())
+        )
+    
+    def _detect_drift_for_feature(self, feature: str, buffer: Optional[DataBuffer] = None) -> Optional[DriftResult]:
         """Detect drift for a single feature"""
-        reference = self.data_buffer.get_reference(feature)
-        current = self.data_buffer.get_current(feature)
+        buffer = buffer or self.data_buffer
+        reference = buffer.get_reference(feature)
+        current = buffer.get_current(feature)
         
         if reference is None or current is None:
             return None
@@ -3973,110 +7561,1078 @@ class DriftMonitoringPipeline:
         if len(current) < 10:  # Need minimum samples
             return None
         
-        # Calculate metrics
-        psi = self.drift_calculator.calculate_psi(reference, current)
-        ks_stat, ks_pval = self.drift_calculator.calculate_ks_test(reference, current)
+        profile = self.drift_calculator.get_profile(
+            feature, reference, buffer.reference_version[feature]
+        )
         
+        # Calculate metrics
+        metrics = self.drift_calculator.evaluate(profile, current)
+        return self._build_result(feature, metrics)
+    
+    def _build_result(self, feature: str, metrics: Dict[str, float], test_name: str = 'ks') -> DriftResult:
+        """สร้าง DriftResult จาก metrics"""
         # Determine drift type
-        drift_type = self.drift_calculator.determine_drift_type(psi, self.config)
-        drift_detected = drift_type != DriftType.NONE or ks_pval < self.config.ks_significance
+        drift_type = self.drift_calculator.determine_drift_type(metrics['psi'], self.config)
+        drift_detected = drift_type != DriftType.NONE or metrics['ks_pvalue'] < self.config.ks_significance
         
         return DriftResult(
-            timestamp=datetime.now(),
+            timestamp=self.clock(),
             feature=feature,
             drift_detected=drift_detected,
             drift_type=drift_type,
-            psi=psi,
-            ks_statistic=ks_stat,
-            ks_pvalue=ks_pval,
-            reference_mean=float(np.mean(reference)),
-            current_mean=float(np.mean(current)),
-            reference_std=float(np.std(reference)),
-            current_std=float(np.std(current))
+            test_name=test_name,
+            **metrics
         )
     
+    def close(self):
+        """ปิด executor, sinks และคืน shared memory (checkpoint รอบสุดท้ายก่อนปิด)"""
+        if self.checkpointer is not None:
+            self.checkpointer.stop(final_checkpoint=True)
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.stop()
+        if self.results_sink is not None:
+            self.results_sink.close()
+        self.alert_manager.close()
+        self.data_buffer.close()
+    
     def get_summary_report(self) -> Dict:
         """Generate summary report"""
-        if not self.results_history:
+        aggregator = self.summary_aggregator
+        if aggregator.total_checks == 0:
             return {'status': 'no_data'}
         
-        # Group by feature
+        # Group by feature (จาก running aggregates ไม่ต้องสแกน history)
+        now = self.clock()
         feature_summary = {}
         for feature in self.config.features_to_monitor:
-            feature_results = [r for r in self.results_history if r.feature == feature]
-            if feature_results:
-                latest = feature_results[-1]
-                drift_count = sum(1 for r in feature_results if r.drift_detected)
-                feature_summary[feature] = {
-                    'latest_psi': latest.psi,
-                    'latest_drift_type': latest.drift_type.value,
-                    'drift_count': drift_count,
-                    'total_checks': len(feature_results),
-                    'drift_rate': drift_count / len(feature_results)
-                }
+            summary = aggregator.feature_summary(feature, now)
+            if summary:
+                feature_summary[feature] = summary
+        
+        return {
+            'timestamp': now.isoformat(),
+            'total_checks': aggregator.total_checks,
+            'total_drifts_detected': aggregator.total_drifts,
+            'active_alerts': self.alert_manager.store.count_active(),
+            'feature_summary': feature_summary
+        }
+    
+    def save_results(self, output_dir: str = 'monitoring_output'):
+        """
+        Save all results to files
+        
+        ถ้ากำหนด sink_dir: results ถูกเขียนแบบ JSONL ตั้งแต่ตอนตรวจแล้ว จึงแค่ flush
+        แล้วเขียน manifest ที่ชี้ไปยังไฟล์ของ sink แทน drift_results.json (alerts เช่นเดียวกัน)
+        """
+        with self.instrumentation.stage('serialization'):
+            # Save drift results
+            if self.results_sink is not None:
+                self.results_sink.write_manifest(f'{output_dir}/drift_results.json')
+            else:
+                results_data = [r.to_dict() for r in self.results_store]
+                with open(f'{output_dir}/drift_results.json', 'w') as f:
+                    json.dump(results_data, f, indent=2)
+            
+            # Save alerts
+            self.alert_manager.save_alerts(f'{output_dir}/alerts/alerts.json')
+            
+            # Save summary
+            summary = self.get_summary_report()
+            with open(f'{output_dir}/reports/summary.json', 'w') as f:
+                json.dump(summary, f, indent=2)
         
+        logger.info(f"Results saved to {output_dir}")
+
+# %% [markdown]
+# ### Checkpoint / Restore
+# หลัง restart pipeline ต้องรอ traffic เต็ม window ใหม่และลืม alert cooldowns กับ history
+# `PipelineCheckpointer` บันทึก state ทั้งหมดเป็นระยะใน background thread:
+# - **Capture** (ถือ lock สั้นๆ): copy windows, active results และ state เล็กๆ อื่น
+# - **Write** (นอก lock): windows ทุก feature ต่อกันเป็น `.npy` ไฟล์เดียว, result segments ที่ seal แล้ว
+#   เขียนครั้งเดียวแล้วใช้ร่วมทุก checkpoint, ที่เหลือ pickle ลง `state.pkl`
+#   ชื่อไฟล์ segment มี id ของ checkpointer นำหน้า run ก่อนหน้าที่ใช้ directory เดียวกันจึงไม่ถูกอ้างถึงผิดไฟล์
+# - ชี้ checkpoint ล่าสุดด้วยไฟล์ `LATEST` ที่เขียนแบบ atomic (`os.replace`) หลัง fsync ทุกไฟล์
+#   checkpoint ที่เขียนไม่เสร็จจึงไม่ถูกใช้
+# - **Restore** เปิด arrays แบบ memory-map แล้ว copy เข้า RingBuffer -> ใช้เวลาระดับ milliseconds
+
+# %%
+def _save_npy_durable(path: str, array: np.ndarray):
+    """np.save แล้ว fsync ก่อนคืน (ต้องอยู่บน disk จริงก่อน publish LATEST)"""
+    with open(path, 'wb') as f:
+        np.save(f, array)
+        f.flush()
+        os.fsync(f.fileno())
+
+class PipelineCheckpointer:
+    """
+    Checkpoint/restore state ของ DriftMonitoringPipeline
+    
+    Layout:
+        <directory>/LATEST                    ชื่อ checkpoint ล่าสุด
+        <directory>/segments/*.npy            sealed result segments (immutable, ชื่อขึ้นต้นด้วย id ของ checkpointer)
+        <directory>/ckpt-000001/buffers.npy   ทุก RingBuffer window ต่อกัน (float64)
+        <directory>/ckpt-000001/results_*.npy active/latest results
+        <directory>/ckpt-000001/state.pkl     config, versions, encoders, alerts, cooldowns, aggregates
+    """
+    
+    def __init__(self, pipeline: 'DriftMonitoringPipeline', directory: str,
+                 interval_seconds: float = 300, keep: int = 2):
+        self.pipeline = pipeline
+        self.directory = directory
+        self.interval_seconds = interval_seconds
+        self.keep = keep
+        self.checkpoints_written = 0
+        self.last_duration: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._write_lock = threading.Lock()
+        # id เฉพาะของ checkpointer: segment files ของ run อื่นที่ใช้ directory เดียวกันจะไม่ชนชื่อ
+        self.segment_prefix = uuid.uuid4().hex[:12]
+        os.makedirs(os.path.join(directory, 'segments'), exist_ok=True)
+    
+    # ---- capture / write ----
+    def capture(self) -> Dict:
+        """Copy state ของ pipeline (ถือ lock ของ pipeline/buffer ระหว่าง copy เท่านั้น)"""
+        pipeline = self.pipeline
+        buffer = pipeline.data_buffer
+        windows, offsets, objects = [], {}, {}
+        position = 0
+        
+        with pipeline._state_lock, buffer.lock:
+            for kind, buffers in (('reference', buffer.reference_data), ('current', buffer.current_data)):
+                for feature, data in buffers.items():
+                    if isinstance(data, RingBuffer):
+                        window = np.array(data.view())
+                        windows.append(window)
+                        offsets[(kind, feature)] = (position, position + len(window))
+                        position += len(window)
+                    else:
+                        # sketches, decayed histograms, categorical windows
+                        objects[(kind, feature)] = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+            
+            state = {
+                'config': pipeline.config,
+                'created_at': datetime.now(),
+                'offsets': offsets,
+                'objects': objects,
+                'encoders': pickle.dumps(buffer.encoders, protocol=pickle.HIGHEST_PROTOCOL),
+                'reference_version': dict(buffer.reference_version),
+                'rows_ingested': buffer.rows_ingested,
+                'is_initialized': buffer.is_initialized,
+                'alerts': pickle.dumps(pipeline.alert_manager.store.state(), protocol=pickle.HIGHEST_PROTOCOL),
+                'last_alert_time': dict(pipeline.alert_manager.last_alert_time),
+                'summary_aggregator': pickle.dumps(pipeline.summary_aggregator, protocol=pickle.HIGHEST_PROTOCOL)
+            }
+            store_state = pipeline.results_store.state()
+        
+        state['buffers'] = np.concatenate(windows) if windows else np.empty(0)
+        state['results'] = store_state
+        return state
+    
+    def _next_name(self) -> str:
+        existing = sorted(d for d in os.listdir(self.directory) if d.startswith('ckpt-'))
+        seq = int(existing[-1].split('-')[1]) + 1 if existing else 0
+        return f'ckpt-{seq:06d}'
+    
+    def write(self, state: Dict) -> str:
+        """เขียน state ที่ capture แล้วลง disk คืน path ของ checkpoint"""
+        with self._write_lock:
+            start = time.perf_counter()
+            name = self._next_name()
+            path = os.path.join(self.directory, name)
+            os.makedirs(path)
+            
+            _save_npy_durable(os.path.join(path, 'buffers.npy'), state.pop('buffers'))
+            
+            results = state.pop('results')
+            segments = []
+            for i, segment in enumerate(results['segments']):
+                if segment.path is None:
+                    # segment ใน memory: เขียนครั้งเดียวใน segments/ ใช้ร่วมทุก checkpoint
+                    segment_path = os.path.join(self.directory, 'segments',
+                                                f'segment_{self.segment_prefix}_{i:06d}.npy')
+                    if not os.path.exists(segment_path):
+                        _save_npy_durable(segment_path, segment.rows)
+                else:
+                    segment_path = segment.path
+                order_path = segment.order_path
+                if order_path is None and segment.order is not None:
+                    order_path = os.path.join(self.directory, 'segments',
+                                              f'segment_{self.segment_prefix}_{i:06d}_order.npy')
+                    if not os.path.exists(order_path):
+                        _save_npy_durable(order_path, segment.order)
+                segments.append((segment.start, segment.end, segment.feature_offsets, os.path.abspath(segment_path),
+                                 os.path.abspath(order_path) if order_path else None))
+            _save_npy_durable(os.path.join(path, 'results_active.npy'), results['active'])
+            _save_npy_durable(os.path.join(path, 'results_latest.npy'), results['latest'])
+            state['results'] = {'feature_names': results['feature_names'],
+                                'feature_tests': results['feature_tests'], 'segments': segments}
+            
+            with open(os.path.join(path, 'state.pkl'), 'wb') as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            
+            # publish แบบ atomic แล้วลบ checkpoints เก่า
+            latest_tmp = os.path.join(self.directory, 'LATEST.tmp')
+            with open(latest_tmp, 'w') as f:
+                f.write(name)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(latest_tmp, os.path.join(self.directory, 'LATEST'))
+            
+            old = sorted(d for d in os.listdir(self.directory) if d.startswith('ckpt-'))[:-self.keep]
+            for d in old:
+                shutil.rmtree(os.path.join(self.directory, d), ignore_errors=True)
+            
+            self.checkpoints_written += 1
+            self.last_duration = time.perf_counter() - start
+            return path
+    
+    def save(self) -> str:
+        """Checkpoint ทันที (capture + write)"""
+        return self.write(self.capture())
+    
+    # ---- background ----
+    def start(self):
+        """เริ่ม checkpoint ทุก interval_seconds ใน daemon thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='drift-checkpoint', daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                self.save()
+            except Exception:
+                logger.exception("Checkpoint failed")
+    
+    def stop(self, final_checkpoint: bool = False):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        if final_checkpoint:
+            self.save()
+    
+    # ---- restore ----
+    @staticmethod
+    def restore(directory: str, config: Optional[MonitoringConfig] = None) -> 'DriftMonitoringPipeline':
+        """สร้าง pipeline ใหม่จาก checkpoint ล่าสุด"""
+        with open(os.path.join(directory, 'LATEST')) as f:
+            path = os.path.join(directory, f.read().strip())
+        with open(os.path.join(path, 'state.pkl'), 'rb') as f:
+            state = pickle.load(f)
+        
+        pipeline = DriftMonitoringPipeline(config or state['config'])
+        config = pipeline.config
+        buffer = pipeline.data_buffer
+        shared = config.executor_mode == 'process'
+        windows = np.load(os.path.join(path, 'buffers.npy'), mmap_mode='r')
+        
+        for (kind, feature), (start, end) in state['offsets'].items():
+            capacity = config.reference_window_size if kind == 'reference' else config.current_window_size
+            ring = RingBuffer(capacity, shared=shared)
+            ring.extend(windows[start:end])
+            (buffer.reference_data if kind == 'reference' else buffer.current_data)[feature] = ring
+        for (kind, feature), data in state['objects'].items():
+            (buffer.reference_data if kind == 'reference' else buffer.current_data)[feature] = pickle.loads(data)
+        buffer.encoders = pickle.loads(state['encoders'])
+        buffer.reference_version = state['reference_version']
+        buffer.rows_ingested = state['rows_ingested']
+        buffer.is_initialized = state['is_initialized']
+        
+        pipeline.alert_manager.store.load_state(pickle.loads(state['alerts']))
+        pipeline.alert_manager.last_alert_time = state['last_alert_time']
+        pipeline.summary_aggregator = pickle.loads(state['summary_aggregator'])
+        
+        results = state['results']
+        pipeline.results_store.load_state({
+            'feature_names': results['feature_names'],
+            'feature_tests': results.get('feature_tests', {}),
+            'segments': [
+                ResultSegment(start=start, end=end, feature_offsets=offsets, path=segment_path,
+                              order=np.load(order_path, mmap_mode='r') if order_path else None,
+                              order_path=order_path)
+                for start, end, offsets, segment_path, order_path in results['segments']
+            ],
+            'active': np.load(os.path.join(path, 'results_active.npy')),
+            'latest': np.load(os.path.join(path, 'results_latest.npy'))
+        })
+        logger.info(f"Pipeline restored from {path} ({len(pipeline.results_store)} results)")
+        return pipeline
+
+# %% [markdown]
+# ### Asyncio Streaming Service
+# `process_batch` ทำ ingest และตรวจ drift ในจังหวะเดียวกัน ใน production เราต้องการแยกสองส่วนนี้:
+# - **Ingest**: รับ batch ผ่าน `asyncio.Queue` ที่มีขนาดจำกัด (producer ถูก backpressure เมื่อคิวเต็ม)
+# - **Scheduler**: ตรวจ drift ทุก `check_interval_seconds` โดยไม่ขึ้นกับจังหวะ ingest
+# - **Executor**: การคำนวณ statistics รันใน thread แยกบน snapshot ของ buffer
+#   event loop จึงรับข้อมูลต่อได้ระหว่างที่กำลังคำนวณ
+# - **Errors**: batch หรือรอบตรวจที่ล้มเหลวถูก log และนับ (`ingest_errors`, `check_errors`) แล้วทำงานต่อ
+#   `stop()` รอรอบตรวจที่ค้างใน executor ให้เสร็จก่อนตรวจรอบสุดท้าย
+
+# %%
+class AsyncDriftMonitoringService:
+    """
+    Asyncio service ที่ครอบ DriftMonitoringPipeline
+    """
+    
+    def __init__(self, pipeline: DriftMonitoringPipeline, max_queue_size: int = 100,
+                 on_results: Optional[Callable[[List[DriftResult]], None]] = None):
+        self.pipeline = pipeline
+        self.max_queue_size = max_queue_size
+        self.on_results = on_results
+        self.queue: Optional[asyncio.Queue] = None
+        self.rows_ingested = 0
+        self.checks_run = 0
+        self.ingest_errors = 0  # batches ที่ add_batch ล้มเหลว (ข้ามไปแล้ว loop ทำงานต่อ)
+        self.check_errors = 0  # รอบตรวจที่ล้มเหลวใน scheduler
+        self.max_queue_depth = 0
+        self._check_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='drift-check')
+        self._tasks: List[asyncio.Task] = []
+        self._check_task: Optional[asyncio.Future] = None
+    
+    async def start(self):
+        """เริ่ม ingest loop และ scheduler"""
+        self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self.pipeline.is_running = True
+        self._tasks = [
+            asyncio.create_task(self._ingest_loop()),
+            asyncio.create_task(self._schedule_loop())
+        ]
+        logger.info("AsyncDriftMonitoringService started")
+    
+    async def submit(self, batch: pd.DataFrame):
+        """ส่ง batch เข้าคิว (รอถ้าคิวเต็ม = backpressure)"""
+        await self.queue.put(batch)
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+    
+    def try_submit(self, batch: pd.DataFrame) -> bool:
+        """ส่ง batch แบบไม่รอ คืน False ถ้าคิวเต็ม"""
+        try:
+            self.queue.put_nowait(batch)
+        except asyncio.QueueFull:
+            return False
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+        return True
+    
+    async def _ingest_loop(self):
+        """ดึง batch จากคิวเข้า DataBuffer (append แบบ columnar จึงเร็วพอจะทำใน event loop)"""
+        while True:
+            batch = await self.queue.get()
+            try:
+                self.pipeline.data_buffer.add_batch(batch)
+                self.rows_ingested += len(batch)
+            except Exception:
+                # batch เสียหนึ่งอันต้องไม่หยุด ingest: ไม่งั้นคิวเต็มและ submit/stop รอตลอดไป
+                self.ingest_errors += 1
+                logger.exception(f"Failed to ingest batch of {len(batch)} rows")
+            finally:
+                self.queue.task_done()
+    
+    async def _schedule_loop(self):
+        """ตรวจ drift ทุก check_interval_seconds (นับจากเวลาเริ่ม ไม่สะสม delay)"""
+        interval = self.pipeline.config.check_interval_seconds
+        next_run = time.monotonic() + interval
+        while True:
+            await asyncio.sleep(max(0.0, next_run - time.monotonic()))
+            next_run += interval
+            try:
+                await self.run_check()
+            except Exception:
+                self.check_errors += 1
+                logger.exception("Scheduled drift check failed")
+    
+    async def run_check(self) -> List[DriftResult]:
+        """ตรวจ drift บน snapshot ของ buffer ใน executor"""
+        if not self.pipeline.data_buffer.is_current_ready():
+            return []
+        
+        snapshot = self.pipeline.data_buffer.snapshot()
+        loop = asyncio.get_running_loop()
+        try:
+            future = loop.run_in_executor(self._check_executor, self.pipeline.check_drift, snapshot)
+        except Exception:
+            snapshot.close()
+            raise
+        
+        def finish(_):
+            # ปิด snapshot เมื่อ executor ใช้เสร็จจริง ไม่ใช่เมื่อ coroutine นี้ถูก cancel
+            snapshot.close()
+            if self._check_task is future:
+                self._check_task = None
+        
+        self._check_task = future
+        future.add_done_callback(finish)
+        # shield: cancel scheduler ระหว่างตรวจไม่ cancel future (thread ยังทำงานอยู่) ให้ stop() รอต่อได้
+        results = await asyncio.shield(future)
+        
+        self.checks_run += 1
+        if self.on_results and results:
+            self.on_results(results)
+        return results
+    
+    async def stop(self, drain: bool = True, final_check: bool = True):
+        """
+        หยุด service
+        
+        drain=True: ingest ข้อมูลที่ค้างในคิวให้หมดก่อน
+        final_check=True: ตรวจ drift รอบสุดท้ายกับข้อมูลล่าสุดก่อนปิด
+        """
+        if drain and self.queue is not None:
+            await self.queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._check_task is not None:
+            # รอบตรวจที่กำลังรันใน executor ต้องเสร็จก่อนตรวจรอบสุดท้าย
+            await asyncio.gather(self._check_task, return_exceptions=True)
+        self._tasks = []
+        if final_check:
+            await self.run_check()
+        self._check_executor.shutdown()
+        self.pipeline.is_running = False
+        logger.info("AsyncDriftMonitoringService stopped")
+
+# %% [markdown]
+# ### Multi-tenant Pipeline Manager
+# หนึ่ง `DriftMonitoringPipeline` ต่อ model มี buffers, caches และ objects ของตัวเอง
+# เมื่อมีหลายพัน models overhead ต่อ object จะมากกว่าข้อมูลจริง `DriftPipelineManager` เก็บทุก tenant
+# ใน struct-of-arrays: แต่ละ (tenant, feature) คือหนึ่ง row ของ NumPy arrays ร่วมกัน
+# - **current windows**: matrix (streams × current_window_size) ทุก feature ของ tenant ใช้ตำแหน่งเขียนเดียวกัน
+# - **reference profiles**: bin edges, reference proportions, sorted reference, mean, std เป็น arrays
+# - **Fair scheduling**: tenant ที่ window เต็มและมีข้อมูลใหม่เข้าคิว FIFO ได้ครั้งเดียว
+#   `run_checks(max_tenants)` ดึงจากหัวคิว tenant ที่ส่งข้อมูลถี่จึงแซงคิวคนอื่นไม่ได้
+# - **Shared worker pool**: tenants ถูกแบ่งเป็น chunks, PSI ของทั้ง chunk คำนวณด้วย batched kernel ครั้งเดียว
+
+# %%
+class DriftPipelineManager:
+    """
+    Host หลาย logical pipelines (tenants) บน arrays ร่วมกัน
+    
+    ทุก tenant ใช้ window sizes และ thresholds จาก config เดียวกัน
+    ผลลัพธ์เก็บใน DriftResultStore ร่วม โดยใช้ชื่อ feature แบบ '<tenant_id>/<feature>'
+    """
+    
+    def __init__(self, config: MonitoringConfig, initial_capacity: int = 64,
+                 tenants_per_task: int = 64):
+        if config.executor_mode not in ('serial', 'thread'):
+            raise ValueError("DriftPipelineManager supports executor_mode 'serial' or 'thread'")
+        self.config = config
+        self.tenants_per_task = tenants_per_task
+        self.drift_calculator = DriftCalculator()
+        
+        # Tenant state (หนึ่งช่องต่อ tenant)
+        self.tenant_index: Dict[str, int] = {}
+        self.tenant_ids: List[str] = []
+        self.tenant_features: List[List[str]] = []
+        self._tenant_capacity = 0
+        self._grow_tenants(initial_capacity)
+        
+        # Stream state (หนึ่ง row ต่อ tenant × feature)
+        self.n_streams = 0
+        self._stream_capacity = 0
+        self._grow_streams(initial_capacity)
+        
+        self._ready: deque = deque()
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.results_store = DriftResultStore(
+            segment_size=config.results_segment_size,
+            storage_dir=config.results_store_dir
+        )
+        self.alert_manager = AlertManager(config)
+        self.tenant_checks = 0
+    
+    @property
+    def n_tenants(self) -> int:
+        return len(self.tenant_ids)
+    
+    def _grow_tenants(self, capacity: int):
+        """ขยาย tenant arrays (ครั้งละ 2 เท่า)"""
+        for name, dtype in (('_t_start', np.int64), ('_t_stop', np.int64), ('_t_pos', np.int64),
+                            ('_t_filled', np.int64), ('_t_queued', bool)):
+            new = np.zeros(capacity, dtype=dtype)
+            if self._tenant_capacity:
+                new[:self.n_tenants] = getattr(self, name)[:self.n_tenants]
+            setattr(self, name, new)
+        self._tenant_capacity = capacity
+    
+    def _grow_streams(self, capacity: int):
+        """ขยาย stream arrays (ครั้งละ 2 เท่า เพื่อให้ amortized O(1) ต่อ stream)"""
+        bins = self.drift_calculator.bins
+        shapes = {
+            'current': (self.config.current_window_size,),
+            'sorted_reference': (self.config.reference_window_size,),
+            'bin_edges': (bins + 1,),
+            'ref_props': (bins,),
+            'ref_len': (),
+            'ref_mean': (),
+            'ref_std': ()
+        }
+        fill = {'bin_edges': np.inf, 'ref_props': 1e-6}
+        for name, shape in shapes.items():
+            dtype = np.int64 if name == 'ref_len' else np.float64
+            new = np.full((capacity, *shape), fill.get(name, 0), dtype=dtype)
+            if self._stream_capacity:
+                new[:self.n_streams] = getattr(self, name)[:self.n_streams]
+            setattr(self, name, new)
+        self._stream_capacity = capacity
+    
+    def add_tenant(self, tenant_id: str, reference_df: pd.DataFrame,
+                   features: Optional[List[str]] = None):
+        """ลงทะเบียน tenant พร้อม reference data (ใช้ reference_window_size rows ล่าสุด)"""
+        if tenant_id in self.tenant_index:
+            raise ValueError(f"Tenant already registered: {tenant_id}")
+        features = [
+            f for f in (features or self.config.features_to_monitor)
+            if f in reference_df.columns
+        ]
+        
+        reference = reference_df[features].to_numpy(dtype=float)[-self.config.reference_window_size:]
+        profiles = [self.drift_calculator.build_profile(column) for column in reference.T]
+        
+        with self._lock:
+            start, stop = self.n_streams, self.n_streams + len(features)
+            if stop > self._stream_capacity:
+                self._grow_streams(max(stop, 2 * self._stream_capacity))
+            for row, profile in zip(range(start, stop), profiles):
+                self.bin_edges[row, :len(profile.bin_edges)] = profile.bin_edges
+                self.ref_props[row, :len(profile.reference_props)] = profile.reference_props
+                self.sorted_reference[row, :len(profile.sorted_reference)] = profile.sorted_reference
+                self.ref_len[row] = len(profile.sorted_reference)
+                self.ref_mean[row] = profile.mean
+                self.ref_std[row] = profile.std
+            
+            t = self.n_tenants
+            if t == self._tenant_capacity:
+                self._grow_tenants(2 * self._tenant_capacity)
+            self._t_start[t], self._t_stop[t] = start, stop
+            self.n_streams = stop
+            self.tenant_index[tenant_id] = t
+            self.tenant_ids.append(tenant_id)
+            self.tenant_features.append(features)
+    
+    def add_batch(self, tenant_id: str, batch_df: pd.DataFrame):
+        """Append batch ของ tenant เข้า current windows (ทุก feature ในครั้งเดียว)"""
+        t = self.tenant_index[tenant_id]
+        window = self.config.current_window_size
+        matrix = batch_df[self.tenant_features[t]].to_numpy(dtype=float)[-window:].T
+        n = matrix.shape[1]
+        
+        with self._lock:
+            idx = (self._t_pos[t] + np.arange(n)) % window
+            self.current[self._t_start[t]:self._t_stop[t], idx] = matrix
+            self._t_pos[t] = (self._t_pos[t] + n) % window
+            self._t_filled[t] = min(window, self._t_filled[t] + n)
+            if self._t_filled[t] == window and not self._t_queued[t]:
+                self._t_queued[t] = True
+                self._ready.append(t)
+    
+    def pending_tenants(self) -> int:
+        """จำนวน tenants ที่รอตรวจ"""
+        return len(self._ready)
+    
+    def run_checks(self, max_tenants: Optional[int] = None) -> Dict[str, List[DriftResult]]:
+        """
+        ตรวจ drift ของ tenants ที่รออยู่ (FIFO สูงสุด max_tenants ตัว)
+        
+        Returns:
+        --------
+        Dict[str, List[DriftResult]] : results ต่อ tenant
+        """
+        with self._lock:
+            n = len(self._ready) if max_tenants is None else min(max_tenants, len(self._ready))
+            batch = [self._ready.popleft() for _ in range(n)]
+            self._t_queued[batch] = False
+            # copy current windows ของ tenants ที่ถูกเลือก เพื่อให้ ingest เขียนต่อได้ระหว่างคำนวณ
+            chunks = []
+            for i in range(0, len(batch), self.tenants_per_task):
+                tenants = batch[i:i + self.tenants_per_task]
+                rows = np.concatenate([np.arange(self._t_start[t], self._t_stop[t]) for t in tenants])
+                chunks.append((tenants, rows, self.current[rows]))
+        
+        if self.config.executor_mode == 'thread' and len(chunks) > 1:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.config.max_workers)
+            metrics = list(self._executor.map(lambda chunk: self._evaluate_chunk(*chunk[1:]), chunks))
+        else:
+            metrics = [self._evaluate_chunk(rows, current) for _, rows, current in chunks]
+        
+        results: Dict[str, List[DriftResult]] = {}
+        now = datetime.now()
+        for (tenants, rows, _), chunk_metrics in zip(chunks, metrics):
+            offset = 0
+            for t in tenants:
+                tenant_id = self.tenant_ids[t]
+                tenant_results = []
+                for feature in self.tenant_features[t]:
+                    values = {k: float(v[offset]) for k, v in chunk_metrics.items()}
+                    drift_type = self.drift_calculator.determine_drift_type(values['psi'], self.config)
+                    tenant_results.append(DriftResult(
+                        timestamp=now,
+                        feature=f"{tenant_id}/{feature}",
+                        drift_detected=drift_type != DriftType.NONE or values['ks_pvalue'] < self.config.ks_significance,
+                        drift_type=drift_type,
+                        **values
+                    ))
+                    offset += 1
+                results[tenant_id] = tenant_results
+                self.results_store.extend(tenant_results)
+                for result in tenant_results:
+                    if result.drift_detected:
+                        self.alert_manager.create_alert(result)
+        
+        self.tenant_checks += len(batch)
+        return results
+    
+    def _evaluate_chunk(self, rows: np.ndarray, current: np.ndarray) -> Dict[str, np.ndarray]:
+        """Metrics ของทุก stream ใน chunk: PSI แบบ batched, KS ต่อ row จาก sorted reference"""
+        cur_props = batched_histogram(current, self.bin_edges[rows]) / current.shape[1] + 1e-6
+        ref_props = self.ref_props[rows]
+        psi = np.sum((cur_props - ref_props) * np.log(cur_props / ref_props), axis=1)
+        
+        ks = np.array([
+            ks_2samp_sorted(self.sorted_reference[row, :self.ref_len[row]], values)
+            for row, values in zip(rows, current)
+        ])
+        return {
+            'psi': psi,
+            'ks_statistic': ks[:, 0],
+            'ks_pvalue': ks[:, 1],
+            'reference_mean': self.ref_mean[rows],
+            'current_mean': current.mean(axis=1),
+            'reference_std': self.ref_std[rows],
+            'current_std': current.std(axis=1)
+        }
+    
+    def tenant_summary(self, tenant_id: str) -> pd.DataFrame:
+        """ผลล่าสุดของทุก feature ของ tenant"""
+        rows = []
+        for feature in self.tenant_features[self.tenant_index[tenant_id]]:
+            result = self.results_store.latest(f"{tenant_id}/{feature}")
+            if result is not None:
+                row = result.to_dict()
+                row['feature'] = feature
+                rows.append(row)
+        return pd.DataFrame(rows)
+    
+    def nbytes(self) -> int:
+        """Memory ของ arrays ทั้งหมด (ไม่รวม results/alerts)"""
+        arrays = [self.current, self.sorted_reference, self.bin_edges, self.ref_props,
+                  self.ref_len, self.ref_mean, self.ref_std, self._t_start, self._t_stop,
+                  self._t_pos, self._t_filled, self._t_queued]
+        return sum(a.nbytes for a in arrays)
+    
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self.alert_manager.close()
+
+# %% [markdown]
+# ### Replay / Backtest Engine
+# ปรับ thresholds และ window sizes โดยไม่ต้องรอ traffic จริง: replay ข้อมูลย้อนหลังผ่าน DriftMonitoringPipeline
+# - CSV/Parquet ถูกอ่านครั้งเดียวแล้วเก็บเป็น `.npy` (values เรียงเป็น feature × rows) ที่เปิดแบบ memory-map
+#   ทุก worker process อ่านไฟล์เดียวกันผ่าน page cache ไม่ต้อง copy ข้อมูล
+# - `EventClock` ทำให้ timestamps ของ results, alert cooldown และ summary ใช้ event time ของข้อมูล
+# - `compare` รันหลาย configs พร้อมกันใน worker processes แล้วคืนตารางเทียบ
+#   จำนวน alerts, false alerts, detection delay (จาก `drift_onsets` ที่รู้ล่วงหน้า) และ compute cost
+
+# %%
+class EventClock:
+    """Clock ที่คืน event time ปัจจุบันของ replay แทน datetime.now()"""
+    
+    def __init__(self, now: datetime):
+        self.now = now
+    
+    def __call__(self) -> datetime:
+        return self.now
+
+def replay_pipeline(config: MonitoringConfig, values: np.ndarray, timestamps: np.ndarray, features: List[str],
+                    reference_rows: int, batch_size: int,
+                    drift_onsets: Optional[Dict[str, datetime]] = None) -> Dict:
+    """
+    Replay values (features × rows) ผ่าน pipeline ใหม่ แล้วคืนสถิติของ run
+    
+    drift_onsets: feature -> เวลาที่ drift เริ่มจริง features ที่ไม่อยู่ใน dict ถือว่าไม่มี drift
+    (ทุก alert ของ feature นั้นเป็น false alert)
+    """
+    drift_onsets = drift_onsets or {}
+    n_rows = values.shape[1]
+    # สถิตินับจาก alerts ใน memory ทั้งหมด: ตรวจก่อน replay ว่า retention รับ alerts ได้ครบ
+    # (สูงสุดหนึ่ง alert ต่อ feature ต่อ check และหนึ่ง check ต่อ batch)
+    max_alerts = -(-(n_rows - reference_rows) // batch_size) * len(features)
+    if config.alert_retention < max_alerts:
+        raise ValueError(f"replay needs every alert in memory: alert_retention must be >= {max_alerts}")
+    clock = EventClock(timestamps[reference_rows - 1].astype(datetime))
+    
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    pipeline = DriftMonitoringPipeline(config, clock=clock)
+    try:
+        pipeline.initialize(pd.DataFrame({f: values[i, :reference_rows] for i, f in enumerate(features)}))
+        for start in range(reference_rows, n_rows, batch_size):
+            end = min(start + batch_size, n_rows)
+            clock.now = timestamps[end - 1].astype(datetime)
+            pipeline.process_batch({f: values[i, start:end] for i, f in enumerate(features)})
+        wall_s, cpu_s = time.perf_counter() - wall_start, time.process_time() - cpu_start
+        
+        alerts = pipeline.alert_manager.store.query()
+        delays = []
+        for feature, onset in drift_onsets.items():
+            after = [a.timestamp for a in alerts if a.feature == feature and a.timestamp >= onset]
+            delays.append(min(after) - onset if after else None)
+        detected = [d for d in delays if d is not None]
         return {
-            'timestamp': datetime.now().isoformat(),
-            'total_checks': len(self.results_history),
-            'total_drifts_detected': sum(1 for r in self.results_history if r.drift_detected),
-            'active_alerts': len(self.alert_manager.get_active_alerts()),
-            'feature_summary': feature_summary
+            'alerts': len(alerts),
+            'false_alerts': sum(
+                1 for a in alerts
+                if a.feature not in drift_onsets or a.timestamp < drift_onsets[a.feature]
+            ),
+            'detected': f'{len(detected)}/{len(drift_onsets)}',
+            'mean_delay': pd.Series(detected, dtype='timedelta64[ns]').mean(),
+            'max_delay': max(detected) if detected else pd.NaT,
+            'checks': pipeline.check_latency.count,
+            'wall_seconds': wall_s,
+            'cpu_seconds': cpu_s,
+            'rows_per_second': (n_rows - reference_rows) / wall_s
         }
+    finally:
+        pipeline.close()
+
+def _replay_task(task: tuple) -> Dict:
+    """Worker: เปิด input แบบ memory-map แล้ว replay หนึ่ง config"""
+    values_path, timestamps_path, features, config, reference_rows, batch_size, drift_onsets = task
+    values = np.load(values_path, mmap_mode='r')
+    timestamps = np.load(timestamps_path, mmap_mode='r')
+    return replay_pipeline(config, values, timestamps, features, reference_rows, batch_size, drift_onsets)
+
+class ReplayEngine:
+    """
+    Replay ข้อมูลย้อนหลัง (เตรียมเป็น memory-mapped .npy) ผ่าน DriftMonitoringPipeline
     
-    def save_results(self, output_dir: str = 'monitoring_output'):
-        """Save all results to files"""
-        # Save drift results
-        results_data = [r.to_dict() for r in self.results_history]
-        with open(f'{output_dir}/drift_results.json', 'w') as f:
-            json.dump(results_data, f, indent=2)
-        
-        # Save alerts
-        self.alert_manager.save_alerts(f'{output_dir}/alerts/alerts.json')
-        
-        # Save summary
-        summary = self.get_summary_report()
-        with open(f'{output_dir}/reports/summary.json', 'w') as f:
-            json.dump(summary, f, indent=2)
+    สร้างจาก CSV/Parquet ด้วย `ReplayEngine.from_file` (cache ไว้ใน cache_dir อ่านไฟล์ต้นทางใหม่เมื่อแก้ไข)
+    """
+    
+    def __init__(self, values_path: str, timestamps_path: str, features: List[str]):
+        self.values_path = values_path
+        self.timestamps_path = timestamps_path
+        self.features = list(features)
+        self.values = np.load(values_path, mmap_mode='r')
+        self.timestamps = np.load(timestamps_path, mmap_mode='r')
+    
+    def __len__(self) -> int:
+        return self.values.shape[1]
+    
+    @classmethod
+    def from_file(cls, path: str, features: List[str], timestamp_column: str = 'timestamp',
+                  cache_dir: Optional[str] = None) -> 'ReplayEngine':
+        """อ่าน CSV หรือ Parquet (เรียงตาม event time) แล้วเก็บเป็น .npy สำหรับ memory-map"""
+        cache_dir = cache_dir or f'{path}.replay'
+        os.makedirs(cache_dir, exist_ok=True)
+        values_path = os.path.join(cache_dir, 'values.npy')
+        timestamps_path = os.path.join(cache_dir, 'timestamps.npy')
+        meta_path = os.path.join(cache_dir, 'meta.json')
+        meta = {'source': os.path.abspath(path), 'mtime': os.path.getmtime(path), 'features': list(features)}
+        
+        cached = None
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                cached = json.load(f)
+        if cached != meta:
+            columns = list(features) + [timestamp_column]
+            if path.endswith(('.parquet', '.pq')):
+                df = pd.read_parquet(path, columns=columns)
+            else:
+                df = pd.read_csv(path, usecols=columns, parse_dates=[timestamp_column])
+            df = df.sort_values(timestamp_column, kind='stable')
+            np.save(values_path, np.ascontiguousarray(df[features].to_numpy(dtype=float).T))
+            np.save(timestamps_path, df[timestamp_column].to_numpy(dtype='datetime64[us]'))
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f)
+        return cls(values_path, timestamps_path, features)
+    
+    def _prepare_config(self, config: MonitoringConfig) -> MonitoringConfig:
+        """
+        Config สำหรับ replay: serial ใน process เดียว ไม่เปิด endpoints/checkpoints/sinks
         
-        logger.info(f"Results saved to {output_dir}")
+        ปิด alert_dedup เพราะไม่มีใคร acknowledge ระหว่าง replay (ทุก alert นับเป็นเหตุการณ์แยก มีแค่ cooldown)
+        และไม่จำกัด alert_retention: สถิติของ replay นับจาก alerts ใน memory ทั้งหมด
+        alert_logging=False: ไม่ log alerts ของ replay (ไม่กระทบ pipelines อื่นใน process)
+        """
+        return dataclasses.replace(
+            config,
+            features_to_monitor=list(config.features_to_monitor or self.features),
+            executor_mode='serial', metrics_port=None, checkpoint_dir=None,
+            sink_dir=None, alert_sinks=[], results_store_dir=None, alert_dedup=False,
+            alert_retention=sys.maxsize, alert_archive_path=None, alert_logging=False
+        )
+    
+    def run(self, config: MonitoringConfig, reference_rows: int = 1000, batch_size: int = 200,
+            drift_onsets: Optional[Dict[str, datetime]] = None) -> Dict:
+        """Replay หนึ่ง config ใน process นี้"""
+        return replay_pipeline(self._prepare_config(config), self.values, self.timestamps, self.features,
+                               reference_rows, batch_size, drift_onsets)
+    
+    def compare(self, configs: Dict[str, MonitoringConfig], reference_rows: int = 1000, batch_size: int = 200,
+                drift_onsets: Optional[Dict[str, datetime]] = None,
+                max_workers: Optional[int] = None) -> pd.DataFrame:
+        """Replay ทุก config พร้อมกันใน worker processes คืนตารางเทียบ (หนึ่งแถวต่อ config)"""
+        tasks = [
+            (self.values_path, self.timestamps_path, self.features, self._prepare_config(config),
+             reference_rows, batch_size, drift_onsets)
+            for config in configs.values()
+        ]
+        with _process_pool(max_workers) as executor:
+            rows = list(executor.map(_replay_task, tasks))
+        return pd.DataFrame(rows, index=list(configs))
 
 # %% [markdown]
 # ## ส่วนที่ 5: สร้าง Report Generator
 
+# %% [markdown]
+# ### Scalable Report Rendering
+# หลังรันนานๆ history มีหลายแสน results ต่อ feature:
+# - `lttb_indices` (Largest-Triangle-Three-Buckets) ลด time series เหลือไม่เกิน `max_points` จุด
+#   โดยเลือกจุดที่รักษารูปร่างของกราฟ (ช่วงที่ PSI พุ่งขึ้นยังเห็นชัด) ใช้ทั้งใน plot และ HTML
+# - HTML สร้างจาก `string.Template` แล้วเขียนลงไฟล์ทีละ chunk แทนการต่อ string ทั้งหน้า
+# - panel ของแต่ละ feature (สถิติ + SVG trend) ถูก cache ไว้ตามจำนวน checks ของ feature
+#   render ใหม่เฉพาะ features ที่มี results ใหม่
+# - `generate_dashboard_data(since=cursor)` คืนเฉพาะ results/alerts ที่ใหม่กว่า cursor ของ client
+#   (results แบบ columnar ตัวเลขล้วน) แทนการส่ง time series ทั้งหมดทุกครั้งที่ poll
+
+# %%
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling คืน indices ของจุดที่เลือก (เรียงตาม x)
+    
+    เก็บจุดแรกและจุดสุดท้ายเสมอ ที่เหลือแบ่งเป็น n_out - 2 buckets แล้วเลือกจุดที่ทำให้
+    สามเหลี่ยมกับจุดที่เลือกก่อนหน้าและค่าเฉลี่ยของ bucket ถัดไปมีพื้นที่มากที่สุด
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
+
+def encode_result_rows(rows: np.ndarray) -> Dict[str, list]:
+    """
+    Columnar encoding ของ result rows สำหรับ dashboard
+    
+    t: เวลาเป็น milliseconds ค่าแรกเป็น epoch ค่าถัดไปเป็นผลต่างจากค่าก่อนหน้า (ตัวเลขสั้น)
+    f: feature id, d: drift_type code (index ใน DRIFT_TYPES), psi: ปัดเป็น 6 ตำแหน่ง
+    """
+    t = rows['timestamp'].astype('datetime64[ms]').astype(np.int64)
+    return {
+        't': np.diff(t, prepend=0).tolist(),
+        'f': rows['feature_id'].tolist(),
+        'd': rows['drift_type'].tolist(),
+        'psi': np.round(rows['psi'], 6).tolist()
+    }
+
 # %%
 class ReportGenerator:
     """
     Component สำหรับสร้าง reports และ visualizations
+    
+    max_points: จำนวนจุดสูงสุดต่อ feature ใน trend plot/panel (LTTB)
     """
     
-    def __init__(self, pipeline: DriftMonitoringPipeline):
+    COLORS = {'none': 'green', 'mild': 'yellow', 'moderate': 'orange', 'severe': 'red'}
+    
+    PAGE_HEADER = Template("""<!DOCTYPE html>
+<html>
+<head>
+    <title>Drift Monitoring Report</title>
+    <style>
+        body { font-family: Arial, sans-serif; margin: 20px; }
+        .header { background-color: #2196F3; color: white; padding: 20px; }
+        .summary { background-color: #f0f0f0; padding: 15px; margin: 10px 0; }
+        .panel { border: 1px solid #ddd; padding: 10px; margin: 10px 0; }
+        .alert-critical { background-color: #ffebee; border-left: 4px solid #f44336; padding: 10px; margin: 5px 0; }
+        .alert-warning { background-color: #fff3e0; border-left: 4px solid #ff9800; padding: 10px; margin: 5px 0; }
+        .alert-info { background-color: #e3f2fd; border-left: 4px solid #2196F3; padding: 10px; margin: 5px 0; }
+        table { border-collapse: collapse; width: 100%; }
+        th, td { border: 1px solid #ddd; padding: 8px; text-align: left; }
+        th { background-color: #2196F3; color: white; }
+    </style>
+</head>
+<body>
+    <div class="header">
+        <h1>🔍 Drift Monitoring Report</h1>
+        <p>Generated: $generated</p>
+    </div>
+    
+    <div class="summary">
+        <h2>📊 Summary</h2>
+        <p><strong>Total Checks:</strong> $total_checks</p>
+        <p><strong>Total Drifts Detected:</strong> $total_drifts</p>
+        <p><strong>Active Alerts:</strong> $active_alerts</p>
+    </div>
+    
+    <h2>📈 Feature Summary</h2>
+    <table>
+        <tr>
+            <th>Feature</th>
+            <th>Latest PSI</th>
+            <th>Drift Type</th>
+            <th>Drift Count</th>
+            <th>Drift Rate</th>
+        </tr>
+""")
+    FEATURE_ROW = Template("""        <tr>
+            <td>$feature</td>
+            <td>$latest_psi</td>
+            <td>$drift_type</td>
+            <td>$drift_count</td>
+            <td>$drift_rate</td>
+        </tr>
+""")
+    PANELS_HEADER = """    </table>
+    
+    <h2>📉 Feature Trends</h2>
+"""
+    PANEL = Template("""    <div class="panel">
+        <h3>$feature</h3>
+        <p>$n_results checks ($n_points points shown), PSI max $psi_max, latest $latest_psi ($drift_type)</p>
+        <svg width="$width" height="$height" viewBox="0 0 $width $height">
+$thresholds
+            <polyline fill="none" stroke="#1565C0" stroke-width="1" points="$points"/>
+$markers
+        </svg>
+    </div>
+""")
+    ALERTS_HEADER = """    
+    <h2>⚠️ Active Alerts</h2>
+"""
+    ALERT = Template("""    <div class="alert-$severity">
+        <strong>$severity_upper</strong>: $message
+        <br><small>$timestamp</small>
+    </div>
+""")
+    PAGE_FOOTER = """</body>
+</html>
+"""
+    
+    def __init__(self, pipeline: DriftMonitoringPipeline, max_points: int = 1000,
+                 panel_width: int = 800, panel_height: int = 160):
         self.pipeline = pipeline
+        self.max_points = max_points
+        self.panel_width = panel_width
+        self.panel_height = panel_height
+        self._panel_cache: Dict[str, tuple] = {}  # feature -> (total_checks, html)
+        self.panels_rendered = 0
     
-    def generate_dashboard_data(self) -> Dict:
-        """Generate data for dashboard"""
-        summary = self.pipeline.get_summary_report()
+    def generate_dashboard_data(self, since: Optional[str] = None) -> Dict:
+        """
+        Generate data for dashboard
         
-        # Time series data for each feature
-        time_series = {}
-        for feature in self.pipeline.config.features_to_monitor:
-            feature_results = [
-                r for r in self.pipeline.results_history 
-                if r.feature == feature
-            ]
-            time_series[feature] = {
-                'timestamps': [r.timestamp.isoformat() for r in feature_results],
-                'psi_values': [r.psi for r in feature_results],
-                'drift_types': [r.drift_type.value for r in feature_results]
-            }
+        since=None: time series ทั้งหมดของทุก feature + active alerts ('mode': 'full')
+        since=<cursor จากครั้งก่อน>: เฉพาะ results/alerts ที่ใหม่กว่า cursor ('mode': 'delta')
+        ถ้า cursor ใช้ไม่ได้แล้ว (เช่นตามหลังเกินหนึ่ง segment) จะได้แบบ full กลับไป
+        ทั้งสองแบบมี 'cursor' สำหรับเรียกครั้งถัดไป
+        """
+        if since is not None:
+            delta = self._dashboard_delta(since)
+            if delta is not None:
+                return delta
+        
+        store = self.pipeline.results_store
+        with self.pipeline._state_lock:
+            summary = self.pipeline.get_summary_report()
+            
+            # Time series data for each feature
+            time_series = {}
+            for feature in self.pipeline.config.features_to_monitor:
+                rows = store.query(feature)
+                time_series[feature] = {
+                    'timestamps': np.datetime_as_string(rows['timestamp']).tolist(),
+                    'psi_values': rows['psi'].tolist(),
+                    'drift_types': [DRIFT_TYPES[t].value for t in rows['drift_type']]
+                }
+            cursor = self._cursor(len(store), self.pipeline.alert_manager.store.version, len(store.feature_names))
+            feature_names = list(store.feature_names)
         
         return {
+            'mode': 'full',
+            'cursor': cursor,
+            'features': feature_names,
+            'drift_type_codes': [t.value for t in DRIFT_TYPES],
             'summary': summary,
             'time_series': time_series,
             'alerts': [a.to_dict() for a in self.pipeline.alert_manager.get_active_alerts()]
         }
     
-    def plot_drift_trends(self, save_path: str = None):
-        """Plot drift trends for all features"""
+    @staticmethod
+    def _cursor(results: int, alerts: int, features: int) -> str:
+        return f'{results}.{alerts}.{features}'
+    
+    def _dashboard_delta(self, since: str) -> Optional[Dict]:
+        """
+        Results/alerts ใหม่กว่า cursor (None ถ้า cursor ใช้ไม่ได้)
+        
+        results เป็น columnar (ดู encode_result_rows) อ้าง feature ด้วย id
+        ('new_features' = ชื่อของ ids ที่ client ยังไม่รู้จัก)
+        alerts = alerts ที่ถูกสร้าง/acknowledge/dedup หลัง cursor (client อัปเดตตาม alert_id)
+        """
+        try:
+            results_cursor, alerts_cursor, features_cursor = (int(part) for part in since.split('.'))
+        except ValueError:
+            return None
+        
+        store = self.pipeline.results_store
+        alert_store = self.pipeline.alert_manager.store
+        with self.pipeline._state_lock:
+            rows = store.since(results_cursor)
+            alerts = alert_store.changes_since(alerts_cursor)
+            if rows is None or alerts is None or features_cursor > len(store.feature_names):
+                return None
+            new_features = store.feature_names[features_cursor:]
+            aggregator = self.pipeline.summary_aggregator
+            changed = [store.feature_names[i] for i in np.unique(rows['feature_id'])]
+            feature_summary = {f: aggregator.feature_summary(f) for f in changed}
+            totals = {
+                'total_checks': aggregator.total_checks,
+                'total_drifts_detected': aggregator.total_drifts,
+                'active_alerts': alert_store.count_active()
+            }
+            cursor = self._cursor(results_cursor + len(rows), alert_store.version,
+                                  features_cursor + len(new_features))
+        
+        return {
+            'mode': 'delta',
+            'cursor': cursor,
+            'new_features': new_features,
+            'summary': {**totals, 'feature_summary': feature_summary},
+            'results': encode_result_rows(rows),
+            'alerts': [a.to_dict() for a in alerts]
+        }
+    
+    def _downsample(self, rows: np.ndarray, max_points: Optional[int] = None) -> np.ndarray:
+        """rows ที่เหลือหลัง LTTB บน (timestamp, psi)"""
+        x = rows['timestamp'].astype(np.int64)
+        return rows[lttb_indices(x, rows['psi'], max_points or self.max_points)]
+    
+    def plot_drift_trends(self, save_path: str = None, max_points: Optional[int] = None):
+        """Plot drift trends for all features (downsample แต่ละ feature เหลือไม่เกิน max_points จุด)"""
         n_features = len(self.pipeline.config.features_to_monitor)
         
         if n_features == 0:
@@ -4088,23 +8644,19 @@ class ReportGenerator:
         if n_features == 1:
             axes = [axes]
         
-        colors = {'none': 'green', 'mild': 'yellow', 'moderate': 'orange', 'severe': 'red'}
-        
         for ax, feature in zip(axes, self.pipeline.config.features_to_monitor):
-            feature_results = [
-                r for r in self.pipeline.results_history 
-                if r.feature == feature
-            ]
+            rows = self.pipeline.results_store.query(feature)
             
-            if not feature_results:
+            if len(rows) == 0:
                 continue
             
-            timestamps = [r.timestamp for r in feature_results]
-            psi_values = [r.psi for r in feature_results]
-            drift_types = [r.drift_type.value for r in feature_results]
+            rows = self._downsample(rows, max_points)
+            timestamps = rows['timestamp']
+            psi_values = rows['psi']
+            drift_types = [DRIFT_TYPES[t].value for t in rows['drift_type']]
             
             # Plot PSI
-            scatter_colors = [colors.get(dt, 'gray') for dt in drift_types]
+            scatter_colors = [self.COLORS.get(dt, 'gray') for dt in drift_types]
             ax.scatter(timestamps, psi_values, c=scatter_colors, s=30, alpha=0.7)
             ax.plot(timestamps, psi_values, 'b-', alpha=0.3)
             
@@ -4130,84 +8682,97 @@ class ReportGenerator:
         
         plt.show()
     
-    def generate_html_report(self, output_path: str):
-        """Generate HTML report"""
+    def _render_panel(self, feature: str, summary: Dict) -> str:
+        """Panel ของ feature: สถิติ + SVG ของ PSI trend (downsampled) และจุดที่มี drift"""
+        all_rows = self.pipeline.results_store.query(feature)
+        rows = self._downsample(all_rows)
+        width, height = self.panel_width, self.panel_height
+        config = self.pipeline.config
+        
+        x = rows['timestamp'].astype(np.int64).astype(float)
+        psi = rows['psi']
+        y_max = max(float(np.nanmax(psi)) if len(psi) else 0.0, config.psi_severe_threshold) * 1.1
+        x_span = (x[-1] - x[0]) or 1.0
+        px = (x - x[0]) / x_span * (width - 10) + 5
+        py = height - 5 - np.nan_to_num(psi) / y_max * (height - 10)
+        
+        thresholds = '\n'.join(
+            f'            <line x1="0" x2="{width}" y1="{height - 5 - t / y_max * (height - 10):.1f}" '
+            f'y2="{height - 5 - t / y_max * (height - 10):.1f}" stroke="{color}" stroke-dasharray="4"/>'
+            for t, color in ((config.psi_mild_threshold, 'yellow'),
+                             (config.psi_moderate_threshold, 'orange'),
+                             (config.psi_severe_threshold, 'red'))
+        )
+        drifted = np.flatnonzero(rows['drift_detected'])
+        markers = '\n'.join(
+            f'            <circle cx="{px[i]:.1f}" cy="{py[i]:.1f}" r="2" '
+            f'fill="{self.COLORS.get(DRIFT_TYPES[rows["drift_type"][i]].value, "gray")}"/>'
+            for i in drifted
+        )
+        return self.PANEL.substitute(
+            feature=html.escape(feature),
+            n_results=len(all_rows),
+            n_points=len(rows),
+            psi_max=f"{float(np.nanmax(all_rows['psi'])) if len(all_rows) else 0.0:.4f}",
+            latest_psi=f"{summary['latest_psi']:.4f}",
+            drift_type=summary['latest_drift_type'],
+            width=width,
+            height=height,
+            thresholds=thresholds,
+            points=' '.join(f'{a:.1f},{b:.1f}' for a, b in zip(px, py)),
+            markers=markers
+        )
+    
+    def _panel(self, feature: str, summary: Dict) -> str:
+        """Panel จาก cache (render ใหม่เมื่อจำนวน checks ของ feature เปลี่ยน)"""
+        key = summary['total_checks']
+        cached = self._panel_cache.get(feature)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        panel = self._render_panel(feature, summary)
+        self._panel_cache[feature] = (key, panel)
+        self.panels_rendered += 1
+        return panel
+    
+    def iter_html(self):
+        """HTML report ทีละ chunk"""
         summary = self.pipeline.get_summary_report()
+        feature_summary = summary.get('feature_summary', {})
         
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Drift Monitoring Report</title>
-            <style>
-                body {{ font-family: Arial, sans-serif; margin: 20px; }}
-                .header {{ background-color: #2196F3; color: white; padding: 20px; }}
-                .summary {{ background-color: #f0f0f0; padding: 15px; margin: 10px 0; }}
-                .alert-critical {{ background-color: #ffebee; border-left: 4px solid #f44336; padding: 10px; margin: 5px 0; }}
-                .alert-warning {{ background-color: #fff3e0; border-left: 4px solid #ff9800; padding: 10px; margin: 5px 0; }}
-                .alert-info {{ background-color: #e3f2fd; border-left: 4px solid #2196F3; padding: 10px; margin: 5px 0; }}
-                table {{ border-collapse: collapse; width: 100%; }}
-                th, td {{ border: 1px solid #ddd; padding: 8px; text-align: left; }}
-                th {{ background-color: #2196F3; color: white; }}
-            </style>
-        </head>
-        <body>
-            <div class="header">
-                <h1>🔍 Drift Monitoring Report</h1>
-                <p>Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
-            </div>
-            
-            <div class="summary">
-                <h2>📊 Summary</h2>
-                <p><strong>Total Checks:</strong> {summary.get('total_checks', 0)}</p>
-                <p><strong>Total Drifts Detected:</strong> {summary.get('total_drifts_detected', 0)}</p>
-                <p><strong>Active Alerts:</strong> {summary.get('active_alerts', 0)}</p>
-            </div>
-            
-            <h2>📈 Feature Summary</h2>
-            <table>
-                <tr>
-                    <th>Feature</th>
-                    <th>Latest PSI</th>
-                    <th>Drift Type</th>
-                    <th>Drift Count</th>
-                    <th>Drift Rate</th>
-                </tr>
-        """
+        yield self.PAGE_HEADER.substitute(
+            generated=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            total_checks=summary.get('total_checks', 0),
+            total_drifts=summary.get('total_drifts_detected', 0),
+            active_alerts=summary.get('active_alerts', 0)
+        )
+        for feature, data in feature_summary.items():
+            yield self.FEATURE_ROW.substitute(
+                feature=html.escape(feature),
+                latest_psi=f"{data['latest_psi']:.4f}",
+                drift_type=data['latest_drift_type'],
+                drift_count=data['drift_count'],
+                drift_rate=f"{data['drift_rate']:.1%}"
+            )
         
-        for feature, data in summary.get('feature_summary', {}).items():
-            html_content += f"""
-                <tr>
-                    <td>{feature}</td>
-                    <td>{data['latest_psi']:.4f}</td>
-                    <td>{data['latest_drift_type']}</td>
-                    <td>{data['drift_count']}</td>
-                    <td>{data['drift_rate']:.1%}</td>
-                </tr>
-            """
-        
-        html_content += """
-            </table>
-            
-            <h2>⚠️ Active Alerts</h2>
-        """
+        yield self.PANELS_HEADER
+        for feature, data in feature_summary.items():
+            yield self._panel(feature, data)
         
+        yield self.ALERTS_HEADER
         for alert in self.pipeline.alert_manager.get_active_alerts():
-            alert_class = f"alert-{alert.severity.value}"
-            html_content += f"""
-            <div class="{alert_class}">
-                <strong>{alert.severity.value.upper()}</strong>: {alert.message}
-                <br><small>{alert.timestamp.strftime('%Y-%m-%d %H:%M:%S')}</small>
-            </div>
-            """
-        
-        html_content += """
-        </body>
-        </html>
-        """
-        
-        with open(output_path, 'w') as f:
-            f.write(html_content)
+            yield self.ALERT.substitute(
+                severity=alert.severity.value,
+                severity_upper=alert.severity.value.upper(),
+                message=html.escape(alert.message),
+                timestamp=alert.timestamp.strftime('%Y-%m-%d %H:%M:%S')
+            )
+        yield self.PAGE_FOOTER
+    
+    def generate_html_report(self, output_path: str):
+        """Generate HTML report (เขียนลงไฟล์ทีละ chunk)"""
+        with open(output_path, 'w', encoding='utf-8') as f:
+            for chunk in self.iter_html():
+                f.write(chunk)
         
         logger.info(f"HTML report saved to {output_path}")
 
@@ -4216,8 +8781,13 @@ class ReportGenerator:
 
 # %%
 # สร้าง test data
-def generate_test_data(n_samples=5000):
-    """สร้างข้อมูลทดสอบที่มี drift"""
+def generate_test_data(n_samples=5000, n_extra_features=0):
+    """
+    สร้างข้อมูลทดสอบที่มี drift
+    
+    n_extra_features: จำนวน features เพิ่มเติม (feature_0000, ...) สำหรับ benchmark
+    ครึ่งหนึ่งมี sudden drift หลัง 60% ของข้อมูล
+    """
     np.random.seed(42)
     
     data = []
@@ -4248,7 +8818,13 @@ def generate_test_data(n_samples=5000):
             'feature_c': np.random.normal(feature_c_mean, 12)
         })
     
-    return pd.DataFrame(data)
+    df = pd.DataFrame(data)
+    if n_extra_features > 0:
+        extra = np.random.normal(0, 1, size=(n_samples, n_extra_features))
+        extra[int(n_samples * 0.6):, ::2] += 0.5
+        columns = [f'feature_{i:04d}' for i in range(n_extra_features)]
+        df = pd.concat([df, pd.DataFrame(extra, columns=columns)], axis=1)
+    return df
 
 # สร้างข้อมูลทดสอบ
 test_data = generate_test_data(5000)
@@ -4280,7 +8856,8 @@ config = MonitoringConfig(
     psi_moderate_threshold=0.2,
     psi_severe_threshold=0.25,
     ks_significance=0.05,
-    features_to_monitor=['feature_a', 'feature_b', 'feature_c']
+    features_to_monitor=['feature_a', 'feature_b', 'feature_c'],
+    summary_windows={'last_hour': timedelta(hours=1)}
 )
 
 # สร้าง pipeline
@@ -4326,6 +8903,8 @@ for feature, data in summary['feature_summary'].items():
     print(f"    Drift Type: {data['latest_drift_type']}")
     print(f"    Drift Count: {data['drift_count']}/{data['total_checks']}")
     print(f"    Drift Rate: {data['drift_rate']:.1%}")
+    last_hour = data['rolling']['last_hour']
+    print(f"    Last Hour: {last_hour['drift_count']}/{last_hour['total_checks']} drifts")
 
 # %%
 # Generate reports
@@ -4342,6 +8921,1039 @@ pipeline.save_results()
 
 print("\n✅ All reports generated and saved to monitoring_output/")
 
+# %% [markdown]
+# ### Parallel Feature Evaluation
+# เมื่อ monitor หลายร้อย features การประเมินทีละ feature ใช้แค่ core เดียว
+# ลองเปรียบเทียบ `executor_mode` ทั้ง 3 แบบ ผลลัพธ์ต้องเหมือนกันทุก mode
+
+# %%
+def generate_wide_data(n_samples=2000, n_features=200, drift_start=1400, seed=0):
+    """สร้างข้อมูลที่มีหลาย features (ครึ่งหนึ่งมี drift หลัง drift_start)"""
+    rng = np.random.default_rng(seed)
+    data = rng.normal(0, 1, size=(n_samples, n_features))
+    data[drift_start:, :n_features // 2] += 0.5
+    columns = [f'f_{i:04d}' for i in range(n_features)]
+    return pd.DataFrame(data, columns=columns)
+
+wide_data = generate_wide_data()
+mode_results = {}
+mode_alerts = {}
+
+for mode in ['serial', 'thread', 'process']:
+    mode_config = MonitoringConfig(
+        features_to_monitor=list(wide_data.columns),
+        executor_mode=mode
+    )
+    mode_pipeline = DriftMonitoringPipeline(mode_config)
+    mode_pipeline.initialize(wide_data.iloc[:1000])
+    
+    start = time.perf_counter()
+    for i in range(1000, len(wide_data), 200):
+        mode_pipeline.process_batch(wide_data.iloc[i:i + 200])
+    elapsed = time.perf_counter() - start
+    
+    mode_results[mode] = [
+        (r.feature, r.psi, r.ks_statistic, r.ks_pvalue, r.drift_detected)
+        for r in mode_pipeline.get_results_history()
+    ]
+    mode_alerts[mode] = [
+        (a.alert_id, a.feature, a.severity, a.message, a.occurrences)
+        for a in mode_pipeline.alert_manager.alerts
+    ]
+    mode_pipeline.close()
+    print(f"{mode:>8}: {elapsed:.2f}s, {len(mode_results[mode])} results, {len(mode_alerts[mode])} alerts")
+
+# ผลลัพธ์ (รวมลำดับ) และ alerts ต้องเหมือนกันทุก mode
+assert mode_results['serial'] == mode_results['thread'] == mode_results['process']
+assert mode_alerts['serial'] == mode_alerts['thread'] == mode_alerts['process']
+print("\n✅ Results and alerts identical across modes")
+
+# %% [markdown]
+# ### JSONL Sink แทน json.dump ทั้ง history
+# ตั้ง `sink_max_bytes` ให้เล็กเพื่อให้เห็นการ rotate และบีบอัดไฟล์
+
+# %%
+sink_dir = 'monitoring_output/stream'
+shutil.rmtree(sink_dir, ignore_errors=True)
+sink_output_dir = 'monitoring_output/sink_run'  # ไม่เขียนทับ drift_results.json ของ pipeline หลัก
+for subdir in ('alerts', 'reports'):
+    os.makedirs(f'{sink_output_dir}/{subdir}', exist_ok=True)
+
+sink_config = MonitoringConfig(
+    features_to_monitor=list(wide_data.columns),
+    sink_dir=sink_dir,
+    sink_max_bytes=64 * 1024
+)
+sink_pipeline = DriftMonitoringPipeline(sink_config)
+sink_pipeline.initialize(wide_data.iloc[:1000])
+
+for i in range(1000, len(wide_data), 200):
+    sink_pipeline.process_batch(wide_data.iloc[i:i + 200])
+    sink_pipeline.save_results(sink_output_dir)  # flush เฉพาะ records ใหม่ ไม่เขียน history ซ้ำ (drift_results.json เป็น manifest)
+
+with open(f'{sink_output_dir}/drift_results.json') as f:
+    results_manifest = json.load(f)
+print(f"drift_results.json -> {results_manifest['records_written']} records in {results_manifest['directory']}")
+assert results_manifest['directory'] == sink_dir and results_manifest['files']
+
+# acknowledge เขียนเป็น record ใหม่ของ alert เดิมใน alerts.jsonl
+acked_id = sink_pipeline.alert_manager.alerts[0].alert_id
+sink_pipeline.alert_manager.acknowledge_alert(acked_id)
+
+results_sink = sink_pipeline.results_sink
+alerts_sink = sink_pipeline.alert_manager.sink
+sink_pipeline.close()
+
+n_records = sum(1 for _ in results_sink.read_records())
+print(f"Records written: {results_sink.records_written} (read back: {n_records})")
+print(f"Rotated files: {results_sink.files_rotated}")
+for path in results_sink.files():
+    print(f"   {path} ({os.path.getsize(path) / 1024:.1f} KB)")
+
+latest_alerts = {record['alert_id']: record for record in alerts_sink.read_records()}
+print(f"Alert records: {alerts_sink.records_written} for {len(latest_alerts)} alerts, "
+      f"alert {acked_id} acknowledged in sink: {latest_alerts[acked_id]['acknowledged']}")
+assert latest_alerts[acked_id]['acknowledged']
+
+# %% [markdown]
+# ### Streaming ด้วย AsyncDriftMonitoringService
+# จำลอง producer ที่ส่ง batch เล็กๆ เข้ามาเรื่อยๆ ขณะที่ scheduler ตรวจ drift ทุก 0.2 วินาที
+
+# %%
+async def run_streaming_demo(data: pd.DataFrame, batch_size: int = 50):
+    stream_config = MonitoringConfig(
+        features_to_monitor=['feature_a', 'feature_b', 'feature_c'],
+        check_interval_seconds=0.2
+    )
+    stream_pipeline = DriftMonitoringPipeline(stream_config)
+    stream_pipeline.initialize(data.iloc[:1000])
+    
+    service = AsyncDriftMonitoringService(stream_pipeline, max_queue_size=20)
+    await service.start()
+    
+    for i in range(1000, len(data), batch_size):
+        await service.submit(data.iloc[i:i + batch_size])
+        await asyncio.sleep(0.005)  # จำลองเวลาระหว่าง batch ที่เข้ามา
+    
+    await service.stop(drain=True)
+    stream_pipeline.close()
+    return service, stream_pipeline
+
+def run_async(coro):
+    """รัน coroutine ได้ทั้งใน script และใน Jupyter (ที่มี event loop ทำงานอยู่แล้ว)"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, coro).result()
+
+service, stream_pipeline = run_async(run_streaming_demo(test_data))
+stream_summary = stream_pipeline.get_summary_report()
+print(f"Rows ingested: {service.rows_ingested}")
+print(f"Checks run: {service.checks_run}")
+print(f"Max queue depth: {service.max_queue_depth}/{service.max_queue_size}")
+print(f"Total drifts detected: {stream_summary['total_drifts_detected']}")
+
+# %% [markdown]
+# ### Throughput Benchmark
+# วัดว่า pipeline scale อย่างไรเมื่อจำนวน features, ขนาด windows และ batch size เปลี่ยน:
+# - **rows/sec** ของ ingest และ **checks/sec** (1 check = ตรวจทุก feature หนึ่งรอบ)
+# - **p50/p99 latency** ของแต่ละ check
+# - **peak memory** (วัดด้วย tracemalloc ในรอบแยก เพื่อไม่ให้ overhead ปนกับเวลา)
+#
+# ผลลัพธ์บันทึกเป็น JSON ใช้ `compare_benchmarks` เทียบกับ baseline ของ version ก่อนเพื่อจับ regression
+
+# %%
+FULL_BENCHMARK_GRID = {
+    'n_features': [10, 100, 1000, 5000],
+    'reference_window_size': [500, 1000, 5000],
+    'current_window_size': [100, 200, 1000],
+    'batch_size': [50, 200, 1000]
+}
+
+def _benchmark_pipeline(data, features, params, n_checks, executor_mode):
+    """Ingest + check ตาม params คืน (ingest_times, check_times, rows)"""
+    config = MonitoringConfig(
+        reference_window_size=params['reference_window_size'],
+        current_window_size=params['current_window_size'],
+        features_to_monitor=features,
+        executor_mode=executor_mode
+    )
+    pipeline = DriftMonitoringPipeline(config)
+    pipeline.initialize(data.iloc[:params['reference_window_size']])
+    
+    stream = data.iloc[params['reference_window_size']:]
+    batch_size = params['batch_size']
+    ingest_times, check_times, rows = [], [], 0
+    try:
+        for start in range(0, len(stream), batch_size):
+            batch = stream.iloc[start:start + batch_size]
+            t0 = time.perf_counter()
+            pipeline.data_buffer.add_batch(batch)
+            t1 = time.perf_counter()
+            ingest_times.append(t1 - t0)
+            rows += len(batch)
+            
+            if pipeline.data_buffer.is_current_ready():
+                pipeline.check_drift()
+                check_times.append(time.perf_counter() - t1)
+                if len(check_times) >= n_checks:
+                    break
+    finally:
+        pipeline.close()
+    return ingest_times, check_times, rows
+
+def run_throughput_benchmark(n_features: int, reference_window_size: int, current_window_size: int,
+                             batch_size: int, n_checks: int = 20, executor_mode: str = 'serial') -> Dict:
+    """Benchmark หนึ่ง configuration"""
+    params = {
+        'n_features': n_features,
+        'reference_window_size': reference_window_size,
+        'current_window_size': current_window_size,
+        'batch_size': batch_size,
+        'executor_mode': executor_mode
+    }
+    # ข้อมูลพอสำหรับ reference + warm-up current window + n_checks batches
+    batches_to_ready = -(-current_window_size // batch_size)
+    n_samples = reference_window_size + (batches_to_ready + n_checks) * batch_size
+    data = generate_test_data(n_samples, n_extra_features=max(0, n_features - 3))
+    features = [c for c in data.columns if c != 'timestamp'][:n_features]
+    
+    ingest_times, check_times, rows = _benchmark_pipeline(data, features, params, n_checks, executor_mode)
+    
+    # รอบแยกสำหรับ peak memory (ตรวจ 3 รอบพอให้ buffers และ caches ถูกสร้างครบ)
+    tracemalloc.start()
+    _benchmark_pipeline(data, features, params, 3, executor_mode)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    latencies_ms = np.array(check_times) * 1000
+    return {
+        **params,
+        'rows_ingested': rows,
+        'ingest_rows_per_sec': rows / sum(ingest_times),
+        'checks': len(check_times),
+        'checks_per_sec': len(check_times) / sum(check_times) if check_times else 0.0,
+        'feature_checks_per_sec': len(check_times) * n_features / sum(check_times) if check_times else 0.0,
+        'check_latency_p50_ms': float(np.percentile(latencies_ms, 50)) if check_times else None,
+        'check_latency_p99_ms': float(np.percentile(latencies_ms, 99)) if check_times else None,
+        'peak_memory_mb': peak_bytes / 1024 ** 2
+    }
+
+def run_benchmark_suite(grid: Dict[str, List], output_path: str, n_checks: int = 20,
+                        executor_mode: str = 'serial') -> List[Dict]:
+    """รันทุก combination ใน grid แล้วบันทึกผลเป็น JSON"""
+    keys = list(grid.keys())
+    results = []
+    for values in itertools.product(*(grid[k] for k in keys)):
+        params = dict(zip(keys, values))
+        result = run_throughput_benchmark(**params, n_checks=n_checks, executor_mode=executor_mode)
+        results.append(result)
+        logger.info(
+            f"benchmark {params}: {result['ingest_rows_per_sec']:,.0f} rows/s, "
+            f"p99 {result['check_latency_p99_ms']:.1f} ms"
+        )
+    
+    report = {
+        'created_at': datetime.now().isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'results': results
+    }
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return results
+
+BENCHMARK_KEYS = ['n_features', 'reference_window_size', 'current_window_size', 'batch_size', 'executor_mode']
+HIGHER_IS_BETTER = ['ingest_rows_per_sec', 'checks_per_sec']
+LOWER_IS_BETTER = ['check_latency_p50_ms', 'check_latency_p99_ms', 'peak_memory_mb']
+
+def compare_benchmarks(baseline_path: str, current_path: str, tolerance: float = 0.10) -> pd.DataFrame:
+    """
+    เทียบผล benchmark สองไฟล์ คืนตารางของ metrics ที่แย่ลงเกิน tolerance
+    """
+    with open(baseline_path) as f:
+        baseline = {tuple(r[k] for k in BENCHMARK_KEYS): r for r in json.load(f)['results']}
+    with open(current_path) as f:
+        current = json.load(f)['results']
+    
+    regressions = []
+    for result in current:
+        base = baseline.get(tuple(result[k] for k in BENCHMARK_KEYS))
+        if base is None:
+            continue
+        for metric in HIGHER_IS_BETTER + LOWER_IS_BETTER:
+            old, new = base.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change < -tolerance if metric in HIGHER_IS_BETTER else change > tolerance
+            if worse:
+                regressions.append({
+                    **{k: result[k] for k in BENCHMARK_KEYS},
+                    'metric': metric, 'baseline': old, 'current': new, 'change': change
+                })
+    return pd.DataFrame(regressions)
+
+# %%
+# Quick sweep (ใช้ FULL_BENCHMARK_GRID สำหรับการวัดเต็มรูปแบบ ใช้เวลานาน)
+quick_grid = {
+    'n_features': [10, 100, 1000],
+    'reference_window_size': [1000],
+    'current_window_size': [200],
+    'batch_size': [200]
+}
+benchmark_path = f"monitoring_output/benchmarks/benchmark_{datetime.now():%Y%m%d_%H%M%S}.json"
+benchmark_results = run_benchmark_suite(quick_grid, benchmark_path, n_checks=10)
+
+benchmark_df = pd.DataFrame(benchmark_results)
+print(benchmark_df[[
+    'n_features', 'ingest_rows_per_sec', 'checks_per_sec', 'feature_checks_per_sec',
+    'check_latency_p50_ms', 'check_latency_p99_ms', 'peak_memory_mb'
+]].round(2).to_string(index=False))
+print(f"\n💾 Benchmark saved to {benchmark_path}")
+
+# เทียบกับตัวเอง = ไม่มี regression (ใน CI ให้เทียบกับไฟล์ของ version ก่อนหน้า)
+print(f"Regressions vs itself: {len(compare_benchmarks(benchmark_path, benchmark_path))}")
+
+# %% [markdown]
+# ### Per-stage Timing และ Sampled Profiling
+# เปิด `instrumentation_enabled` เพื่อดูว่าเวลาของแต่ละ check หมดไปกับ stage ไหน
+# และใช้ `profile_every_n_checks` แนบ cProfile กับบาง checks
+
+# %%
+def run_instrumented(data: pd.DataFrame, **config_kwargs) -> tuple:
+    instrumented_config = MonitoringConfig(features_to_monitor=list(data.columns), **config_kwargs)
+    instrumented_pipeline = DriftMonitoringPipeline(instrumented_config)
+    instrumented_pipeline.initialize(data.iloc[:1000])
+    start = time.perf_counter()
+    for i in range(1000, len(data), 50):
+        instrumented_pipeline.process_batch(data.iloc[i:i + 50])
+    elapsed = time.perf_counter() - start
+    instrumented_pipeline.close()
+    return instrumented_pipeline, elapsed
+
+instrumented_pipeline, _ = run_instrumented(
+    wide_data, instrumentation_enabled=True, profile_every_n_checks=5
+)
+print(instrumented_pipeline.instrumentation.report().round(1).to_string(index=False))
+
+sampled = instrumented_pipeline.instrumentation.profiles
+print(f"\nProfiled checks: {[p['check'] for p in sampled]}")
+print('\n'.join(sampled[0]['top'].splitlines()[:20]))
+
+# overhead ของ instrumentation (ไม่รวม profiling)
+_, disabled_time = run_instrumented(wide_data)
+_, enabled_time = run_instrumented(wide_data, instrumentation_enabled=True)
+print(f"Disabled: {disabled_time:.3f}s, enabled: {enabled_time:.3f}s "
+      f"({(enabled_time / disabled_time - 1) * 100:+.1f}%)")
+
+# %% [markdown]
+# ### Prometheus Metrics Endpoint
+# เปิด endpoint บน port ว่าง แล้ว scrape ด้วย urllib (เหมือนที่ Prometheus ทำ)
+# ใน production ให้ตั้ง `metrics_port` คงที่ แล้วเพิ่ม target ใน `prometheus.yml`
+
+# %%
+metrics_config = MonitoringConfig(
+    features_to_monitor=['feature_a', 'feature_b', 'feature_c'],
+    metrics_port=0
+)
+metrics_pipeline = DriftMonitoringPipeline(metrics_config)
+metrics_pipeline.initialize(reference_data)
+
+for i in range(0, 2000, 100):
+    metrics_pipeline.process_batch(remaining_data.iloc[i:i + 100])
+
+with urllib.request.urlopen(metrics_pipeline.metrics_exporter.url, timeout=5) as response:
+    scrape = response.read().decode('utf-8')
+metrics_pipeline.close()
+
+print(f"Scraped {metrics_pipeline.metrics_exporter.url}")
+for line in scrape.splitlines():
+    if line.startswith(('drift_feature_psi', 'drift_feature_state', 'drift_rows_ingested',
+                        'drift_checks_total', 'drift_check_duration_seconds_count', 'drift_active_alerts')):
+        print(f"   {line}")
+
+# %% [markdown]
+# ### Reference จาก Training Set ขนาดใหญ่ด้วย QuantileSketch
+# สร้าง sketch ทีละ chunk (เหมือนอ่านหลายไฟล์หรือแบ่งให้หลาย workers) แล้ว merge เข้า DataBuffer
+# จากนั้นเทียบ PSI/KS กับ window mode ที่เก็บค่าดิบของ training set ทั้งหมด
+
+# %%
+sketch_features = ['feature_a', 'feature_b', 'feature_c']
+training_rows, chunk_rows = 1_000_000, 100_000
+training_rng = np.random.default_rng(7)
+training_data = pd.DataFrame({
+    'feature_a': training_rng.normal(50, 10, training_rows),
+    'feature_b': training_rng.normal(100, 15, training_rows),
+    'feature_c': training_rng.normal(75, 12, training_rows)
+})
+
+# partial sketches ต่อ chunk -> merge
+start = time.perf_counter()
+partial_sketches = []
+for i in range(0, training_rows, chunk_rows):
+    chunk = training_data.iloc[i:i + chunk_rows]
+    partial = {}
+    for feature in sketch_features:
+        partial[feature] = QuantileSketch(k=400)
+        partial[feature].extend(chunk[feature].to_numpy())
+    partial_sketches.append(partial)
+
+sketch_pipeline = DriftMonitoringPipeline(MonitoringConfig(
+    features_to_monitor=sketch_features, reference_mode='sketch'
+))
+for partial in partial_sketches:
+    sketch_pipeline.data_buffer.merge_reference_sketches(partial)
+sketch_build = time.perf_counter() - start
+
+exact_pipeline = DriftMonitoringPipeline(MonitoringConfig(
+    features_to_monitor=sketch_features, reference_window_size=training_rows
+))
+exact_pipeline.initialize(training_data)
+
+sketch_results, exact_results = [], []
+for i in range(0, len(remaining_data), batch_size):
+    batch = remaining_data.iloc[i:i + batch_size]
+    sketch_results += sketch_pipeline.process_batch(batch)
+    exact_results += exact_pipeline.process_batch(batch)
+
+sketch_bytes = sum(sk.nbytes for sk in sketch_pipeline.data_buffer.reference_data.values())
+exact_bytes = sum(rb._data.nbytes for rb in exact_pipeline.data_buffer.reference_data.values())
+print(f"Reference rows: {training_rows:,} x {len(sketch_features)} features (sketch built in {sketch_build:.2f}s)")
+print(f"Reference memory: sketch {sketch_bytes / 1024:.1f} KB vs raw {exact_bytes / 1024 ** 2:.1f} MB")
+
+psi_error = max(abs(a.psi - b.psi) for a, b in zip(sketch_results, exact_results))
+ks_error = max(abs(a.ks_statistic - b.ks_statistic) for a, b in zip(sketch_results, exact_results))
+same_decision = sum(a.drift_detected == b.drift_detected for a, b in zip(sketch_results, exact_results))
+print(f"Max |PSI error|: {psi_error:.4f}, max |KS error|: {ks_error:.4f}")
+print(f"Same drift decision: {same_decision}/{len(exact_results)} checks")
+
+sketch_pipeline.close()
+exact_pipeline.close()
+del training_data
+
+# %% [markdown]
+# ### Decayed Reference กับ Gradual Drift
+# เรียก `update_reference()` หลังทุก check เทียบ window mode (append current window เข้า reference)
+# กับ decayed mode ที่ half-life ต่างกัน ดู PSI ของ feature_a ซึ่งมี gradual drift
+
+# %%
+decay_runs = {
+    'window': dict(reference_mode='window'),
+    'half_life=500': dict(reference_mode='decayed', reference_half_life=500),
+    'half_life=2000': dict(reference_mode='decayed', reference_half_life=2000)
+}
+decay_psi = {}
+for label, mode_kwargs in decay_runs.items():
+    decay_pipeline = DriftMonitoringPipeline(MonitoringConfig(
+        features_to_monitor=['feature_a', 'feature_b', 'feature_c'],
+        instrumentation_enabled=True, **mode_kwargs
+    ))
+    decay_pipeline.initialize(reference_data)
+    psi_trace = []
+    for i in range(0, len(remaining_data), batch_size):
+        results = decay_pipeline.process_batch(remaining_data.iloc[i:i + batch_size])
+        psi_trace += [r.psi for r in results if r.feature == 'feature_a']
+        if results:
+            decay_pipeline.data_buffer.update_reference()
+    decay_psi[label] = psi_trace
+    report = decay_pipeline.instrumentation.report().set_index('stage')
+    print(f"{label:>15}: update_reference mean {report.loc['update_reference', 'mean_us']:.1f} us, "
+          f"max PSI(feature_a)={max(psi_trace):.3f}")
+    decay_pipeline.close()
+
+print(pd.DataFrame(decay_psi).round(3).to_string())
+
+# %% [markdown]
+# ### Multi-tenant Scaling
+# ตรวจว่า memory ต่อ tenant และ throughput (tenant checks/sec) คงที่เมื่อจำนวน tenants เพิ่มขึ้น
+# เทียบกับการสร้าง `DriftMonitoringPipeline` แยกต่อ tenant
+
+# %%
+tenant_features = ['f0', 'f1', 'f2', 'f3', 'f4']
+tenant_config = MonitoringConfig(
+    features_to_monitor=tenant_features,
+    reference_window_size=500, current_window_size=100,
+    executor_mode='thread'
+)
+
+def tenant_frames(n_tenants: int, n_rows: int, shift: float = 0.0, seed: int = 0):
+    """DataFrame ต่อ tenant (tenant เลขคี่มี drift = shift)"""
+    rng = np.random.default_rng(seed)
+    for t in range(n_tenants):
+        values = rng.normal(0, 1, size=(n_rows, len(tenant_features))) + shift * (t % 2)
+        yield f'model_{t:05d}', pd.DataFrame(values, columns=tenant_features)
+
+def measure_manager(n_tenants: int, repeats: int = 3) -> Dict:
+    tracemalloc.start()
+    manager = DriftPipelineManager(tenant_config)
+    for tenant_id, reference in tenant_frames(n_tenants, 500):
+        manager.add_tenant(tenant_id, reference)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    
+    # best-of-N: ตัด noise จาก load ของเครื่องออกจาก throughput
+    batches = list(tenant_frames(n_tenants, 100, shift=0.5, seed=1))
+    elapsed = float('inf')
+    for _ in range(repeats):
+        for tenant_id, batch in batches:
+            manager.add_batch(tenant_id, batch)
+        start = time.perf_counter()
+        results = manager.run_checks()
+        elapsed = min(elapsed, time.perf_counter() - start)
+    manager.close()
+    return {
+        'tenants': n_tenants,
+        'kb_per_tenant': memory / n_tenants / 1024,
+        'tenant_checks_per_sec': len(results) / elapsed
+    }
+
+def measure_separate_pipelines(n_tenants: int) -> Dict:
+    tracemalloc.start()
+    pipelines = []
+    for tenant_id, reference in tenant_frames(n_tenants, 500):
+        tenant_pipeline = DriftMonitoringPipeline(tenant_config)
+        tenant_pipeline.initialize(reference)
+        pipelines.append(tenant_pipeline)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    
+    for tenant_pipeline, (_, batch) in zip(pipelines, tenant_frames(n_tenants, 100, shift=0.5, seed=1)):
+        tenant_pipeline.data_buffer.add_batch(batch)
+    start = time.perf_counter()
+    for tenant_pipeline in pipelines:
+        tenant_pipeline.check_drift()
+    elapsed = time.perf_counter() - start
+    for tenant_pipeline in pipelines:
+        tenant_pipeline.close()
+    return {
+        'tenants': n_tenants,
+        'kb_per_tenant': memory / n_tenants / 1024,
+        'tenant_checks_per_sec': n_tenants / elapsed
+    }
+
+measure_manager(50)  # warm-up: thread pool และ cache ของ exact KS p-values
+scaling = pd.DataFrame([measure_manager(n) for n in [250, 1000, 4000]])
+print("DriftPipelineManager:")
+print(scaling.round(1).to_string(index=False))
+print("\nOne DriftMonitoringPipeline per tenant:")
+print(pd.DataFrame([measure_separate_pipelines(250)]).round(1).to_string(index=False))
+
+# memory ต่อ tenant และ throughput ต้องไม่แย่ลงตามจำนวน tenants
+# bound ของ throughput หลวมเพื่อทน timing noise: ถ้างานต่อ check โตตามจำนวน tenants (16 เท่า) ratio จะต่ำกว่า 0.1
+memory_growth = scaling['kb_per_tenant'].iloc[-1] / scaling['kb_per_tenant'].iloc[0]
+throughput_ratio = scaling['tenant_checks_per_sec'].iloc[-1] / scaling['tenant_checks_per_sec'].iloc[0]
+print(f"\nkb/tenant ratio (4000 vs 250 tenants): {memory_growth:.2f}")
+print(f"checks/sec ratio (4000 vs 250 tenants): {throughput_ratio:.2f}")
+assert memory_growth < 1.5, "memory per tenant grows with tenant count"
+assert throughput_ratio > 0.5, "tenant check throughput drops with tenant count"
+
+# %% [markdown]
+# ### Checkpoint และ Restore หลัง Redeploy
+# รัน pipeline ครึ่งหนึ่งของข้อมูล, checkpoint, จำลอง restart ด้วย `DriftMonitoringPipeline.restore`
+# แล้วส่งข้อมูลที่เหลือให้ทั้งสอง pipeline ผลลัพธ์ต้องเหมือนกัน (ไม่มี warm-up)
+
+# %%
+checkpoint_dir = 'monitoring_output/checkpoints'
+shutil.rmtree(checkpoint_dir, ignore_errors=True)
+
+checkpoint_config = MonitoringConfig(
+    features_to_monitor=['feature_a', 'feature_b', 'feature_c'],
+    results_segment_size=20,  # ให้มี sealed segments ใน checkpoint
+    checkpoint_dir=checkpoint_dir,
+    checkpoint_interval_seconds=0.2
+)
+original = DriftMonitoringPipeline(checkpoint_config)
+original.initialize(reference_data)
+
+half = len(remaining_data) // 2
+for i in range(0, half, 100):
+    original.process_batch(remaining_data.iloc[i:i + 100])
+time.sleep(0.5)  # ให้ background thread checkpoint อย่างน้อยหนึ่งครั้ง
+checkpoint_path = original.checkpointer.save()
+print(f"Background checkpoints: {original.checkpointer.checkpoints_written - 1}, "
+      f"last write {original.checkpointer.last_duration * 1000:.1f} ms -> {checkpoint_path}")
+# จำลองว่า process เดิมหยุดทำงาน: ไม่ checkpoint ทับ pipeline ที่ restore แล้ว
+original.checkpointer.stop()
+original.checkpointer = None
+
+start = time.perf_counter()
+restored = DriftMonitoringPipeline.restore(checkpoint_dir)
+print(f"Restore: {(time.perf_counter() - start) * 1000:.1f} ms, "
+      f"{len(restored.results_store)} results, {len(restored.alert_manager.alerts)} alerts, "
+      f"current window {len(restored.data_buffer.current_data['feature_a'])} rows")
+
+def alert_keys(pipeline: DriftMonitoringPipeline) -> List[tuple]:
+    return [(a.alert_id, a.feature, a.severity, a.message, a.occurrences) for a in pipeline.alert_manager.alerts]
+
+# alerts และ cooldowns (last_alert_time) ต้องกลับมาครบตั้งแต่ก่อนส่งข้อมูลต่อ
+assert alert_keys(restored) == alert_keys(original)
+assert restored.alert_manager.last_alert_time == original.alert_manager.last_alert_time
+
+original_after, restored_after = [], []
+for i in range(half, len(remaining_data), 100):
+    batch = remaining_data.iloc[i:i + 100]
+    original_after += [(r.feature, r.psi, r.ks_pvalue, r.drift_type) for r in original.process_batch(batch)]
+    restored_after += [(r.feature, r.psi, r.ks_pvalue, r.drift_type) for r in restored.process_batch(batch)]
+
+# cooldown ที่หายไปจะทำให้ pipeline ที่ restore สร้าง alerts เกิน -> alert ids ไม่ตรงกัน
+assert original_after == restored_after
+assert alert_keys(restored) == alert_keys(original)
+assert restored.alert_manager.last_alert_time.keys() == original.alert_manager.last_alert_time.keys()
+print(f"✅ Results ({len(restored_after)}) and alerts ({len(restored.alert_manager.alerts)}) identical after restore")
+restored.close()
+original.close()
+
+# %% [markdown]
+# ### Categorical Features
+# `region` เปลี่ยนสัดส่วนหลัง sample 2000, `merchant_id` มี ~5,000 ค่า (high cardinality)
+# เก็บเฉพาะ top-k + 'other' และมี merchants ใหม่ที่ไม่เคยเห็นใน reference หลัง sample 3000
+# ตรวจว่า chi-squared จาก incremental counts ตรงกับ `stats.chi2_contingency` บน window ดิบ
+#
+# categorical PSI ไวต่อ categories ที่ไม่มีใน current window (eps = 1e-6 เหมือน LAB 2)
+# จึงควรเลือก `categorical_top_k` ให้แต่ละ category มีตัวอย่างพอใน `current_window_size`
+
+# %%
+def generate_categorical_data(n_samples=5000, seed=0):
+    rng = np.random.default_rng(seed)
+    regions = np.array(['north', 'south', 'east', 'west', 'central'])
+    before = [0.3, 0.25, 0.2, 0.15, 0.1]
+    after = [0.1, 0.15, 0.2, 0.25, 0.3]
+    region = np.where(
+        np.arange(n_samples) < 2000,
+        rng.choice(regions, n_samples, p=before),
+        rng.choice(regions, n_samples, p=after)
+    )
+    merchant = rng.zipf(1.5, n_samples) % 5000
+    merchant = np.where(np.arange(n_samples) >= 3000, merchant + 5000 * (rng.random(n_samples) < 0.3), merchant)
+    return pd.DataFrame({
+        'feature_a': rng.normal(50, 10, n_samples),
+        'region': region,
+        'merchant_id': [f'm{m}' for m in merchant]
+    })
+
+categorical_data = generate_categorical_data()
+categorical_config = MonitoringConfig(
+    features_to_monitor=['feature_a', 'region', 'merchant_id'],
+    categorical_features=['region', 'merchant_id'],
+    categorical_top_k=20,
+    current_window_size=1000
+)
+categorical_pipeline = DriftMonitoringPipeline(categorical_config)
+categorical_pipeline.initialize(categorical_data.iloc[:1000])
+
+for i in range(1000, len(categorical_data), 250):
+    results = categorical_pipeline.process_batch(categorical_data.iloc[i:i + 250])
+    for r in results:
+        if r.feature != 'feature_a' and i % 1000 == 0:
+            print(f"rows {i:5d} {r.feature:12s} chi2={r.ks_statistic:8.1f} "
+                  f"p={r.ks_pvalue:.4f} PSI={r.psi:.4f} {r.drift_type}")
+
+# เทียบกับ scipy บน window ดิบ (decode กลับจาก codes)
+buffer = categorical_pipeline.data_buffer
+for feature in categorical_config.categorical_features:
+    n_codes = buffer.encoders[feature].n_codes
+    reference_counts = np.bincount(buffer.reference_data[feature].view(), minlength=n_codes)
+    current_counts = np.bincount(buffer.current_data[feature].view(), minlength=n_codes)
+    assert np.array_equal(reference_counts, buffer.reference_data[feature].counts)
+    assert np.array_equal(current_counts, buffer.current_data[feature].counts)
+    
+    table = np.array([reference_counts, current_counts])
+    table = table[:, table.sum(axis=0) > 0]
+    expected = stats.chi2_contingency(table, correction=False)
+    metrics = categorical_pipeline.drift_calculator.calculate_categorical_batch(
+        reference_counts[None, :], current_counts[None, :]
+    )
+    print(f"{feature}: {n_codes} codes, chi2 {metrics['ks_statistic'][0]:.3f} vs scipy {expected[0]:.3f}, "
+          f"p {metrics['ks_pvalue'][0]:.3g} vs {expected[1]:.3g}")
+    assert np.isclose(metrics['ks_statistic'][0], expected[0])
+    assert np.isclose(metrics['ks_pvalue'][0], expected[1])
+
+# mean/std ของ categorical ไม่มีความหมาย -> to_dict ต้องเป็น JSON ที่ strict consumers อ่านได้
+categorical_record = categorical_pipeline.results_store.latest('region').to_dict()
+json.dumps(categorical_record, allow_nan=False)
+assert categorical_record['test_name'] == 'chi2' and categorical_record['current_mean'] is None
+
+categorical_pipeline.close()
+
+# %% [markdown]
+# ### Alert Store หลัง Alerts จำนวนมาก
+# สร้าง 1M alerts (acknowledge ทั้งหมดยกเว้น 500 ล่าสุด) โดยเก็บใน memory แค่ 10,000 ที่เหลือย้ายไป SQLite
+# แล้ววัดเวลา query active alerts และ acknowledge ด้วย alert_id เทียบตอนที่มี alerts น้อย
+# และดู dedup ของ pipeline เมื่อไม่มี cooldown
+
+# %%
+def fill_alert_store(store: AlertStore, n_alerts: int, n_features: int = 500, n_active: int = 500, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    severities = list(AlertSeverity)
+    start = datetime(2024, 1, 1)
+    for i, (f, s) in enumerate(zip(rng.integers(0, n_features, n_alerts), rng.integers(0, 3, n_alerts))):
+        alert = store.add(Alert(
+            timestamp=start + timedelta(seconds=i), severity=severities[s],
+            message=f'drift in feature_{f:04d}', details={'psi': 0.3}, feature=f'feature_{f:04d}'
+        ))
+        if i >= n_active:
+            store.acknowledge(alert.alert_id - n_active)  # ค้างเป็น active แค่ n_active alerts ล่าสุด
+
+def time_alert_queries(store: AlertStore, repeat: int = 200) -> Dict:
+    stats_row = {'in_memory': len(store), 'active': store.count_active()}
+    start = time.perf_counter()
+    for _ in range(repeat):
+        store.query(acknowledged=False)
+        store.query(feature='feature_0042', acknowledged=False)
+        store.query(severity=AlertSeverity.CRITICAL, acknowledged=False)
+    stats_row['query_us'] = (time.perf_counter() - start) / repeat * 1e6
+    active_ids = [a.alert_id for a in store.query(acknowledged=False)][:repeat]
+    start = time.perf_counter()
+    for alert_id in active_ids:
+        store.acknowledge(alert_id)
+    stats_row['ack_us'] = (time.perf_counter() - start) / len(active_ids) * 1e6
+    return stats_row
+
+archive_path = 'monitoring_output/alerts/archive.sqlite'
+if os.path.exists(archive_path):
+    os.remove(archive_path)
+
+alert_stats = {}
+for n_alerts in (10_000, 1_000_000):
+    store = AlertStore(max_alerts=10_000, archive_path=archive_path if n_alerts > 10_000 else None, dedup=False)
+    start = time.perf_counter()
+    fill_alert_store(store, n_alerts)
+    fill_s = time.perf_counter() - start
+    alert_stats[n_alerts] = time_alert_queries(store)
+    row = alert_stats[n_alerts]
+    print(f"{n_alerts:>9,} alerts (fill {fill_s:.1f}s): {row['in_memory']:,} in memory, {row['active']} active, "
+          f"active queries {row['query_us']:.0f} us, acknowledge {row['ack_us']:.1f} us")
+    if n_alerts > 10_000:
+        oldest = store.archived(feature='feature_0042', limit=1)[0]
+        print(f"archived {store.total_archived:,}, latest archived for feature_0042: id={oldest.alert_id}, "
+              f"ack by id in archive -> {store.acknowledge(oldest.alert_id)}")
+    store.close()
+
+# query ของ active alerts สแกนเฉพาะ active index: ขนาดเท่ากันทั้ง 10k และ 1M alerts (ไม่ขึ้นกับ total_archived)
+# และเวลา query ต้องไม่โตตามจำนวน alerts ทั้งหมด (bound หลวมกัน timing noise; สแกนทั้ง 1M จะช้ากว่า ~100 เท่า)
+query_ratio = alert_stats[1_000_000]['query_us'] / alert_stats[10_000]['query_us']
+print(f"Active query time ratio (1M vs 10k alerts): {query_ratio:.2f}")
+assert alert_stats[1_000_000]['active'] == alert_stats[10_000]['active'] == 500
+assert alert_stats[1_000_000]['in_memory'] <= 10_000
+assert query_ratio < 10, "active alert queries scale with total alerts"
+
+# Dedup ใน pipeline: ไม่มี cooldown -> drift ซ้ำรวมเข้า alert เดิมจนกว่าจะ acknowledge
+dedup_pipeline = DriftMonitoringPipeline(MonitoringConfig(
+    features_to_monitor=['feature_a', 'feature_b', 'feature_c'],
+    alert_cooldown_minutes=0
+))
+dedup_pipeline.initialize(reference_data)
+for i in range(0, len(remaining_data), 100):
+    dedup_pipeline.process_batch(remaining_data.iloc[i:i + 100])
+for alert in dedup_pipeline.alert_manager.get_active_alerts():
+    print(f"#{alert.alert_id} {alert.feature} {alert.severity.value}: {alert.occurrences} occurrences")
+dedup_pipeline.close()
+
+# %% [markdown]
+# ### Alert Dispatch ไปยัง Webhook ที่ช้า
+# Local HTTP stand-in ของ webhook: ตอบช้า 0.2 วินาทีต่อ request และตอบ 500 ใน 2 requests แรก
+# เทียบเวลา ingest ของ pipeline ที่มี alert sinks กับที่ไม่มี (ไม่มี cooldown/dedup เพื่อให้มี alerts มาก)
+# แล้วตรวจว่า receiver และไฟล์ได้รับ alerts ครบ
+
+# %%
+class AlertReceiver:
+    """Webhook stand-in: เก็บ alerts ที่ได้รับ ตอบช้า `delay` วินาที และตอบ 500 ใน `fail_first` requests แรก"""
+    
+    def __init__(self, delay: float = 0.2, fail_first: int = 2):
+        receiver = self
+        self.delay = delay
+        self.fail_first = fail_first
+        self.requests = 0
+        self.alerts: List[Dict] = []
+        self.lock = threading.Lock()
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                time.sleep(receiver.delay)
+                with receiver.lock:
+                    receiver.requests += 1
+                    failed = receiver.requests <= receiver.fail_first
+                    if not failed:
+                        receiver.alerts.extend(json.loads(body)['alerts'])
+                self.send_response(500 if failed else 200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/alerts"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def run_alert_heavy(alert_sinks: List[AlertSink]) -> tuple:
+    pipeline = DriftMonitoringPipeline(MonitoringConfig(
+        features_to_monitor=['feature_a', 'feature_b', 'feature_c'],
+        alert_cooldown_minutes=0,
+        alert_dedup=False,
+        alert_sinks=alert_sinks,
+        alert_batch_size=20,
+        alert_flush_seconds=0.1,
+        alert_retry_backoff_seconds=0.1
+    ))
+    pipeline.initialize(reference_data)
+    start = time.perf_counter()
+    for i in range(0, len(remaining_data), 50):
+        pipeline.process_batch(remaining_data.iloc[i:i + 50])
+    return pipeline, time.perf_counter() - start
+
+receiver = AlertReceiver(delay=0.2, fail_first=2)
+alert_file = 'monitoring_output/alerts/dispatched.jsonl'
+if os.path.exists(alert_file):
+    os.remove(alert_file)
+
+logger.setLevel(logging.ERROR)  # ไม่ให้ log ของ alerts จำนวนมากรก output
+run_alert_heavy([])[0].close()  # warm-up
+baseline_pipeline, baseline_s = run_alert_heavy([])
+dispatch_pipeline, dispatch_s = run_alert_heavy([
+    WebhookAlertSink(receiver.url, concurrency=2), FileAlertSink(alert_file), LogAlertSink()
+])
+n_alerts = dispatch_pipeline.alert_manager.store.total_created
+
+start = time.perf_counter()
+dispatch_pipeline.alert_manager.dispatcher.flush(timeout=60)
+flush_s = time.perf_counter() - start
+logger.setLevel(logging.INFO)
+
+print(f"Ingest without sinks: {baseline_s:.2f}s, with webhook/file/log sinks: {dispatch_s:.2f}s "
+      f"(overhead {dispatch_s - baseline_s:+.2f}s, {n_alerts} alerts, drain after ingest {flush_s:.2f}s)")
+print(f"Check latency p99: {baseline_pipeline.check_latency.quantile(0.99) / 1e6:.1f} ms without sinks, "
+      f"{dispatch_pipeline.check_latency.quantile(0.99) / 1e6:.1f} ms with sinks")
+print(f"Synchronous POST per alert would add ~{n_alerts * receiver.delay:.0f}s to ingest")
+print(f"Webhook requests: {receiver.requests}, alerts received: {len(receiver.alerts)}")
+for name, sink_stats in dispatch_pipeline.alert_manager.dispatcher.stats.items():
+    print(f"  {name:8s} {sink_stats}")
+
+with open(alert_file) as f:
+    file_alerts = [json.loads(line) for line in f]
+assert len(receiver.alerts) == len(file_alerts) == n_alerts
+assert sorted(a['alert_id'] for a in receiver.alerts) == list(range(n_alerts))
+assert dispatch_pipeline.alert_manager.dispatcher.stats['webhook']['retries'] >= 1
+# delivery ต้องไม่เพิ่ม latency ของ check: ถ้า POST แบบ synchronous ทุก check ที่มี alert จะช้าขึ้น >= receiver.delay
+# margin ครึ่งหนึ่งของ receiver.delay กว้างพอสำหรับ timing noise แต่แคบกว่า POST หนึ่งครั้ง
+delivery_margin_ns = receiver.delay / 2 * 1e9
+assert (dispatch_pipeline.check_latency.quantile(0.99)
+        < baseline_pipeline.check_latency.quantile(0.99) + delivery_margin_ns)
+assert dispatch_s < baseline_s + n_alerts * receiver.delay / 4
+
+baseline_pipeline.close()
+dispatch_pipeline.close()
+receiver.stop()
+
+# %% [markdown]
+# ### Report หลังรันนาน
+# จำลอง history 20,000 checks × 10 features แล้วเทียบ trend plot/HTML แบบ downsample (LTTB 1,000 จุด)
+# กับแบบทุกจุด และดูว่า report ครั้งถัดไป render panel ใหม่เฉพาะ features ที่มี results ใหม่
+
+# %%
+def fill_long_history(pipeline: DriftMonitoringPipeline, n_checks: int, features: List[str],
+                      start_time: datetime, seed: int = 0):
+    """เติม results จำลอง (PSI มี noise + ช่วง drift เป็นระยะ) ลง results store และ aggregator"""
+    rng = np.random.default_rng(seed)
+    config = pipeline.config
+    for feature in features:
+        psi = np.abs(rng.normal(0.03, 0.02, n_checks))
+        for center in rng.integers(0, n_checks, 5):
+            psi[center:center + 50] += rng.uniform(0.15, 0.5)
+        results = []
+        for t in range(n_checks):
+            drift_type = pipeline.drift_calculator.determine_drift_type(psi[t], config)
+            results.append(DriftResult(
+                timestamp=start_time + timedelta(minutes=t), feature=feature,
+                drift_detected=drift_type != DriftType.NONE, drift_type=drift_type, psi=float(psi[t]),
+                ks_statistic=0.0, ks_pvalue=1.0, reference_mean=0.0, current_mean=0.0,
+                reference_std=1.0, current_std=1.0
+            ))
+        pipeline.results_store.extend(results)
+        for r in results:
+            pipeline.summary_aggregator.update(r)
+
+long_features = [f'feature_{i:02d}' for i in range(10)]
+long_pipeline = DriftMonitoringPipeline(MonitoringConfig(features_to_monitor=long_features))
+n_long_checks = 20_000
+fill_long_history(long_pipeline, n_long_checks, long_features, datetime(2024, 1, 1))
+
+# LTTB เลือกจุดตามรูปร่าง ค่าสูงสุดหลัง downsample จึงใกล้เคียง (ไม่จำเป็นต้องเท่ากับ) ค่าจริง
+rows = long_pipeline.results_store.query('feature_00')
+kept = rows[lttb_indices(rows['timestamp'].astype(np.int64), rows['psi'], 1000)]
+print(f"LTTB: {len(rows):,} -> {len(kept):,} points, max PSI {rows['psi'].max():.4f} -> {kept['psi'].max():.4f}")
+
+for label, max_points in (('all points', n_long_checks), ('LTTB 1000', 1000)):
+    generator = ReportGenerator(long_pipeline, max_points=max_points)
+    start = time.perf_counter()
+    generator.plot_drift_trends(save_path=f'monitoring_output/reports/long_trends_{max_points}.png')
+    plot_s = time.perf_counter() - start
+    plt.close('all')
+    
+    report_path = f'monitoring_output/reports/long_report_{max_points}.html'
+    start = time.perf_counter()
+    generator.generate_html_report(report_path)
+    html_s = time.perf_counter() - start
+    print(f"{label:>10}: plot {plot_s:.2f}s, HTML {html_s * 1000:.0f} ms "
+          f"({os.path.getsize(report_path) / 1e6:.2f} MB)")
+
+# Refresh: ไม่มี results ใหม่ -> ใช้ panels จาก cache ทั้งหมด
+rendered = generator.panels_rendered
+start = time.perf_counter()
+generator.generate_html_report(report_path)
+print(f"Refresh without new results: {(time.perf_counter() - start) * 1000:.1f} ms, "
+      f"{generator.panels_rendered - rendered} panels re-rendered")
+
+# Results ใหม่เฉพาะ 2 features -> render ใหม่แค่ 2 panels
+fill_long_history(long_pipeline, 10, long_features[:2], datetime(2024, 1, 1) + timedelta(minutes=n_long_checks), seed=1)
+rendered = generator.panels_rendered
+start = time.perf_counter()
+generator.generate_html_report(report_path)
+print(f"Refresh after new results for 2 features: {(time.perf_counter() - start) * 1000:.1f} ms, "
+      f"{generator.panels_rendered - rendered} panels re-rendered")
+assert generator.panels_rendered - rendered == 2
+long_pipeline.close()
+
+# %% [markdown]
+# ### Dashboard Polling ด้วย Cursor
+# จำลอง dashboard ที่ poll หลังทุก batch: เทียบขนาด/เวลาของ payload แบบ full กับ delta (`since=cursor`)
+# แล้วตรวจว่า client ที่รวม deltas ได้ PSI series และ active alerts เหมือนกับแบบ full
+# (segment_size เล็กเพื่อให้มีการ seal ระหว่าง polls)
+
+# %%
+dashboard_pipeline = DriftMonitoringPipeline(MonitoringConfig(
+    features_to_monitor=['feature_a', 'feature_b', 'feature_c'],
+    results_segment_size=50,
+    alert_cooldown_minutes=0
+))
+dashboard_pipeline.initialize(reference_data)
+dashboard = ReportGenerator(dashboard_pipeline)
+
+snapshot = dashboard.generate_dashboard_data()
+cursor = snapshot['cursor']
+client_features = list(snapshot['features'])
+client_psi = {f: list(ts['psi_values']) for f, ts in snapshot['time_series'].items()}
+client_alerts = {a['alert_id']: a for a in snapshot['alerts']}
+
+poll_stats = []
+for n_batch, i in enumerate(range(0, len(remaining_data), 50)):
+    dashboard_pipeline.process_batch(remaining_data.iloc[i:i + 50])
+    if n_batch == 40:
+        # acknowledge ระหว่างทาง -> ต้องส่งไปใน delta ด้วย
+        for alert in dashboard_pipeline.alert_manager.get_active_alerts()[:3]:
+            dashboard_pipeline.alert_manager.acknowledge_alert(alert.alert_id)
+    
+    start = time.perf_counter()
+    delta = dashboard.generate_dashboard_data(since=cursor)
+    delta_s = time.perf_counter() - start
+    start = time.perf_counter()
+    full = dashboard.generate_dashboard_data()
+    full_s = time.perf_counter() - start
+    poll_stats.append((len(json.dumps(full)), len(json.dumps(delta)), full_s, delta_s))
+    
+    assert delta['mode'] == 'delta'
+    cursor = delta['cursor']
+    client_features += delta['new_features']
+    for feature_id, psi in zip(delta['results']['f'], delta['results']['psi']):
+        client_psi.setdefault(client_features[feature_id], []).append(psi)
+    for alert in delta['alerts']:
+        client_alerts[alert['alert_id']] = alert
+
+poll_stats = np.array(poll_stats)
+print(f"{len(poll_stats)} polls, {len(dashboard_pipeline.results_store)} results, "
+      f"{len(dashboard_pipeline.results_store.segments)} sealed segments")
+print(f"Last poll: full {poll_stats[-1, 0] / 1024:.1f} KB in {poll_stats[-1, 2] * 1000:.2f} ms, "
+      f"delta {poll_stats[-1, 1] / 1024:.2f} KB in {poll_stats[-1, 3] * 1000:.2f} ms")
+print(f"Total transferred: full {poll_stats[:, 0].sum() / 1e6:.1f} MB, delta {poll_stats[:, 1].sum() / 1e6:.3f} MB")
+
+for feature, ts in full['time_series'].items():
+    assert np.allclose(client_psi[feature], ts['psi_values'], atol=1e-6)
+client_active = {alert_id for alert_id, a in client_alerts.items() if not a['acknowledged']}
+assert client_active == {a['alert_id'] for a in full['alerts']}
+print(f"Client state matches full payload: {len(client_active)} active alerts")
+
+# cursor ที่เก่ากว่า segment ล่าสุดที่ seal ไปแล้ว -> ได้ full payload กลับมา
+print(f"Stale cursor -> mode '{dashboard.generate_dashboard_data(since='0.0.0')['mode']}'")
+dashboard_pipeline.close()
+
+# %% [markdown]
+# ### Backtest Configs ด้วย Replay Engine
+# history 300,000 rows (1 row ต่อนาที): `feature_b` เปลี่ยนแบบ sudden ที่ row 150,000,
+# `feature_a` ค่อยๆ เปลี่ยนตั้งแต่ row 200,000, `feature_c` ไม่เปลี่ยน
+# replay จาก CSV ด้วยหลาย window sizes / thresholds แล้วเทียบ alerts, detection delay และ cost
+
+# %%
+def generate_history(n_rows: int = 300_000, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    idx = np.arange(n_rows)
+    gradual = np.clip((idx - 200_000) / 50_000, 0, 1) * 20
+    return pd.DataFrame({
+        'timestamp': pd.date_range('2024-01-01', periods=n_rows, freq='min'),
+        'feature_a': rng.normal(50 + gradual, 10),
+        'feature_b': rng.normal(np.where(idx < 150_000, 100, 130), 15),
+        'feature_c': rng.normal(75, 12, n_rows)
+    })
+
+history_path = 'monitoring_output/history.csv'
+history = generate_history()
+history.to_csv(history_path, index=False)
+onsets = {
+    'feature_b': history['timestamp'][150_000].to_pydatetime(),
+    'feature_a': history['timestamp'][200_000].to_pydatetime()
+}
+
+start = time.perf_counter()
+engine = ReplayEngine.from_file(history_path, ['feature_a', 'feature_b', 'feature_c'])
+print(f"Prepared {len(engine):,} rows in {time.perf_counter() - start:.2f}s "
+      f"(cached, later runs memory-map {engine.values_path})")
+
+base = MonitoringConfig(features_to_monitor=['feature_a', 'feature_b', 'feature_c'], alert_cooldown_minutes=24 * 60)
+candidates = {
+    f'window={window}, severe={severe}': dataclasses.replace(
+        base, current_window_size=window, psi_severe_threshold=severe,
+        psi_moderate_threshold=min(base.psi_moderate_threshold, severe)
+    )
+    for window in (100, 200, 500)
+    for severe in (0.25, 0.5)
+}
+
+start = time.perf_counter()
+backtest = engine.compare(candidates, reference_rows=5000, batch_size=200, drift_onsets=onsets)
+compare_s = time.perf_counter() - start
+print(backtest.to_string())
+print(f"\n{len(candidates)} configs in {compare_s:.1f}s wall "
+      f"({backtest['wall_seconds'].sum():.1f}s of replay across {os.cpu_count()} CPUs)")
+
+# replay ใน process เดียวได้ผลเหมือน worker (delay วัดด้วย event time จึงไม่ขึ้นกับความเร็วเครื่อง)
+single = engine.run(candidates['window=200, severe=0.25'], reference_rows=5000, batch_size=200, drift_onsets=onsets)
+assert single['alerts'] == backtest.loc['window=200, severe=0.25', 'alerts']
+assert single['mean_delay'] == backtest.loc['window=200, severe=0.25', 'mean_delay']
+
+# retention ที่เก็บ alerts ไม่ครบ -> ValueError ก่อนเริ่ม replay (ไม่ต้องรอ backtest จบ)
+start = time.perf_counter()
+try:
+    replay_pipeline(dataclasses.replace(base, alert_retention=1000), engine.values, engine.timestamps,
+                    engine.features, reference_rows=5000, batch_size=200)
+except ValueError as e:
+    print(f"Rejected in {(time.perf_counter() - start) * 1000:.1f} ms: {e}")
+else:
+    raise AssertionError("bounded alert_retention was accepted")
+
 # %% [markdown]
 # ## ส่วนที่ 7: Integration กับ MLflow (Optional)
 
@@ -4357,55 +9969,198 @@ except ImportError:
     print("   Install with: pip install mlflow")
 
 if MLFLOW_AVAILABLE:
+    from mlflow.entities import Metric, RunTag
+    from mlflow.tracking import MlflowClient
+    
     class MLflowDriftTracker:
         """
         Integration กับ MLflow สำหรับ track drift experiments
-        """
         
-        def __init__(self, experiment_name: str = "drift_monitoring"):
-            mlflow.set_experiment(experiment_name)
+        metrics ถูกเก็บใน buffer (พร้อม step และ timestamp) แล้วส่งด้วย MlflowClient.log_batch
+        จาก background thread เมื่อครบ flush_size หรือทุก flush_interval วินาที
+        -> log_drift_result ไม่ต้องรอ tracking server
+        
+        ถ้าส่งไม่สำเร็จ metrics จะกลับเข้า buffer แล้ว retry ด้วย exponential backoff
+        buffer มีขนาดไม่เกิน max_buffer (เกินแล้วทิ้งค่าที่เก่าที่สุด นับใน metrics_dropped)
+        
+        drift type ถูก log เป็น tag (ค่าล่าสุด) เพราะ MLflow param เปลี่ยนค่าภายหลังไม่ได้
+        """
+        MAX_BATCH_METRICS = 1000  # ขีดจำกัดของ log_batch ต่อ request
+        MAX_BATCH_TAGS = 100
+        
+        def __init__(self, experiment_name: str = "drift_monitoring", tracking_uri: Optional[str] = None,
+                     flush_size: int = 1000, flush_interval: float = 5.0, max_buffer: int = 100_000,
+                     backoff_seconds: float = 1.0, max_backoff_seconds: float = 60.0):
+            self.client = MlflowClient(tracking_uri)
+            experiment = self.client.get_experiment_by_name(experiment_name)
+            self.experiment_id = (experiment.experiment_id if experiment is not None
+                                  else self.client.create_experiment(experiment_name))
+            self.flush_size = min(flush_size, self.MAX_BATCH_METRICS)
+            self.flush_interval = flush_interval
+            self.max_buffer = max_buffer
+            self.backoff_seconds = backoff_seconds
+            self.max_backoff_seconds = max_backoff_seconds
+            
             self.active_run = None
+            self.metrics_logged = 0
+            self.metrics_dropped = 0
+            self.batches_sent = 0
+            self.failed_attempts = 0
+            self._steps: Dict[str, int] = {}
+            self._metrics: deque = deque()
+            self._tags: Dict[str, RunTag] = {}
+            self._in_flight = 0
+            self._flush_requested = False
+            self._stop = False
+            self._cond = threading.Condition()
+            self._thread: Optional[threading.Thread] = None
         
         def start_run(self, run_name: str = None):
-            """Start new MLflow run"""
-            self.active_run = mlflow.start_run(run_name=run_name)
+            """Start new MLflow run (และ background thread สำหรับส่ง metrics)"""
+            self.active_run = self.client.create_run(
+                self.experiment_id, tags={'mlflow.runName': run_name} if run_name else None
+            )
+            self._steps = {}
+            self._stop = False
+            self._thread = threading.Thread(target=self._run, name='mlflow-logger', daemon=True)
+            self._thread.start()
             return self.active_run
         
-        def log_drift_result(self, result: DriftResult):
-            """Log drift result to MLflow"""
+        def _enqueue(self, metrics: List['Metric'], tags: List['RunTag'] = ()):
+            with self._cond:
+                self._metrics.extend(metrics)
+                for tag in tags:
+                    self._tags[tag.key] = tag
+                overflow = len(self._metrics) - self.max_buffer
+                for _ in range(max(0, overflow)):
+                    self._metrics.popleft()
+                self.metrics_dropped += max(0, overflow)
+                if len(self._metrics) >= self.flush_size:
+                    self._cond.notify_all()
+        
+        def log_drift_result(self, result: DriftResult, step: Optional[int] = None):
+            """Log drift result to MLflow (ใส่ buffer แล้วคืนทันที)"""
             if self.active_run is None:
                 return
             
-            # Log metrics
-            mlflow.log_metric(f"{result.feature}_psi", result.psi)
-            mlflow.log_metric(f"{result.feature}_ks_stat", result.ks_statistic)
-            mlflow.log_metric(f"{result.feature}_drift", 1 if result.drift_detected else 0)
-            
-            # Log params
-            mlflow.log_param(f"{result.feature}_drift_type", result.drift_type.value)
+            if step is None:
+                step = self._steps.get(result.feature, 0)
+                self._steps[result.feature] = step + 1
+            timestamp = int(result.timestamp.timestamp() * 1000)
+            self._enqueue(
+                [
+                    Metric(f"{result.feature}_psi", float(result.psi), timestamp, step),
+                    # <feature>_ks_stat หรือ <feature>_chi2_stat (categorical) แยก series ตาม test
+                    Metric(f"{result.feature}_{result.test_name}_stat", float(result.ks_statistic), timestamp, step),
+                    Metric(f"{result.feature}_drift", 1.0 if result.drift_detected else 0.0, timestamp, step)
+                ],
+                [RunTag(f"{result.feature}_drift_type", result.drift_type.value)]
+            )
+        
+        def log_drift_results(self, results: List[DriftResult]):
+            for result in results:
+                self.log_drift_result(result)
         
         def log_summary(self, summary: Dict):
             """Log summary to MLflow"""
             if self.active_run is None:
                 return
             
-            mlflow.log_metric("total_drifts", summary.get('total_drifts_detected', 0))
-            mlflow.log_metric("total_checks", summary.get('total_checks', 0))
-            
+            timestamp = int(time.time() * 1000)
+            step = summary.get('total_checks', 0)
+            metrics = [
+                Metric("total_drifts", summary.get('total_drifts_detected', 0), timestamp, step),
+                Metric("total_checks", summary.get('total_checks', 0), timestamp, step)
+            ]
             for feature, data in summary.get('feature_summary', {}).items():
-                mlflow.log_metric(f"{feature}_drift_rate", data['drift_rate'])
+                metrics.append(Metric(f"{feature}_drift_rate", data['drift_rate'], timestamp, step))
+            self._enqueue(metrics)
         
         def log_artifact(self, artifact_path: str):
             """Log artifact to MLflow"""
             if self.active_run is None:
                 return
-            mlflow.log_artifact(artifact_path)
-        
-        def end_run(self):
-            """End MLflow run"""
-            if self.active_run:
-                mlflow.end_run()
-                self.active_run = None
+            self.client.log_artifact(self.active_run.info.run_id, artifact_path)
+        
+        def flush(self, timeout: Optional[float] = None) -> bool:
+            """รอจน metrics ใน buffer ถูกส่งหมด (False ถ้าครบ timeout ก่อน)"""
+            with self._cond:
+                self._flush_requested = True
+                self._cond.notify_all()
+                done = self._cond.wait_for(
+                    lambda: not self._metrics and not self._tags and self._in_flight == 0, timeout
+                )
+                self._flush_requested = False
+                return done
+        
+        def _run(self):
+            failures = 0
+            run_id = self.active_run.info.run_id
+            while True:
+                with self._cond:
+                    self._cond.wait_for(
+                        lambda: self._stop or self._flush_requested or len(self._metrics) >= self.flush_size,
+                        timeout=self.flush_interval
+                    )
+                    if self._stop and not (self._metrics or self._tags):
+                        return
+                    metrics = [self._metrics.popleft() for _ in range(min(len(self._metrics), self.flush_size))]
+                    tag_keys = list(self._tags)[:self.MAX_BATCH_TAGS]
+                    tags = [self._tags.pop(key) for key in tag_keys]
+                    self._in_flight = len(metrics) + len(tags)
+                    if not self._in_flight:
+                        continue
+                
+                try:
+                    self.client.log_batch(run_id, metrics=metrics, tags=tags)
+                except Exception as e:
+                    failures += 1
+                    self.failed_attempts += 1
+                    delay = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (failures - 1))
+                    logger.warning(f"MLflow log_batch failed ({e}); retrying in {delay:.1f}s")
+                    with self._cond:
+                        self._in_flight = 0
+                        self._cond.notify_all()
+                        if self._stop:
+                            self.metrics_dropped += len(metrics)
+                            return
+                        # ใส่กลับหน้า buffer ตามลำดับเดิม tag ที่ใหม่กว่า (ถ้ามี) ชนะ
+                        self._metrics.extendleft(reversed(metrics))
+                        for tag in tags:
+                            self._tags.setdefault(tag.key, tag)
+                        self._cond.wait_for(lambda: self._stop, timeout=delay)
+                    continue
+                
+                failures = 0
+                with self._cond:
+                    self.metrics_logged += len(metrics)
+                    self.batches_sent += 1
+                    self._in_flight = 0
+                    self._cond.notify_all()
+        
+        def end_run(self, timeout: Optional[float] = 30.0):
+            """ส่ง metrics ที่ค้างอยู่ (รอรวมไม่เกิน timeout) แล้ว end MLflow run"""
+            if not self.active_run:
+                return
+            deadline = None if timeout is None else time.monotonic() + timeout
+            if not self.flush(timeout):
+                logger.warning(f"MLflow flush timed out; {len(self._metrics)} metrics not logged")
+            with self._cond:
+                self._stop = True
+                self.metrics_dropped += len(self._metrics)
+                self._metrics.clear()
+                self._tags.clear()
+                self._cond.notify_all()
+            self._thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+            if self._thread.is_alive():
+                # log_batch ค้าง (เช่น network stall): ไม่รอต่อ thread เป็น daemon จึงไม่ค้าง process ตอนปิด
+                with self._cond:
+                    abandoned = self._in_flight
+                    self.metrics_dropped += abandoned
+                logger.warning(f"MLflow log_batch still running after {timeout}s; "
+                               f"abandoned {abandoned} in-flight metrics/tags")
+            self.client.set_terminated(self.active_run.info.run_id)
+            self.active_run = None
     
     # Example usage
     print("\n" + "=" * 60)
@@ -4425,6 +10180,86 @@ if MLFLOW_AVAILABLE:
     tracker.end_run()
     print("✅ Results logged to MLflow")
 
+# %% [markdown]
+# ### Batched MLflow Logging
+# เดิมทุก result เรียก `log_metric` 3 ครั้งและ `log_param` 1 ครั้ง (1 round trip ต่อครั้ง)
+# เทียบเวลาใน path ของ pipeline ระหว่างการ log ทีละค่ากับ MLflowDriftTracker ที่ buffer แล้วส่งด้วย `log_batch`
+# โดยใช้ SQLite tracking store ใน `monitoring_output/` และจำลอง tracking server ล่มช่วงสั้นๆ
+# ด้วย client ที่ `log_batch` ล้มเหลว 3 ครั้งแรก
+
+# %%
+if MLFLOW_AVAILABLE:
+    tracking_uri = f"sqlite:///{os.path.abspath('monitoring_output/mlflow.db')}"
+    
+    class FlakyMlflowClient:
+        """MlflowClient ที่ log_batch ล้มเหลว `failures` ครั้งแรก (จำลอง tracking server ล่ม)"""
+        
+        def __init__(self, client: 'MlflowClient', failures: int):
+            self.client = client
+            self.failures = failures
+        
+        def __getattr__(self, name):
+            return getattr(self.client, name)
+        
+        def log_batch(self, *args, **kwargs):
+            if self.failures > 0:
+                self.failures -= 1
+                raise ConnectionError("tracking server unavailable")
+            return self.client.log_batch(*args, **kwargs)
+    
+    def run_with_mlflow(log_results: Callable[[List[DriftResult]], None]) -> float:
+        """เวลาที่ pipeline ใช้ในการ log (วัดเฉพาะ log_results)"""
+        mlflow_pipeline = DriftMonitoringPipeline(MonitoringConfig(
+            features_to_monitor=['feature_a', 'feature_b', 'feature_c']
+        ))
+        mlflow_pipeline.initialize(reference_data)
+        logging_s = 0.0
+        for i in range(0, len(remaining_data), 50):
+            results = mlflow_pipeline.process_batch(remaining_data.iloc[i:i + 50])
+            start = time.perf_counter()
+            log_results(results)
+            logging_s += time.perf_counter() - start
+        mlflow_pipeline.close()
+        return logging_s
+    
+    # แบบเดิม: 1 request ต่อ metric/tag
+    direct_client = MlflowClient(tracking_uri)
+    experiment = direct_client.get_experiment_by_name("drift_monitoring_lab")
+    experiment_id = (experiment.experiment_id if experiment is not None
+                     else direct_client.create_experiment("drift_monitoring_lab"))
+    direct_run_id = direct_client.create_run(experiment_id, tags={'mlflow.runName': 'per_call'}).info.run_id
+    
+    def log_per_call(results: List[DriftResult]):
+        for r in results:
+            direct_client.log_metric(direct_run_id, f"{r.feature}_psi", r.psi)
+            direct_client.log_metric(direct_run_id, f"{r.feature}_{r.test_name}_stat", r.ks_statistic)
+            direct_client.log_metric(direct_run_id, f"{r.feature}_drift", 1 if r.drift_detected else 0)
+            direct_client.set_tag(direct_run_id, f"{r.feature}_drift_type", r.drift_type.value)
+    
+    per_call_s = run_with_mlflow(log_per_call)
+    direct_client.set_terminated(direct_run_id)
+    
+    # แบบ buffered + tracking server ล่ม 3 ครั้ง
+    batched_tracker = MLflowDriftTracker("drift_monitoring_lab", tracking_uri=tracking_uri,
+                                         flush_size=500, flush_interval=0.5, backoff_seconds=0.2)
+    batched_tracker.client = FlakyMlflowClient(batched_tracker.client, failures=3)
+    batched_run = batched_tracker.start_run(run_name="batched")
+    batched_s = run_with_mlflow(batched_tracker.log_drift_results)
+    
+    start = time.perf_counter()
+    batched_tracker.end_run()
+    drain_s = time.perf_counter() - start
+    
+    history = direct_client.get_metric_history(batched_run.info.run_id, 'feature_a_psi')
+    expected = len(direct_client.get_metric_history(direct_run_id, 'feature_a_psi'))
+    print(f"Per-call logging: {per_call_s:.2f}s in the pipeline loop")
+    print(f"Batched logging: {batched_s * 1000:.1f} ms in the pipeline loop, drain at end_run {drain_s:.2f}s")
+    print(f"  {batched_tracker.batches_sent} log_batch calls, {batched_tracker.failed_attempts} failed attempts, "
+          f"{batched_tracker.metrics_logged} metrics logged, {batched_tracker.metrics_dropped} dropped")
+    print(f"  feature_a_psi history: {len(history)} points (per-call run: {expected}), "
+          f"steps {[m.step for m in history[:5]]}...")
+    assert len(history) == expected and batched_tracker.metrics_dropped == 0
+
 # %% [markdown]
 # ## สรุป LAB 6
 #